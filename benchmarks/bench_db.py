@@ -0,0 +1,264 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+src_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, src_folder)
+
+# columns whose value only goes down as a player improves
+falling_columns = ("globalrank", "regionalrank", "competitiverank")
+# text columns, every other data column grows with the player's activity
+text_columns = ("kingdom", "datecreated")
+
+
+def generate_history(path, guilds, players, cadence_days, years, kingdoms, seed):
+    """
+    Writes a playerstats table with the upload history of `guilds` x `players` players over `years` years, in the
+    order the uploads happened. Every player joins at a random time, uploads about every `cadence_days` days and
+    grows at an own pace, so stats only ever increase (ranks only decrease).
+
+    :param path: Path of the database file.
+    :return: The number of records and a sample of (guild id, player name, upload date) for record lookups.
+    """
+    import db_related
+
+    conn = sqlite3.connect(path)
+    conn.execute(db_related.create_statdb_query)
+    columns = [column[1] for column in conn.execute("PRAGMA table_info(playerstats)")][5:]
+    columns.remove("kingdomid")
+    numeric_columns = [column for column in columns if column not in text_columns]
+    query = (f"INSERT INTO playerstats (guildid, discordid, timestamp, playername, {', '.join(columns)}) "
+             f"VALUES ({', '.join(['?'] * (len(columns) + 4))})")
+
+    rng = random.Random(seed)
+    end = datetime.utcnow()
+    start = end - timedelta(days=365 * years)
+    span_seconds = (end - start).total_seconds()
+
+    # every player is (next upload time, guild id, discord id, name, kingdom, growth per day, current values)
+    heap = []
+    for guild_id in range(1, guilds + 1):
+        for number in range(players):
+            joined = start + timedelta(seconds=rng.random() * span_seconds * 0.8)
+            growth = {column: rng.uniform(0.2, 3) * rng.choice((1, 10, 100)) for column in numeric_columns}
+            values = {column: rng.randint(1, 100) for column in numeric_columns}
+            for column in falling_columns:
+                values[column] = rng.randint(50_000, 500_000)
+            heap.append((joined, guild_id, guild_id * 100_000 + number, f"g{guild_id}player{number}",
+                         f"kingdom{rng.randrange(kingdoms)}", growth, values))
+    heapq.heapify(heap)
+
+    rows = 0
+    samples = []
+    batch = []
+    while heap:
+        uploaded, guild_id, discord_id, name, kingdom, growth, values = heapq.heappop(heap)
+        if uploaded > end:
+            continue
+        batch.append([guild_id, discord_id, uploaded.strftime('%Y-%m-%d %H:%M:%S'), name] +
+                     [kingdom if column == "kingdom" else "20210101" if column == "datecreated" else values[column]
+                      for column in columns])
+        rows += 1
+        if len(samples) < 1000:
+            samples.append((guild_id, name, uploaded.strftime('%Y-%m-%d')))
+        elif rng.random() < 1000 / rows:
+            samples[rng.randrange(1000)] = (guild_id, name, uploaded.strftime('%Y-%m-%d'))
+        days = rng.expovariate(1 / cadence_days)
+        for column in numeric_columns:
+            step = int(growth[column] * days * rng.uniform(0.5, 1.5))
+            values[column] = max(1, values[column] - step // 50) if column in falling_columns else values[column] + step
+        heapq.heappush(heap, (uploaded + timedelta(days=days), guild_id, discord_id, name, kingdom, growth, values))
+        if len(batch) == 10_000:
+            conn.executemany(query, batch)
+            batch = []
+    if batch:
+        conn.executemany(query, batch)
+    conn.commit()
+    conn.close()
+    return rows, samples
+
+
+async def measure(function, repeat, budget_seconds):
+    """
+    Awaits function() up to `repeat` times, stopping early once the time budget is used up.
+
+    :return: The durations in seconds.
+    """
+    durations = []
+    deadline = time.perf_counter() + budget_seconds
+    for _ in range(repeat):
+        st = time.perf_counter()
+        await function()
+        durations.append(time.perf_counter() - st)
+        if time.perf_counter() > deadline:
+            break
+    return durations
+
+
+def summarize(durations):
+    ordered = sorted(durations)
+    return {'runs': len(ordered), 'median_ms': statistics.median(ordered) * 1000,
+            'p95_ms': ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)] * 1000,
+            'min_ms': ordered[0] * 1000, 'mean_ms': statistics.fmean(ordered) * 1000}
+
+
+def benchmark_cases(db_related, args, samples, rng):
+    """
+    Returns (name, function) pairs; every call of a function runs the measured query once with fresh arguments.
+    """
+    category = args.category
+    now = datetime.utcnow()
+    frames = {"day": (now.year, now.month, now.day, None), "week": (now.year, None, None, now.isocalendar()[1]),
+              "month": (now.year, now.month, None, None), "year": (now.year, None, None, None)}
+    kingdom = f"kingdom{rng.randrange(args.kingdoms)}"
+    cases = []
+
+    def guild():
+        return rng.randint(1, args.guilds)
+
+    for scope_name, scope, with_kingdom in (("guild", False, False), ("guild_kingdom", False, True),
+                                            ("global", True, False), ("global_kingdom", True, True)):
+        def scoreboard(scope=scope, with_kingdom=with_kingdom):
+            return db_related.get_scoreboard(guild(), category, scope, False, 10, kingdom if with_kingdom else None)
+
+        def scoreboard_page(scope=scope, with_kingdom=with_kingdom):
+            return db_related.get_scoreboard_page(guild(), category, scope, False, 10,
+                                                  kingdom if with_kingdom else None)
+
+        cases.append((f"get_scoreboard/{scope_name}", scoreboard))
+        cases.append((f"get_scoreboard_page/{scope_name}", scoreboard_page))
+        for period, frame in frames.items():
+            def changes(scope=scope, with_kingdom=with_kingdom, frame=frame):
+                return db_related.calculate_changes(guild(), category, scope, *frame,
+                                                    kingdom if with_kingdom else None)
+
+            cases.append((f"calculate_changes/{period}/{scope_name}", changes))
+
+    def latest_record():
+        guild_id, name, _ = rng.choice(samples)
+        return db_related.get_latest_record(guild_id, name)
+
+    def specific_record():
+        guild_id, name, day = rng.choice(samples)
+        year, month, day = map(int, day.split('-'))
+        return db_related.fetch_specific_record(guild_id, name, year, month, day, rng.choice(("first", "second")))
+
+    async def upload():
+        guild_id, name, _ = rng.choice(samples)
+        latest = await db_related.get_latest_record(guild_id, name)
+        stats = dict(zip(db_related.get_column_names(), latest))
+        for column in (category, "level", "monstersslain"):
+            stats[column] = (stats[column] or 0) + rng.randint(1, 50)
+        stats.update(playername=name, guildid=guild_id, discordid=guild_id * 100_000)
+        await db_related.check_and_update_record(stats, guild_id, name)
+
+    cases.append(("get_latest_record", latest_record))
+    cases.append(("fetch_specific_record", specific_record))
+    cases.append(("check_and_update_record", upload))
+    return cases
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=src_folder, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_path):
+    with open(previous_path, encoding="utf-8") as file:
+        previous = json.load(file)['results']
+    print(f"\n{'case':<44} {'before ms':>10} {'after ms':>10} {'ratio':>7}")
+    for name, result in results.items():
+        if name in previous:
+            before, after = previous[name]['median_ms'], result['median_ms']
+            print(f"{name:<44} {before:>10.2f} {after:>10.2f} {after / before if before else math.inf:>6.2f}x")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Times the queries of db_related on a generated multi-guild history")
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--players", type=int, default=200, help="players per guild")
+    parser.add_argument("--cadence", type=float, default=3, help="average days between the uploads of a player")
+    parser.add_argument("--years", type=float, default=2, help="years of history")
+    parser.add_argument("--kingdoms", type=int, default=40)
+    parser.add_argument("--category", default="bossesslain", help="the category the scoreboards rank by")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per case")
+    parser.add_argument("--budget", type=float, default=10, help="seconds after which a case stops repeating")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", help="keep the generated database at this path, or reuse it if it exists")
+    parser.add_argument("--output", help="JSON file for the results, defaults to benchmarks/results/")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="kari-bench-db-")
+    database = os.path.abspath(args.database) if args.database else os.path.join(folder, "playerstats.db")
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         f"bench_db-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    # the database paths are read when db_related is imported
+    os.environ.update(STAT_DB_PATH=database, LANG_DB_PATH=os.path.join(folder, "langprefs.db"))
+    import db_related
+
+    if not os.path.exists(database):
+        st = time.perf_counter()
+        rows, samples = generate_history(database, args.guilds, args.players, args.cadence, args.years,
+                                         args.kingdoms, args.seed)
+        print(f"generated {rows} records in {time.perf_counter() - st:.1f}s")
+    else:
+        with sqlite3.connect(database) as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM playerstats").fetchone()[0]
+            samples = conn.execute("SELECT guildid, playername, date(timestamp) FROM playerstats "
+                                   "ORDER BY random() LIMIT 1000").fetchall()
+        print(f"reusing {rows} records of {database}")
+
+    st = time.perf_counter()
+    await db_related.setup_db()
+    setup_seconds = time.perf_counter() - st
+    print(f"setup_db: {setup_seconds:.1f}s")
+
+    rng = random.Random(args.seed)
+    results = dict()
+    try:
+        for name, function in benchmark_cases(db_related, args, samples, rng):
+            results[name] = summarize(await measure(function, args.repeat, args.budget))
+            print(f"{name:<44} median {results[name]['median_ms']:>9.2f} ms  p95 {results[name]['p95_ms']:>9.2f} ms"
+                  f"  ({results[name]['runs']} runs)")
+    finally:
+        await db_related.close_db()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({'created_at': datetime.utcnow().isoformat(timespec='seconds'), 'commit': git_commit(),
+                   'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                   'parameters': vars(args), 'records': rows, 'setup_db_seconds': setup_seconds,
+                   'results': results}, file, indent=2)
+    print(f"results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
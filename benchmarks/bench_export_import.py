@@ -0,0 +1,86 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import db_related  # noqa: E402
+from export_related import export_guild, import_guild  # noqa: E402
+from lang_db_connection import LangDBConnection  # noqa: E402
+from stat_db_connection import StatDBConnection  # noqa: E402
+
+
+def create_fixture(path, rows, guild_id):
+    """
+    Creates a player stats database with `rows` records of a single guild.
+
+    :param path: Path of the database file.
+    :param rows: The number of records to generate.
+    :param guild_id: The guild the records belong to.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute(db_related.create_statdb_query)
+    columns = [column[1] for column in conn.execute("PRAGMA table_info(playerstats)")][5:]
+    numeric_columns = [column for column in columns if column not in ("kingdom", "datecreated")]
+    quoted_columns = ', '.join(['guildid', 'discordid', 'playername'] + columns)
+    placeholders = ', '.join(['?'] * (len(columns) + 3))
+    query = f"INSERT INTO playerstats ({quoted_columns}) VALUES ({placeholders})"
+
+    rng = random.Random(0)
+    batch = []
+    for i in range(rows):
+        record = {column: rng.randint(0, 99999) for column in numeric_columns}
+        record['kingdom'] = f"kingdom{i % 50}"
+        record['datecreated'] = "2021-01-01"
+        batch.append([guild_id, i % 5000, f"player{i % 5000}"] + [record[column] for column in columns])
+        if len(batch) == 10000:
+            conn.executemany(query, batch)
+            batch = []
+    if batch:
+        conn.executemany(query, batch)
+    conn.commit()
+    conn.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measures export and import throughput")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        StatDBConnection.path = os.path.join(folder, "playerstats.db")
+        LangDBConnection.path = os.path.join(folder, "langprefs.db")
+        create_fixture(StatDBConnection.path, args.rows, 1)
+        await db_related.setup_db()
+
+        for export_format in ("csv", "jsonl"):
+            st = time.perf_counter()
+            paths, row_count = await export_guild(1, os.path.join(folder, export_format), export_format)
+            elapsed = time.perf_counter() - st
+            size = sum(os.path.getsize(path) for path in paths)
+            print(f"export {export_format}: {row_count} rows in {elapsed:.2f}s ({row_count / elapsed:.0f} rows/s), "
+                  f"{len(paths)} parts, {size / 1024 / 1024:.1f} MiB")
+
+            st = time.perf_counter()
+            imported = await import_guild(2, paths)
+            elapsed = time.perf_counter() - st
+            print(f"import {export_format}: {imported} rows in {elapsed:.2f}s ({imported / elapsed:.0f} rows/s)")
+
+        await db_related.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
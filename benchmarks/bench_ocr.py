@@ -0,0 +1,178 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from ocr_corpus import default_corpus, load_translations, stat_columns
+
+stages = ("decode", "ocr", "parse", "total")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+
+async def read_image(ocr_related, image_data, language_file):
+    """
+    Runs one image through the upload pipeline: decoding, preprocessing and Tesseract, parsing and sanitizing.
+
+    :return: The recognized stats and the seconds spent per stage.
+    """
+    timings = dict()
+    st = time.perf_counter()
+    img = await asyncio.get_running_loop().run_in_executor(ocr_related.executor, ocr_related.decode_image, image_data)
+    timings['decode'] = time.perf_counter() - st
+    img_text = await ocr_related.ocr_processing_async(img, language_file)
+    timings['ocr'] = time.perf_counter() - st - timings['decode']
+    parse_start = time.perf_counter()
+    playerstats, _ = await ocr_related.process_text_tess(img_text.strip().split("\n"), language_file)
+    playerstats = ocr_related.sanitize_ocr_results(playerstats)
+    timings['parse'] = time.perf_counter() - parse_start
+    timings['total'] = time.perf_counter() - st
+    return playerstats, timings
+
+
+async def run(args, entries, translations):
+    import ocr_related
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def benchmark(entry):
+        with open(os.path.join(args.corpus, entry['file']), "rb") as file:
+            image_data = file.read()
+        async with semaphore:
+            try:
+                recognized, timings = await read_image(ocr_related, image_data, translations[entry['language']])
+            except Exception as e:
+                print(f"{entry['file']} failed: {type(e).__name__}: {e}", file=sys.stderr)
+                recognized, timings = dict(), None
+        results.append((entry, recognized, timings))
+
+    st = time.perf_counter()
+    await asyncio.gather(*(benchmark(entry) for entry in entries))
+    return results, time.perf_counter() - st
+
+
+def score(results, columns):
+    """
+    Compares the recognized stats to the ground truth.
+
+    :return: A dictionary of the field accuracy per column and per language, width and quality, the share of images
+             read without any mistake, and the mistakes.
+    """
+    fields = defaultdict(lambda: [0, 0])  # column -> [correct, total]
+    groups = defaultdict(lambda: [0, 0])  # (dimension, value) -> [correct, total] over every field
+    perfect = 0
+    mistakes = []
+    for entry, recognized, _ in results:
+        wrong = 0
+        for column in columns:
+            expected = entry['fields'][column]
+            correct = recognized.get(column) == expected
+            wrong += not correct
+            fields[column][0] += correct
+            fields[column][1] += 1
+            for dimension in ("language", "width", "quality"):
+                groups[(dimension, entry[dimension])][0] += correct
+                groups[(dimension, entry[dimension])][1] += 1
+            if not correct:
+                mistakes.append({'file': entry['file'], 'column': column, 'expected': expected,
+                                 'recognized': recognized.get(column)})
+        perfect += wrong == 0
+
+    by_dimension = defaultdict(dict)
+    for (dimension, value), (correct, total) in sorted(groups.items()):
+        by_dimension[dimension][str(value)] = correct / total
+    correct_fields = sum(correct for correct, _ in fields.values())
+    total_fields = sum(total for _, total in fields.values())
+    return {'field_accuracy': correct_fields / total_fields if total_fields else 0,
+            'perfect_images': perfect / len(results) if results else 0,
+            'columns': {column: correct / total for column, (correct, total) in fields.items()},
+            **by_dimension, 'mistakes': mistakes}
+
+
+def latency_report(results, elapsed):
+    report = {'images': len(results), 'failed': sum(1 for _, _, timings in results if timings is None),
+              'seconds': elapsed, 'images_per_second': len(results) / elapsed if elapsed else 0}
+    for stage in stages:
+        values = [timings[stage] for _, _, timings in results if timings is not None]
+        if values:
+            report[stage] = {'p50_ms': percentile(values, 0.5) * 1000, 'p95_ms': percentile(values, 0.95) * 1000,
+                             'max_ms': max(values) * 1000}
+    return report
+
+
+def print_report(accuracy, latency):
+    print(f"{'column':<22} {'accuracy':>8}")
+    for column, value in accuracy['columns'].items():
+        print(f"{column:<22} {value:>8.1%}")
+    for dimension in ("language", "width", "quality"):
+        print(f"\nby {dimension}: " + ", ".join(f"{value}: {share:.1%}"
+                                                for value, share in accuracy.get(dimension, {}).items()))
+    print(f"\nfield accuracy {accuracy['field_accuracy']:.2%}, images without mistakes "
+          f"{accuracy['perfect_images']:.1%}")
+    print(f"\n{'stage':<8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for stage in stages:
+        if stage in latency:
+            print(f"{stage:<8} {latency[stage]['p50_ms']:>9.1f} {latency[stage]['p95_ms']:>9.1f} "
+                  f"{latency[stage]['max_ms']:>9.1f}")
+    print(f"{latency['images']} images ({latency['failed']} failed) in {latency['seconds']:.1f}s, "
+          f"{latency['images_per_second']:.2f} images per second")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Reads the screenshots of an ocr_corpus.py corpus with the upload "
+                                                 "pipeline and reports the accuracy per field and the latency")
+    parser.add_argument("--corpus", default=default_corpus, help="folder written by ocr_corpus.py")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count(), help="images read at once")
+    parser.add_argument("--limit", type=int, help="only read the first images of the corpus")
+    parser.add_argument("--tesseract", help="Tesseract executable, if it is not on the PATH")
+    parser.add_argument("--json", help="also write the results, including every mistake, to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the text Tesseract read")
+    args = parser.parse_args()
+    args.corpus = os.path.abspath(args.corpus)
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    with open(os.path.join(args.corpus, "truth.jsonl"), encoding="utf-8") as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    entries = entries[:args.limit] if args.limit else entries
+
+    import category_related
+    import ocr_related
+
+    if args.tesseract:
+        ocr_related.pytesseract.tesseract_cmd = args.tesseract
+    ocr_related.debug_text = args.verbose
+    translations = load_translations()
+    columns = stat_columns()
+    category_related.load(translations, columns)
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)  # the preprocessing saves the last image to the working directory
+        results, elapsed = await run(args, entries, translations)
+
+    accuracy = score(results, columns)
+    latency = latency_report(results, elapsed)
+    print_report(accuracy, latency)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as file:
+            json.dump({'accuracy': accuracy, 'latency': latency}, file, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from bench_export_import import create_fixture  # noqa: E402
+from fake_gateway import api_url, src_folder, start_fake_discord  # noqa: E402
+
+import_probe = """
+import sys, time
+st = time.perf_counter()
+import kari
+print(time.perf_counter() - st, ','.join(m for m in ('ocr_related', 'PIL', 'pytesseract', 'numpy') if m in sys.modules))
+"""
+
+
+def measure_import(env, repeat):
+    """
+    Imports kari in fresh interpreters.
+
+    :return: The import times in seconds and the OCR modules that were loaded by the import.
+    """
+    times = []
+    loaded = ""
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", import_probe], cwd=src_folder, env=env, check=True,
+                                capture_output=True, text=True).stdout.split()
+        times.append(float(output[0]))
+        loaded = output[1] if len(output) > 1 else ""
+    return times, loaded
+
+
+async def wait_for_line(process, text, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        line = await asyncio.wait_for(process.stdout.readline(), max(0.1, deadline - time.monotonic()))
+        if not line:
+            raise RuntimeError("The bot exited")
+        if text in line.decode(errors="replace"):
+            return time.perf_counter()
+
+
+async def measure_run(fake, env, reconnects, timeout):
+    """
+    Starts the bot against the fake gateway and reconnects it a few times.
+
+    :return: Seconds until the gateway was identified, until on_ready, and for every reconnect the seconds from the
+             closed connection to the next identify and to the next on_ready.
+    """
+    identified = len(fake.identify_times)
+    st = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, "-u", "kari.py", cwd=src_folder, env=env,
+                                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        ready = await wait_for_line(process, "Logged in as", timeout) - st
+        identify = fake.identify_times[identified] - st
+        reconnect_times = []
+        for _ in range(reconnects):
+            identified = len(fake.identify_times)
+            closed = time.perf_counter()
+            await fake.close_shard(0)
+            ready_again = await wait_for_line(process, "Logged in as", timeout)
+            reconnect_times.append((fake.identify_times[identified] - closed, ready_again - closed))
+        return identify, ready, reconnect_times
+    finally:
+        process.send_signal(signal.SIGTERM)
+        await process.wait()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measures import time, time to ready and reconnect cost of the bot")
+    parser.add_argument("--rows", type=int, default=100_000, help="records in the fixture database")
+    parser.add_argument("--repeat", type=int, default=5, help="number of measured imports")
+    parser.add_argument("--reconnects", type=int, default=3, help="number of measured reconnects")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the bot")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        fake, runner = await start_fake_discord(1, 10)
+        env = dict(os.environ, TOKEN="fake-token", DISCORD_API_URL=api_url(fake),
+                   STAT_DB_PATH=os.path.join(folder, "playerstats.db"),
+                   LANG_DB_PATH=os.path.join(folder, "langprefs.db"), BACKUP_DIR=os.path.join(folder, "backups"))
+        try:
+            times, loaded = measure_import(env, args.repeat)
+            print(f"import kari: median {statistics.median(times) * 1000:.0f} ms, min {min(times) * 1000:.0f} ms, "
+                  f"OCR modules loaded: {loaded or 'none'}")
+
+            create_fixture(env['STAT_DB_PATH'], args.rows, 1)
+            for run in ("first start", "second start"):
+                # the first start builds the derived tables of the fixture, the second one finds them in place
+                identify, ready, reconnect_times = await measure_run(fake, env, args.reconnects, args.timeout)
+                print(f"{run} ({args.rows} records): identified after {identify:.2f}s, ready after {ready:.2f}s")
+            if reconnect_times:
+                # py-cord waits for more guilds for a while after READY, that delay is included in every ready time
+                print(f"reconnect: identified again after "
+                      f"{statistics.median(identify for identify, _ in reconnect_times) * 1000:.0f} ms, ready after "
+                      f"{statistics.median(ready for _, ready in reconnect_times) * 1000:.0f} ms (medians)")
+        finally:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
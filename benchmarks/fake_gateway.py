@@ -0,0 +1,284 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+src_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+locales_folder = os.path.join(src_folder, "..", "locales")
+api_version = 10
+bot_user = {'id': '100000000000000001', 'username': 'Kari', 'discriminator': '0000', 'global_name': None,
+            'avatar': None, 'bot': True}
+test_user = {'id': '100000000000000002', 'username': 'tester', 'discriminator': '0000', 'global_name': None,
+             'avatar': None}
+snowflakes = itertools.count(200000000000000000)
+
+
+def json_response(data):
+    # py-cord only decodes bodies whose content type is exactly application/json, without a charset
+    return web.Response(body=json.dumps(data).encode(), content_type="application/json")
+
+
+class FakeDiscord:
+    """
+    A local stand-in for the Discord REST API and gateway, just enough for py-cord to log in, connect its shards,
+    sync the slash commands and answer interactions.
+
+    Attributes:
+        shard_count (int): The number of shards the bot is told to use.
+        guild_ids (list): The ids of the guilds the bot is in.
+        shards (dict): Shard id -> the websocket of the connected shard.
+        identify_counts (dict): Shard id -> the number of times the shard identified.
+        identify_times (list): The time.perf_counter() of every identify.
+        commands (dict): Command name -> registered command.
+        responses (dict): Interaction token -> queue of the response and followup payloads.
+    """
+
+    def __init__(self, shard_count, guild_count):
+        self.shard_count = shard_count
+        self.guild_ids = [(next(snowflakes) << 22) + i for i in range(guild_count)]
+        self.shards = dict()
+        self.identify_counts = dict()
+        self.identify_times = []
+        self.commands = dict()
+        self.responses = dict()
+        self.url = None
+
+    def shard_of(self, guild_id):
+        return (guild_id >> 22) % self.shard_count
+
+    def create_app(self):
+        app = web.Application()
+        api = f"/api/v{api_version}"
+        app.router.add_get(f"{api}/users/@me", lambda request: json_response(bot_user))
+        app.router.add_get(f"{api}/gateway", lambda request: json_response({'url': self.gateway_url()}))
+        app.router.add_get(f"{api}/gateway/bot", self.gateway_bot)
+        app.router.add_get(f"{api}/applications/{{application}}/commands", self.get_commands)
+        app.router.add_put(f"{api}/applications/{{application}}/commands", self.put_commands)
+        app.router.add_post(f"{api}/applications/{{application}}/commands", self.post_command)
+        app.router.add_post(f"{api}/interactions/{{id}}/{{token}}/callback", self.interaction_callback)
+        app.router.add_post(f"{api}/webhooks/{{application}}/{{token}}", self.followup)
+        app.router.add_get(f"{api}/soundboard-default-sounds", lambda request: json_response([]))
+        app.router.add_get("/gateway", self.gateway)
+        app.router.add_route("*", "/{tail:.*}", self.fallback)
+        return app
+
+    def gateway_url(self):
+        return self.url.replace("http://", "ws://") + "/gateway"
+
+    async def gateway_bot(self, request):
+        return json_response({'url': self.gateway_url(), 'shards': self.shard_count,
+                                  'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0,
+                                                          'max_concurrency': 16}})
+
+    async def get_commands(self, request):
+        return json_response(list(self.commands.values()))
+
+    def register_command(self, command):
+        command = dict(command, id=str(next(snowflakes)), application_id=bot_user['id'], version='1',
+                       type=command.get('type', 1))
+        self.commands[command['name']] = command
+        return command
+
+    async def put_commands(self, request):
+        self.commands.clear()
+        return json_response([self.register_command(command) for command in await request.json()])
+
+    async def post_command(self, request):
+        return json_response(self.register_command(await request.json()))
+
+    async def interaction_callback(self, request):
+        payload = await self.read_payload(request)
+        self.responses.setdefault(request.match_info['token'], asyncio.Queue()).put_nowait(payload)
+        return json_response({'interaction': {'id': request.match_info['id'], 'type': 2,
+                                              'activity_instance_id': None, 'response_message_id': None,
+                                              'response_message_loading': payload.get('type') == 5,
+                                              'response_message_ephemeral': False}})
+
+    async def followup(self, request):
+        payload = await self.read_payload(request)
+        self.responses.setdefault(request.match_info['token'], asyncio.Queue()).put_nowait({'type': 'followup',
+                                                                                            'data': payload})
+        message = {'id': str(next(snowflakes)), 'channel_id': '1', 'author': bot_user, 'content': '',
+                   'timestamp': '2024-01-01T00:00:00+00:00', 'edited_timestamp': None, 'tts': False,
+                   'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [],
+                   'embeds': [], 'pinned': False, 'type': 0}
+        message.update({key: value for key, value in payload.items() if key in ('content', 'embeds')})
+        return json_response(message)
+
+    @staticmethod
+    async def read_payload(request):
+        if request.content_type == "application/json":
+            return await request.json()
+        # py-cord sends forms, url encoded when there are no files
+        form = await request.post()
+        return json.loads(form.get("payload_json") or "{}")
+
+    async def fallback(self, request):
+        print(f"Fake Discord: unhandled {request.method} {request.path}")
+        return json_response({})
+
+    def guild_payload(self, guild_id):
+        return {'id': str(guild_id), 'name': f"Guild {guild_id & 0xfff}", 'icon': None, 'owner_id': test_user['id'],
+                'unavailable': False, 'member_count': 1, 'channels': [], 'members': [], 'features': [],
+                'emojis': [], 'stickers': [], 'voice_states': [], 'threads': [], 'stage_instances': [],
+                'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0,
+                           'color': 0, 'colors': {'primary_color': 0, 'secondary_color': None, 'tertiary_color': None},
+                           'hoist': False, 'managed': False, 'mentionable': False}]}
+
+    async def gateway(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({'op': 10, 'd': {'heartbeat_interval': 41250}})
+        shard_id = None
+        sequence = itertools.count(1)
+        async for message in ws:
+            payload = json.loads(message.data)
+            if payload['op'] == 1:
+                await ws.send_json({'op': 11})
+            elif payload['op'] == 6:
+                await ws.send_json({'op': 9, 'd': False})  # sessions cannot be resumed, the shard identifies again
+            elif payload['op'] == 2:
+                shard_id, _ = payload['d'].get('shard', (0, 1))
+                self.identify_counts[shard_id] = self.identify_counts.get(shard_id, 0) + 1
+                self.identify_times.append(time.perf_counter())
+                self.shards[shard_id] = ws
+                guild_ids = [guild_id for guild_id in self.guild_ids if self.shard_of(guild_id) == shard_id]
+                await ws.send_json({'op': 0, 's': next(sequence), 't': 'READY', 'd': {
+                    'v': api_version, 'user': bot_user, 'session_id': f"session-{shard_id}",
+                    'resume_gateway_url': self.gateway_url(), 'shard': [shard_id, self.shard_count],
+                    'application': {'id': bot_user['id'], 'flags': 0},
+                    'guilds': [{'id': str(guild_id), 'unavailable': True} for guild_id in guild_ids]}})
+                for guild_id in guild_ids:
+                    await ws.send_json({'op': 0, 's': next(sequence), 't': 'GUILD_CREATE',
+                                        'd': self.guild_payload(guild_id)})
+        if shard_id is not None and self.shards.get(shard_id) is ws:
+            del self.shards[shard_id]
+        return ws
+
+    async def close_shard(self, shard_id):
+        """
+        Closes the connection of a shard like a gateway restart does, so the bot has to reconnect.
+        """
+        await self.shards.pop(shard_id).close(code=4000)
+
+    async def interact(self, guild_id, name, options=None, timeout=30):
+        """
+        Sends a slash command interaction to the shard of a guild and waits for the bot's answer.
+
+        :return: The content of the first followup or direct response, and the embeds.
+        """
+        token = f"token-{next(snowflakes)}"
+        queue = self.responses.setdefault(token, asyncio.Queue())
+        command = self.commands[name]
+        await self.shards[self.shard_of(guild_id)].send_json({'op': 0, 's': None, 't': 'INTERACTION_CREATE', 'd': {
+            'id': str(next(snowflakes)), 'application_id': bot_user['id'], 'type': 2, 'token': token, 'version': 1,
+            'guild_id': str(guild_id), 'channel_id': str(guild_id), 'locale': 'en-US', 'guild_locale': 'en-US',
+            'member': {'user': test_user, 'roles': [], 'joined_at': '2024-01-01T00:00:00+00:00',
+                       'permissions': '8', 'deaf': False, 'mute': False},
+            'data': {'id': command['id'], 'name': name, 'type': 1, 'options': options or []}}})
+        while True:
+            payload = await asyncio.wait_for(queue.get(), timeout)
+            if payload.get('type') == 5:
+                continue  # deferred, the answer follows
+            data = payload.get('data') or {}
+            return data.get('content'), data.get('embeds') or []
+
+
+async def wait_until(condition, timeout, message):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError(message)
+        await asyncio.sleep(0.2)
+
+
+async def start_fake_discord(shard_count, guild_count):
+    """
+    Starts a FakeDiscord on a free local port.
+
+    :return: The FakeDiscord and its aiohttp runner, to be cleaned up by the caller.
+    """
+    fake = FakeDiscord(shard_count, guild_count)
+    runner = web.AppRunner(fake.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    fake.url = f"http://127.0.0.1:{port}"
+    return fake, runner
+
+
+def api_url(fake):
+    return f"{fake.url}/api/v{{API_VERSION}}"
+
+
+async def run(args):
+    fake, runner = await start_fake_discord(args.shards, args.guilds)
+
+    folder = tempfile.mkdtemp(prefix="kari-cluster-")
+    env = dict(os.environ, TOKEN="fake-token", DISCORD_API_URL=api_url(fake),
+               CLUSTER_PROCESSES=str(args.processes), SHARD_COUNT=str(args.shards),
+               WRITER_ADDRESS=f"unix:{os.path.join(folder, 'writer.sock')}",
+               STAT_DB_PATH=os.path.join(folder, "playerstats.db"), LANG_DB_PATH=os.path.join(folder, "langprefs.db"),
+               BACKUP_DIR=os.path.join(folder, "backups"))
+    st = time.perf_counter()
+    cluster = await asyncio.create_subprocess_exec(sys.executable, "cluster_related.py", cwd=src_folder, env=env)
+    try:
+        await wait_until(lambda: len(fake.shards) == args.shards and fake.commands, args.timeout,
+                         "not every shard connected")
+        print(f"{args.shards} shards connected in {time.perf_counter() - st:.1f} seconds")
+
+        with open(os.path.join(locales_folder, "de.json"), encoding="utf-8") as f:
+            german = json.load(f)
+        # the language is written by the process owning the first guild's shard and read by another process
+        first_guild = fake.guild_ids[0]
+        other_guild = next((guild_id for guild_id in fake.guild_ids
+                            if fake.shard_of(guild_id) * args.processes // args.shards
+                            != fake.shard_of(first_guild) * args.processes // args.shards), first_guild)
+        content, _ = await fake.interact(first_guild, "set_language", [{'name': 'language', 'type': 3, 'value': 'de'}])
+        assert content == german["languageupdated"], content
+        _, embeds = await fake.interact(other_guild, "help")
+        assert embeds and embeds[0]['title'] == german["help"], embeds
+        print(f"Write on shard {fake.shard_of(first_guild)} was read on shard {fake.shard_of(other_guild)}")
+
+        latencies = []
+        for i in range(args.interactions):
+            guild_id = fake.guild_ids[i % len(fake.guild_ids)]
+            interaction_st = time.perf_counter()
+            await fake.interact(guild_id, "set_language", [{'name': 'language', 'type': 3, 'value': 'en'}])
+            latencies.append(time.perf_counter() - interaction_st)
+        if latencies:
+            latencies.sort()
+            print(f"{len(latencies)} writes through the writer service: "
+                  f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+        reconnects = {shard_id: count for shard_id, count in fake.identify_counts.items() if count > 1}
+        print(f"Shards that identified more than once: {reconnects or 'none'}")
+    finally:
+        cluster.send_signal(signal.SIGTERM)
+        await cluster.wait()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the bot in cluster mode against a local fake Discord gateway.")
+    parser.add_argument("--shards", type=int, default=4, help="number of shards")
+    parser.add_argument("--processes", type=int, default=2, help="number of bot processes")
+    parser.add_argument("--guilds", type=int, default=40, help="number of guilds spread over the shards")
+    parser.add_argument("--interactions", type=int, default=50, help="number of timed write interactions")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the cluster")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,270 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import stat
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+src_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, src_folder)
+
+from aiohttp import web  # noqa: E402
+
+guild_id = 1
+# columns shown on the generated screenshots, with the value range of the random stats
+screenshot_columns = {"level": 500, "monstersslain": 100000, "bossesslain": 5000, "dungeonscleared": 3000,
+                      "questscompleted": 2000, "fishcaught": 10000}
+error_keys = ("errorimageprocess", "uploadexpired", "invalidimage", "uploadthrottled")
+
+# stands in for Tesseract when it is not installed: burns the CPU time of a real run and prints stat lines
+fake_tesseract_source = """#!{python}
+import random, sys, time
+sys.stdin.buffer.read()
+end = time.process_time() + {seconds}
+while time.process_time() < end:
+    pass
+for label, top in {labels}:
+    print(f"{{label}}    {{random.randint(1, top)}}")
+"""
+
+
+class FakeFollowup:
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    async def send(self, content=None, **kwargs):
+        self.ctx.messages.append(content)
+
+
+class FakeContext:
+    """
+    The parts of a py-cord ApplicationContext the command handlers use. Responses are collected instead of sent.
+    """
+
+    def __init__(self, bot, command, user_id):
+        self.bot = bot
+        self.command = command
+        self.author = FakeObject(id=user_id)
+        self.guild = FakeObject(id=guild_id)
+        self.channel = FakeObject(id=guild_id)
+        self.interaction = FakeObject(created_at=datetime.now(timezone.utc), guild_id=guild_id)
+        self.followup = FakeFollowup(self)
+        self.messages = []
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def respond(self, content=None, **kwargs):
+        self.messages.append(content)
+
+
+class FakeObject:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+def render_screenshot(labels, rng):
+    """
+    Draws a stats screenshot like the game's profile page, light text on a dark background.
+
+    :return: The PNG bytes.
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    try:
+        font = ImageFont.load_default(size=28)
+    except TypeError:
+        font = ImageFont.load_default()  # Pillow before 10.1 only has a small bitmap font
+    img = Image.new("RGB", (900, 80 + 50 * len(labels)), (28, 30, 38))
+    draw = ImageDraw.Draw(img)
+    for i, (label, top) in enumerate(labels):
+        draw.text((40, 40 + 50 * i), label, fill=(230, 230, 230), font=font)
+        draw.text((600, 40 + 50 * i), str(rng.randint(1, top)), fill=(230, 230, 230), font=font)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def start_cdn(images, latency):
+    """
+    Serves the screenshots like Discord's attachment CDN, with an optional delay per request.
+
+    :return: The base URL and the aiohttp runner.
+    """
+    async def attachment(request):
+        if latency:
+            await asyncio.sleep(latency)
+        return web.Response(body=images[int(request.match_info['n']) % len(images)], content_type="image/png")
+
+    app = web.Application()
+    app.router.add_get("/attachments/{n}.png", attachment)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}", runner
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def parse_mix(value):
+    mix = dict()
+    for item in value.split(','):
+        name, weight = item.split('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+async def run_load(args, kari, cdn_url):
+    rng = random.Random(args.seed)
+    en = kari.translation_cache['en']
+    error_messages = {en.get(key) for key in error_keys}
+    correction_columns = list(screenshot_columns)
+
+    def make_request(user_id):
+        # (command, arguments) per kind of the mix
+        kind = rng.choices(list(args.mix), weights=list(args.mix.values()))[0]
+        player = user_id % args.players
+        if kind == "upload":
+            image = FakeObject(url=f"{cdn_url}/attachments/{rng.randrange(1000)}.png", content_type="image/png")
+            return kari.upload_stats, (f"player{player}", image, None)
+        if kind == "correct":
+            column = rng.choice(correction_columns)
+            return kari.correct_latest, (en.get(column), str(rng.randint(1, screenshot_columns[column])))
+        if kind == "scoreboard":
+            return kari.scoreboard, (rng.choice(correction_columns), None, rng.choice(["This Server", "All Servers"]),
+                                     10)
+        if kind == "week_scoreboard":
+            return kari.weekly_scoreboard, (rng.choice(correction_columns), None, "This Server", None, None, 10)
+        raise ValueError(f"Unknown request kind {kind}")
+
+    results = dict()  # command -> [latencies, errors]
+    queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(None)
+
+    async def user(user_id):
+        while not queue.empty():
+            queue.get_nowait()
+            command, arguments = make_request(user_id)
+            ctx = FakeContext(kari.bot, command, user_id)
+            st = time.perf_counter()
+            failed = False
+            try:
+                # the hooks of the bot and the command run around the callback like in py-cord
+                await command.call_before_hooks(ctx)
+                try:
+                    await command.callback(ctx, *arguments)
+                finally:
+                    await command.call_after_hooks(ctx)
+            except Exception as e:
+                failed = True
+                if args.verbose:
+                    print(f"{command.name} failed: {type(e).__name__}: {e}")
+            latency = time.perf_counter() - st
+            failed = failed or any(message in error_messages for message in ctx.messages)
+            entry = results.setdefault(command.name, [[], 0])
+            entry[0].append(latency)
+            entry[1] += failed
+
+    st = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(args.concurrency)))
+    return results, time.perf_counter() - st
+
+
+def report(results, elapsed):
+    print(f"{'command':<16} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    total = 0
+    for name, (latencies, errors) in sorted(results.items()):
+        total += len(latencies)
+        print(f"{name:<16} {len(latencies):>6} {errors:>6} {percentile(latencies, 0.5) * 1000:>9.1f} "
+              f"{percentile(latencies, 0.95) * 1000:>9.1f} {percentile(latencies, 0.99) * 1000:>9.1f} "
+              f"{len(latencies) / elapsed:>8.1f}")
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} requests per second")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Drives the slash command handlers of kari.py with concurrent fake "
+                                                 "interactions and reports their latency")
+    parser.add_argument("--requests", type=int, default=1000, help="total number of commands")
+    parser.add_argument("--concurrency", type=int, default=100, help="simulated users sending commands at once")
+    parser.add_argument("--mix", type=parse_mix, default="upload=1,correct=2,scoreboard=4,week_scoreboard=1",
+                        help="relative weights of upload, correct, scoreboard and week_scoreboard")
+    parser.add_argument("--rows", type=int, default=20_000, help="records in the database before the test")
+    parser.add_argument("--players", type=int, default=5000, help="players the simulated users upload as")
+    parser.add_argument("--tesseract", default=None, help="Tesseract executable; a stand-in is used by default")
+    parser.add_argument("--ocr-seconds", type=float, default=0.5, help="CPU seconds the Tesseract stand-in burns")
+    parser.add_argument("--cdn-latency", type=float, default=0.05, help="seconds the attachment server waits")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's output and every failed command")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    with tempfile.TemporaryDirectory() as folder:
+        # the database paths and limits are read when the bot's modules are imported
+        os.environ.update(STAT_DB_PATH=os.path.join(folder, "playerstats.db"),
+                          LANG_DB_PATH=os.path.join(folder, "langprefs.db"), BACKUP_DIR=os.path.join(folder, "backups"),
+                          TRACE_FILE=os.path.join(folder, "traces.jsonl"),
+                          # the users of the test upload far more often than the rate limit allows
+                          UPLOAD_BURST="1000000", UPLOAD_RATE_PER_MINUTE="1000000")
+        from bench_export_import import create_fixture
+
+        create_fixture(os.environ['STAT_DB_PATH'], args.rows, guild_id)
+        os.chdir(src_folder)  # the bot reads its translations relative to src
+        import kari
+        import ocr_related
+
+        labels = [(json.load(open("../locales/en.json", encoding="utf-8"))[column], top)
+                  for column, top in screenshot_columns.items()]
+        if args.tesseract:
+            ocr_related.pytesseract.tesseract_cmd = args.tesseract
+        else:
+            path = os.path.join(folder, "tesseract")
+            with open(path, "w") as file:
+                file.write(fake_tesseract_source.format(python=sys.executable, seconds=args.ocr_seconds,
+                                                        labels=labels))
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+            ocr_related.pytesseract.tesseract_cmd = path
+
+        rng = random.Random(args.seed)
+        images = [render_screenshot(labels, rng) for _ in range(20)]
+        cdn_url, cdn = await start_cdn(images, args.cdn_latency)
+        await kari.startup()
+        try:
+            # the bot's output, only shown with --verbose, with the text read from every screenshot
+            ocr_related.debug_text = args.verbose
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, "w")):
+                results, elapsed = await run_load(args, kari, cdn_url)
+        finally:
+            await cdn.cleanup()
+            await kari.close_db()
+        report(results, elapsed)
+        if json_path:
+            with open(json_path, "w") as file:
+                json.dump({name: {'count': len(latencies), 'errors': errors,
+                                  'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95),
+                                  'p99': percentile(latencies, 0.99)}
+                           for name, (latencies, errors) in results.items()}, file, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,192 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+src_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+locales_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "locales")
+default_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ocr_corpus")
+sys.path.insert(0, src_folder)
+
+# the stats screen of the game shows the stats in rows of label and value, light text on a dark background
+base_width = 1080
+row_height = 72
+margin = 60
+background = (24, 26, 34)
+label_color = (205, 205, 215)
+value_color = (245, 245, 245)
+# upper bounds of the random values, columns not listed go up to a million
+value_ranges = {"level": 250, "ascensionlevel": 100, "travelersguild": 10, "anglersguild": 10, "circleofanguish": 10,
+                "titanfelledguild": 10, "bladesoffinesse": 10, "spelunkingguild": 10, "seersguild": 10,
+                "monumentalguild": 10, "globalrank": 2_000_000, "regionalrank": 500_000, "competitiverank": 200_000,
+                "coliseumwins": 5000, "endlessrecord": 300, "entriescompleted": 2000, "areastaken": 3000}
+# fonts tried in order when none is given; the game uses Merriweather Sans, Pillow's own font lacks accents
+font_candidates = ("MerriweatherSans-Regular.ttf", "DejaVuSans.ttf", "Arial.ttf")
+kingdom_names = ("Nightfall", "Ravenmoor", "Les Chevaliers", "Drachenfels", "Sunspire", "Eternal Oath")
+
+
+def stat_columns():
+    """
+    Returns the columns an upload can recognize, in the order the game shows them.
+    """
+    import field_registry
+
+    return list(field_registry.data_columns)
+
+
+def load_translations():
+    translations = dict()
+    for filename in sorted(os.listdir(locales_folder)):
+        if filename.endswith(".json"):
+            with open(os.path.join(locales_folder, filename), encoding="utf-8") as file:
+                translations[filename.split('.')[0]] = json.load(file)
+    return translations
+
+
+def random_stats(columns, rng):
+    """
+    Draws the stats of a player.
+
+    :return: A tuple (shown, truth) of the values as the game writes them and as the bot should store them.
+    """
+    shown, truth = dict(), dict()
+    for column in columns:
+        if column == "kingdom":
+            shown[column] = truth[column] = rng.choice(kingdom_names)
+        elif column == "datecreated":
+            created = date(2019, 1, 1) + timedelta(days=rng.randrange(2000))
+            shown[column] = created.strftime('%Y/%m/%d')
+            truth[column] = created.strftime('%Y-%m-%d')
+        elif column == "playtime":
+            days, hours = rng.randrange(1500), rng.randrange(24)
+            shown[column] = f"{days}d {hours:02d}h"
+            truth[column] = days * 24 + hours
+        else:
+            value = rng.randint(1, value_ranges.get(column, 1_000_000))
+            shown[column] = f"{value:,}"
+            truth[column] = value
+    return shown, truth
+
+
+def load_font(path, size):
+    from PIL import ImageFont
+
+    if path:
+        return ImageFont.truetype(path, size)
+    for candidate in font_candidates:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()  # Pillow before 10.1 only has a small bitmap font
+
+
+def render_stats_screen(labels, shown, font):
+    """
+    Draws a stats screen at the base width, one row per column.
+
+    :param labels: Column -> label in the language of the screen.
+    :param shown: Column -> value as the game writes it.
+    :param font: The PIL font.
+    :return: The PIL Image object.
+    """
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", (base_width, 2 * margin + row_height * len(shown)), background)
+    draw = ImageDraw.Draw(img)
+    for i, (column, value) in enumerate(shown.items()):
+        top = margin + row_height * i
+        draw.text((margin, top), labels[column], fill=label_color, font=font)
+        # values are right aligned like in the game
+        draw.text((base_width - margin, top), value, fill=value_color, font=font, anchor="ra")
+    return img
+
+
+def encode(img, width, quality):
+    """
+    Scales a screen to a width and saves it as a JPEG of the given quality, or as a PNG if quality is 0.
+
+    :return: The bytes of the image file.
+    """
+    from PIL import Image
+
+    if width != img.width:
+        img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    if quality:
+        img.save(buffer, format="JPEG", quality=quality)
+    else:
+        img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def generate(folder, count, widths, qualities, languages, font_path, seed):
+    """
+    Writes `count` stats screens per language, each at every width and quality, and their ground truth to
+    truth.jsonl in the folder.
+
+    :return: The number of images written.
+    """
+    rng = random.Random(seed)
+    translations = load_translations()
+    columns = stat_columns()
+    font = load_font(font_path, 40)
+    os.makedirs(folder, exist_ok=True)
+    written = 0
+    with open(os.path.join(folder, "truth.jsonl"), "w", encoding="utf-8") as truth_file:
+        for language in languages or translations:
+            language_file = translations[language]
+            labels = {column: language_file.get(column, column) for column in columns}
+            for number in range(count):
+                shown, truth = random_stats(columns, rng)
+                img = render_stats_screen(labels, shown, font)
+                for width in widths:
+                    for quality in qualities:
+                        encoding = f"q{quality}.jpg" if quality else "lossless.png"
+                        filename = f"{language}-{number:04d}-{width}-{encoding}"
+                        with open(os.path.join(folder, filename), "wb") as file:
+                            file.write(encode(img, width, quality))
+                        truth_file.write(json.dumps({'file': filename, 'language': language, 'width': width,
+                                                     'quality': quality, 'fields': truth}, ensure_ascii=False) + "\n")
+                        written += 1
+    return written
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Renders synthetic stats screens in every language with their "
+                                                 "ground truth, for bench_ocr.py")
+    parser.add_argument("--output", default=default_corpus, help="folder of the corpus")
+    parser.add_argument("--count", type=int, default=10, help="players per language")
+    parser.add_argument("--widths", type=int_list, default="720,1080,1440", help="image widths in pixels")
+    parser.add_argument("--qualities", type=int_list, default="95,75,50",
+                        help="JPEG qualities, 0 writes a lossless PNG")
+    parser.add_argument("--languages", help="comma separated language codes, every language by default")
+    parser.add_argument("--font", help="TrueType font to render with, by default the first installed of " + ", ".join(font_candidates))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    languages = args.languages.split(',') if args.languages else None
+    written = generate(args.output, args.count, args.widths, args.qualities, languages, args.font, args.seed)
+    print(f"wrote {written} images to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
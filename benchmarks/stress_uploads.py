@@ -0,0 +1,224 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+src_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, src_folder)
+
+guild_id = 1
+kingdoms = ("Nightfall", "Dawnbreak", "Frostvale")
+
+
+def player_names(count):
+    return [f"player{index:04d}" for index in range(count)]
+
+
+def random_upload(rng):
+    stats = {'level': rng.randint(1, 500), 'monstersslain': rng.randint(0, 100000),
+             'bossesslain': rng.randint(0, 5000)}
+    if rng.random() < 0.5:
+        stats['kingdom'] = rng.choice(kingdoms)
+    return stats
+
+
+async def upload_burst(db_related, players, uploads, seed):
+    """
+    Uploads for every player at once, as if the same screenshots were sent from several clients.
+
+    :return: The responses counted per player and response, the errors and the latency of every upload.
+    """
+    rng = random.Random(seed)
+    responses = Counter()
+    errors = []
+    latencies = []
+
+    async def upload(playername):
+        await asyncio.sleep(rng.random() * 0.01)
+        stats = random_upload(rng)
+        stats.update(playername=playername, guildid=guild_id, discordid=0)
+        st = time.perf_counter()
+        try:
+            response, _, _ = await db_related.check_and_update_record(stats, guild_id, playername)
+            responses[f"{playername}:{response}"] += 1
+        except Exception as e:
+            if isinstance(e, sqlite3.OperationalError) and "locked" in str(e):
+                # another process held the write lock longer than the busy timeout, the upload is lost
+                responses[f"{playername}:locktimeout"] += 1
+            errors.append(f"{playername}: {type(e).__name__}: {e}")
+        latencies.append(time.perf_counter() - st)
+
+    await asyncio.gather(*(upload(playername) for playername in players for _ in range(uploads)))
+    return responses, errors, latencies
+
+
+async def worker(args):
+    # one process of the multi-process run, writes directly to the shared database like a second bot would
+    import db_related
+
+    output = sys.stdout
+    # the bot modules print, only the results are read from the output
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        try:
+            await db_related.setup_db(wal=True)
+            # the setup writes the schema, so the processes are set up one after another and start together
+            print("ready", file=output, flush=True)
+            await asyncio.get_running_loop().run_in_executor(None, sys.stdin.readline)
+            responses, errors, latencies = await upload_burst(db_related, player_names(args.players),
+                                                              args.uploads, args.seed)
+        finally:
+            await db_related.close_db()
+    json.dump({'responses': responses, 'errors': errors, 'latencies': latencies}, output)
+
+
+def check_database(database, players, uploads, responses):
+    """
+    Checks that every burst ended in one record per player, which was inserted once and merged into by every
+    other upload, and that the latest record table agrees.
+
+    :return: A list of the violations found.
+    """
+    violations = []
+    with sqlite3.connect(database) as conn:
+        counts = dict(conn.execute("SELECT playername, COUNT(*) FROM playerstats GROUP BY playername").fetchall())
+        latest = dict(conn.execute("SELECT playername, id FROM latest_playerstats").fetchall())
+        newest = dict(conn.execute("""
+            SELECT playername, id FROM (
+                SELECT playername, id, ROW_NUMBER() OVER (PARTITION BY playername ORDER BY timestamp DESC, id DESC)
+                AS position
+                FROM playerstats
+            ) WHERE position = 1
+        """).fetchall())
+    for playername in players:
+        if counts.get(playername) != 1:
+            violations.append(f"{playername} has {counts.get(playername, 0)} records instead of 1")
+        if responses[f"{playername}:recordinserted"] != 1:
+            violations.append(f"{playername} was inserted {responses[f'{playername}:recordinserted']} times")
+        if responses[f"{playername}:recordmerged"] != uploads - 1:
+            violations.append(f"{playername} was merged {responses[f'{playername}:recordmerged']} times "
+                              f"instead of {uploads - 1}")
+        if latest.get(playername) != newest.get(playername):
+            violations.append(f"latest record of {playername} is {latest.get(playername)}, "
+                              f"not {newest.get(playername)}")
+    return violations
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def report(name, responses, errors, latencies, elapsed, violations):
+    print(f"{name}: {len(latencies)} uploads in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), "
+          f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p95 {percentile(latencies, 0.95) * 1000:.1f} ms")
+    kinds = Counter()
+    for key, count in responses.items():
+        kinds[key.rsplit(":", 1)[1]] += count
+    print("  " + ", ".join(f"{kind} {count}" for kind, count in sorted(kinds.items())))
+    lost = kinds["locktimeout"]
+    if lost:
+        print(f"  {lost} uploads timed out waiting for the write lock and were lost")
+    for error in errors[:10]:
+        print(f"  error: {error}")
+    for violation in violations[:20]:
+        print(f"  violation: {violation}")
+    if elapsed >= 60:
+        print("  the run took longer than the merge window of a minute, later uploads insert new records")
+    print(f"  {'FAILED' if errors or violations else 'OK'}: {len(errors)} errors, {len(violations)} violations")
+    return not errors and not violations
+
+
+async def single_process(args, folder):
+    database = os.path.join(folder, "single.db")
+    os.environ.update(STAT_DB_PATH=database, LANG_DB_PATH=os.path.join(folder, "langprefs.db"))
+    import db_related
+
+    await db_related.setup_db()
+    players = player_names(args.players)
+    st = time.perf_counter()
+    try:
+        responses, errors, latencies = await upload_burst(db_related, players, args.uploads, args.seed)
+    finally:
+        await db_related.close_db()
+    elapsed = time.perf_counter() - st
+    violations = check_database(database, players, args.uploads, responses)
+    return report("one process", responses, errors, latencies, elapsed, violations)
+
+
+def multi_process(args, folder):
+    database = os.path.join(folder, "shared.db")
+    environment = dict(os.environ, STAT_DB_PATH=database, LANG_DB_PATH=os.path.join(folder, "langprefs.db"))
+    command = [sys.executable, os.path.abspath(__file__), "--worker", "--players", str(args.players),
+               "--uploads", str(args.uploads)]
+    processes = []
+    errors = []
+    for index in range(args.processes):
+        process = subprocess.Popen(command + ["--seed", str(args.seed + index)], env=environment, cwd=src_folder,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   text=True)
+        if process.stdout.readline().strip() != "ready":
+            process.communicate()
+            errors.append(f"worker {process.pid} failed to set up the database")
+            continue
+        processes.append(process)
+    st = time.perf_counter()
+    for process in processes:
+        process.stdin.write("go\n")
+        process.stdin.flush()
+    responses = Counter()
+    latencies = []
+    for process in processes:
+        output, _ = process.communicate()
+        try:
+            result = json.loads(output)
+        except ValueError:
+            errors.append(f"worker {process.pid} exited with {process.returncode} without results")
+            continue
+        responses.update(result['responses'])
+        errors += result['errors']
+        latencies += result['latencies']
+    elapsed = time.perf_counter() - st
+    violations = check_database(database, player_names(args.players), args.uploads * args.processes, responses)
+    return report(f"{args.processes} processes", responses, errors, latencies or [0], elapsed, violations)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Sends many simultaneous uploads for the same players and checks "
+                                                 "that each player ends up with one record")
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--uploads", type=int, default=20, help="simultaneous uploads per player and process")
+    parser.add_argument("--processes", type=int, default=4, help="processes writing the same database, 0 to skip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        await worker(args)
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(src_folder)
+        passed = await single_process(args, folder)
+        if args.processes:
+            passed = multi_process(args, folder) and passed
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,343 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+from metrics import cache_lookup
+
+group_columns = {"guild": "guildid", "kingdom": "kingdomid"}  # group type -> column of the group id
+# group type -> columns of the record sequences whose gains are summed, a player's records in a guild or in a kingdom
+sequence_columns = {"guild": ("guildid", "playername"), "kingdom": ("guildid", "playername", "kingdomid")}
+metrics = ("total", "average", "members")
+cache_size = 512
+layout_version = 2  # stored with the categories, a new layout rebuilds the aggregates
+
+# group_totals holds, per guild and per kingdom, the member count and the sum and count of the latest values of
+# every category. group_progress holds the summed gains of the members per group, day and previous day: the gain of
+# a record is its difference to the player's previous record in the group, in time order, booked on the day of the
+# record and the day of that previous record. The progress of a time frame sums the gains whose previous day also
+# lies in it, which adds up to each member's last minus first value in the time frame, like calculate_changes.
+# Both are maintained by triggers, so a group scoreboard reads a handful of rows instead of every player.
+categories = []
+result_cache = dict()  # (group type, category, metric, ascending, limit, start, end) -> entries, cleared on writes
+
+
+def state_key(category_list):
+    return f"{layout_version}:{','.join(category_list)}"
+
+
+def create_aggregatedb_queries(category_list):
+    """
+    Returns the queries creating the aggregate tables for the given categories.
+
+    :param category_list: The rankable categories.
+    """
+    sums = ', '.join([f"sum_{category} INTEGER DEFAULT 0, count_{category} INTEGER DEFAULT 0"
+                      for category in category_list])
+    gains = ', '.join([f"gain_{category} INTEGER DEFAULT 0" for category in category_list])
+    return [
+        f"""
+        CREATE TABLE IF NOT EXISTS group_totals (
+            grouptype TEXT,
+            groupid INTEGER,
+            members INTEGER DEFAULT 0,
+            {sums},
+            PRIMARY KEY (grouptype, groupid)
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS group_progress (
+            grouptype TEXT,
+            groupid INTEGER,
+            day TEXT,
+            previousday TEXT,
+            {gains},
+            PRIMARY KEY (grouptype, groupid, day, previousday)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_group_progress_day ON group_progress (grouptype, day)",
+        "CREATE TABLE IF NOT EXISTS group_aggregate_state (id INTEGER PRIMARY KEY, categories TEXT)",
+    ]
+
+
+async def setup_tables(conn, category_list):
+    """
+    Creates the aggregate tables. When the categories changed since they were filled, they are dropped
+    and recreated empty.
+
+    :param conn: The stat database connection.
+    :param category_list: The rankable categories.
+    :return: Whether the aggregates have to be rebuilt from the records.
+    """
+    categories[:] = category_list
+    await conn.execute("CREATE TABLE IF NOT EXISTS group_aggregate_state (id INTEGER PRIMARY KEY, categories TEXT)")
+    async with conn.execute("SELECT categories FROM group_aggregate_state WHERE id = 1") as cur:
+        state = await cur.fetchone()
+    needs_rebuild = state is None or state[0] != state_key(category_list)
+    if needs_rebuild:
+        await conn.execute("DROP TABLE IF EXISTS group_totals")
+        await conn.execute("DROP TABLE IF EXISTS group_progress")
+    for query in create_aggregatedb_queries(category_list):
+        await conn.execute(query)
+    await conn.commit()
+    return needs_rebuild
+
+
+async def rebuild(conn):
+    """
+    Recomputes all aggregates from the latest record table and the full record history.
+
+    :param conn: The stat database connection.
+    """
+    sum_columns = ', '.join([f"sum_{category}, count_{category}" for category in categories])
+    sum_values = ', '.join([f"SUM({integer_value('l', category)}), SUM(typeof(l.{category}) = 'integer')"
+                            for category in categories])
+    gain_columns = ', '.join([f"gain_{category}" for category in categories])
+    gain_sums = ', '.join([f"SUM(gain_{category})" for category in categories])
+    gain_values = ', '.join([f"{integer_value('r', category)} - LAG({integer_value('r', category)}) OVER w "
+                             f"AS gain_{category}" for category in categories])
+
+    await conn.execute("DELETE FROM group_totals")
+    await conn.execute("DELETE FROM group_progress")
+    for group_type, group_column in group_columns.items():
+        await conn.execute(f"""
+            INSERT INTO group_totals (grouptype, groupid, members, {sum_columns})
+            SELECT '{group_type}', l.{group_column}, COUNT(*), {sum_values}
+            FROM latest_playerstats l
+            WHERE l.{group_column} IS NOT NULL
+            GROUP BY l.{group_column}
+        """)
+        # gains between consecutive records of a player in the group, the same differences the triggers book
+        await conn.execute(f"""
+            INSERT INTO group_progress (grouptype, groupid, day, previousday, {gain_columns})
+            SELECT '{group_type}', {group_column}, day, previousday, {gain_sums}
+            FROM (
+                SELECT r.{group_column}, date(r.timestamp) AS day, date(LAG(r.timestamp) OVER w) AS previousday,
+                       {gain_values}
+                FROM playerstats r
+                WHERE r.{group_column} IS NOT NULL
+                WINDOW w AS (PARTITION BY {', '.join(sequence_columns[group_type])} ORDER BY r.timestamp, r.id)
+            )
+            WHERE previousday IS NOT NULL
+            GROUP BY {group_column}, day, previousday
+        """)
+    await conn.execute("INSERT OR REPLACE INTO group_aggregate_state (id, categories) VALUES (1, ?)",
+                       (state_key(categories),))
+    await conn.commit()
+    invalidate()
+
+
+def integer_value(ref, category):
+    return f"(CASE WHEN typeof({ref}.{category}) = 'integer' THEN {ref}.{category} ELSE 0 END)"
+
+
+def totals_queries(ref, sign):
+    """
+    Returns the trigger statements adding (sign '+') or removing (sign '-') a latest record to or from the totals
+    of its guild and kingdom.
+
+    :param ref: The trigger row holding the latest record, NEW or OLD.
+    :param sign: '+' or '-'.
+    """
+    columns = ', '.join([f"sum_{category}, count_{category}" for category in categories])
+    values = ', '.join([f"{sign}{integer_value(ref, category)}, {sign}(typeof({ref}.{category}) = 'integer')"
+                        for category in categories])
+    updates = ', '.join([f"sum_{category} = sum_{category} + excluded.sum_{category}, "
+                         f"count_{category} = count_{category} + excluded.count_{category}"
+                         for category in categories])
+    return ''.join([f"""
+        INSERT INTO group_totals (grouptype, groupid, members, {columns})
+        SELECT '{group_type}', {ref}.{group_column}, {sign}1, {values}
+        WHERE {ref}.{group_column} IS NOT NULL
+        ON CONFLICT (grouptype, groupid) DO UPDATE SET members = members + excluded.members, {updates};
+    """ for group_type, group_column in group_columns.items()])
+
+
+def gain(new, old, category):
+    # missing values count as 0 like in calculate_changes, so the gains of a time frame add up to last minus first
+    return f"({integer_value(new, category)} - {integer_value(old, category)})"
+
+
+def neighbour(ref, direction, group_type):
+    """
+    Returns a subquery selecting the id of the previous ('<') or next ('>') record in time order of the player of a
+    trigger row, among the player's records in the row's group. The trigger row itself is left out.
+    """
+    order = "DESC" if direction == "<" else "ASC"
+    same_sequence = ' AND '.join([f"{column} = {ref}.{column}" for column in sequence_columns[group_type]])
+    return (f"(SELECT id FROM playerstats WHERE {same_sequence} AND id != {ref}.id "
+            f"AND (timestamp, id) {direction} ({ref}.timestamp, {ref}.id) "
+            f"ORDER BY timestamp {order}, id {order} LIMIT 1)")
+
+
+def book_query(group_type, sign, new, old, source):
+    """
+    Returns the trigger statement adding (sign '+') or removing (sign '-') the gain of a record over its previous
+    record to or from the progress of its group.
+
+    :param new: The row of the record.
+    :param old: The row of its previous record.
+    :param source: The FROM clause and condition providing the rows.
+    """
+    group_column = group_columns[group_type]
+    columns = ', '.join([f"gain_{category}" for category in categories])
+    gains = ', '.join([f"{sign}{gain(new, old, category)}" for category in categories])
+    updates = ', '.join([f"gain_{category} = gain_{category} + excluded.gain_{category}" for category in categories])
+    return f"""
+        INSERT INTO group_progress (grouptype, groupid, day, previousday, {columns})
+        SELECT '{group_type}', {new}.{group_column}, date({new}.timestamp), date({old}.timestamp), {gains}
+        FROM {source} AND {new}.{group_column} IS NOT NULL
+        ON CONFLICT (grouptype, groupid, day, previousday) DO UPDATE SET {updates};
+    """
+
+
+def progress_queries(ref, sign):
+    """
+    Returns the trigger statements booking the gains of a record that was added (sign '+') to or removed (sign '-')
+    from a player's records. The record after it, if there is one, is then compared to it instead of the record
+    before it, or the other way around.
+
+    :param ref: The trigger row, NEW or OLD.
+    :param sign: '+' or '-'.
+    """
+    other = '-' if sign == '+' else '+'
+    queries = []
+    for group_type in group_columns:
+        previous = f"playerstats p WHERE p.id = {neighbour(ref, '<', group_type)}"
+        following = f"playerstats n WHERE n.id = {neighbour(ref, '>', group_type)}"
+        both = (f"playerstats n, playerstats p WHERE n.id = {neighbour(ref, '>', group_type)} "
+                f"AND p.id = {neighbour(ref, '<', group_type)}")
+        queries += [book_query(group_type, sign, ref, 'p', previous),
+                    book_query(group_type, sign, 'n', ref, following),
+                    book_query(group_type, other, 'n', 'p', both)]
+    return ''.join(queries)
+
+
+def create_trigger_queries():
+    """
+    Returns the queries (re)creating the triggers that maintain the aggregates. The totals follow the latest record
+    table. The progress follows every record: a record's gain is its difference to the player's previous record, so
+    adding, changing or removing a record also changes the gain of the record after it. An update counts as removing
+    the old row and adding the new one.
+    """
+    return [
+        "DROP TRIGGER IF EXISTS group_totals_after_insert",
+        "DROP TRIGGER IF EXISTS group_totals_after_delete",
+        "DROP TRIGGER IF EXISTS group_progress_after_insert",
+        "DROP TRIGGER IF EXISTS group_progress_after_update",
+        "DROP TRIGGER IF EXISTS group_progress_after_delete",
+        f"""
+        CREATE TRIGGER group_totals_after_insert AFTER INSERT ON latest_playerstats
+        BEGIN
+            {totals_queries('NEW', '+')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER group_totals_after_delete AFTER DELETE ON latest_playerstats
+        BEGIN
+            {totals_queries('OLD', '-')}
+        END
+        """,
+        # backfilled records may be older than existing ones, so a new record can have a record after it
+        f"""
+        CREATE TRIGGER group_progress_after_insert AFTER INSERT ON playerstats
+        BEGIN
+            {progress_queries('NEW', '+')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER group_progress_after_update AFTER UPDATE ON playerstats
+        BEGIN
+            {progress_queries('OLD', '-')}
+            {progress_queries('NEW', '+')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER group_progress_after_delete AFTER DELETE ON playerstats
+        BEGIN
+            {progress_queries('OLD', '-')}
+        END
+        """,
+    ]
+
+
+async def remove_group(conn, group_type, group_id):
+    """
+    Deletes the aggregates of a group that no record belongs to anymore, e.g. a kingdom merged into another.
+
+    :param conn: The stat database connection.
+    :param group_type: 'guild' or 'kingdom'.
+    :param group_id: The id of the group.
+    """
+    await conn.execute("DELETE FROM group_totals WHERE grouptype = ? AND groupid = ?", (group_type, group_id))
+    await conn.execute("DELETE FROM group_progress WHERE grouptype = ? AND groupid = ?", (group_type, group_id))
+
+
+def invalidate():
+    """
+    Drops the cached group scoreboards after a write.
+    """
+    result_cache.clear()
+
+
+async def get_group_scoreboard(conn, group_type, category, metric, ascending, limit, start_date=None, end_date=None):
+    """
+    Retrieves a scoreboard of guilds or kingdoms, either by their members' latest values or, when a time frame is
+    given, by the progress their members made in it. Results are cached until the next write.
+
+    :param conn: The stat database connection.
+    :param group_type: 'guild' or 'kingdom'.
+    :param category: The statistic to rank the groups by.
+    :param metric: 'total', 'average' (per member with a value) or 'members' (the member count).
+    :param ascending: Boolean indicating whether lower values rank higher.
+    :param limit: The maximum number of groups.
+    :param start_date: Optional; the first day ('%Y-%m-%d') of the time frame.
+    :param end_date: Optional; the last day of the time frame.
+    :return: A list of dictionaries with the group id, value and member count.
+    """
+    cache_key = (group_type, category, metric, ascending, limit, start_date, end_date)
+    if cache_key in result_cache:
+        cache_lookup("group_scoreboard", True)
+        return result_cache[cache_key]
+    cache_lookup("group_scoreboard", False)
+
+    order = "DESC" if metric == "members" or not ascending else "ASC"
+    if start_date is None:
+        value = {"total": f"t.sum_{category}",
+                 "average": f"CAST(t.sum_{category} AS REAL) / t.count_{category}",
+                 "members": "t.members"}[metric]
+        query = f"""
+            SELECT t.groupid, {value} AS value, t.members FROM group_totals t
+            WHERE t.grouptype = ? AND t.count_{category} > 0
+            ORDER BY value {order}, t.groupid
+            LIMIT ?
+        """
+        params = (group_type, limit)
+    else:
+        value = {"total": "p.gain",
+                 "average": f"CAST(p.gain AS REAL) / t.count_{category}",
+                 "members": "t.members"}[metric]
+        query = f"""
+            SELECT t.groupid, {value} AS value, t.members
+            FROM (
+                SELECT groupid, SUM(gain_{category}) AS gain FROM group_progress
+                WHERE grouptype = ? AND day BETWEEN ? AND ? AND previousday >= ?
+                GROUP BY groupid
+            ) p
+            INNER JOIN group_totals t ON t.grouptype = ? AND t.groupid = p.groupid
+            WHERE t.count_{category} > 0
+            ORDER BY value {order}, t.groupid
+            LIMIT ?
+        """
+        params = (group_type, start_date, end_date, start_date, group_type, limit)
+
+    async with conn.execute(query, params) as cur:
+        entries = [{'groupid': row[0], 'value': row[1], 'members': row[2]} for row in await cur.fetchall()]
+
+    if len(result_cache) >= cache_size:
+        result_cache.clear()
+    result_cache[cache_key] = entries
+    return entries
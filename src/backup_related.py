@@ -0,0 +1,183 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import aiosqlite
+
+from lang_db_connection import LangDBConnection
+from stat_db_connection import StatDBConnection
+
+backup_folder = os.getenv('BACKUP_DIR', '../backups')
+backup_interval_hours = float(os.getenv('BACKUP_INTERVAL_HOURS', '6'))
+backup_keep = int(os.getenv('BACKUP_KEEP', '14'))
+backup_compress = os.getenv('BACKUP_COMPRESS', '1') == '1'
+backup_pages_per_step = 64  # pages copied before the source database is released again, without write-ahead logging
+backup_step_sleep = 0.05  # seconds to wait between steps, lets writers in between
+backup_manifest = "backups.jsonl"
+
+backup_task = None  # scheduled backup task, started once
+
+
+async def backup_database(source_path, name, folder=None, compress=None):
+    """
+    Creates an online snapshot of a SQLite database on its own connection, so the shared bot connection stays free
+    for uploads and no write has to wait for the whole copy.
+
+    In write-ahead logging mode the snapshot is written with VACUUM INTO, which reads one consistent state of the
+    database while writers keep committing. Otherwise a reader would block every commit for as long as it reads, so
+    the incremental backup API copies a few pages at a time and yields in between; a write from another connection
+    restarts that copy, which is why the bot switches its databases to write-ahead logging when backups are on.
+
+    :param source_path: Path of the database file to back up.
+    :param name: Short name of the database used in the snapshot file name (e.g. "playerstats").
+    :param folder: Optional; the folder to write snapshots to. Defaults to BACKUP_DIR.
+    :param compress: Optional; whether to gzip the snapshot. Defaults to BACKUP_COMPRESS.
+    :return: A dictionary with the snapshot path, its size in bytes and the backup duration in seconds.
+    """
+    folder = folder or backup_folder
+    compress = backup_compress if compress is None else compress
+    os.makedirs(folder, exist_ok=True)
+
+    timestamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+    snapshot_path = os.path.join(folder, f"{name}-{timestamp}.db")
+    suffix = 1
+    while os.path.exists(snapshot_path) or os.path.exists(snapshot_path + ".gz"):
+        # never overwrite a snapshot taken within the same second
+        snapshot_path = os.path.join(folder, f"{name}-{timestamp}-{suffix}.db")
+        suffix += 1
+    st = time.perf_counter()
+
+    source = await aiosqlite.connect(source_path)
+    try:
+        async with source.execute("PRAGMA journal_mode") as cur:
+            journal_mode = (await cur.fetchone())[0]
+        if journal_mode.lower() == "wal":
+            await source.execute("VACUUM INTO ?", (snapshot_path,))
+        else:
+            target = sqlite3.connect(snapshot_path, check_same_thread=False)
+            try:
+                await source.backup(target, pages=backup_pages_per_step, sleep=backup_step_sleep)
+            finally:
+                target.close()
+    finally:
+        await source.close()
+
+    if compress:
+        snapshot_path = await asyncio.get_running_loop().run_in_executor(None, compress_snapshot, snapshot_path)
+
+    result = {
+        'database': name,
+        'path': snapshot_path,
+        'size': os.path.getsize(snapshot_path),
+        'duration': round(time.perf_counter() - st, 3),
+        'timestamp': timestamp,
+    }
+    write_manifest_entry(folder, result)
+    rotate_backups(folder, name)
+    return result
+
+
+async def backup_all(folder=None, compress=None):
+    """
+    Backs up the player statistics and language preference databases.
+
+    :param folder: Optional; the folder to write snapshots to.
+    :param compress: Optional; whether to gzip the snapshots.
+    :return: A list with the result dictionary of each backup.
+    """
+    results = []
+    for connection_class, name in ((StatDBConnection, "playerstats"), (LangDBConnection, "langprefs")):
+        if os.path.exists(connection_class.path):
+            results.append(await backup_database(connection_class.path, name, folder, compress))
+    return results
+
+
+async def backup_loop():
+    """
+    Periodically backs up all databases, waiting BACKUP_INTERVAL_HOURS between runs.
+    A failing backup is reported and retried on the next run instead of stopping the loop.
+    """
+    while True:
+        try:
+            for result in await backup_all():
+                print(f"Backed up {result['database']} to {result['path']} "
+                      f"({result['size']} bytes, {result['duration']} seconds)")
+        except Exception as e:
+            print(f"Backup failed: {e}")
+        await asyncio.sleep(backup_interval_hours * 3600)
+
+
+def backups_enabled():
+    """
+    Returns whether scheduled backups are on. Their databases use write-ahead logging, see backup_database.
+    """
+    return backup_interval_hours > 0
+
+
+def start_backup_task():
+    """
+    Starts the scheduled backup task if backups are enabled and it is not already running.
+    Backups are disabled by setting BACKUP_INTERVAL_HOURS to 0.
+    """
+    global backup_task
+    if not backups_enabled() or (backup_task is not None and not backup_task.done()):
+        return
+    backup_task = asyncio.create_task(backup_loop())
+
+
+# Helper functions
+def compress_snapshot(snapshot_path):
+    """
+    Gzips a snapshot file and removes the uncompressed copy.
+
+    :param snapshot_path: Path of the snapshot to compress.
+    :return: The path of the compressed snapshot.
+    """
+    compressed_path = snapshot_path + ".gz"
+    with open(snapshot_path, "rb") as f_in, gzip.open(compressed_path, "wb", compresslevel=6) as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(snapshot_path)
+    return compressed_path
+
+
+def rotate_backups(folder, name, keep=None):
+    """
+    Deletes the oldest snapshots of a database so that at most `keep` remain.
+
+    :param folder: The folder containing the snapshots.
+    :param name: Short name of the database.
+    :param keep: Optional; the number of snapshots to keep. Defaults to BACKUP_KEEP.
+    :return: A list of the removed snapshot paths.
+    """
+    keep = backup_keep if keep is None else keep
+    snapshots = [os.path.join(folder, filename) for filename in os.listdir(folder)
+                 if filename.startswith(f"{name}-") and (filename.endswith(".db") or filename.endswith(".db.gz"))]
+    snapshots.sort(key=os.path.getmtime)  # oldest first
+    removed = snapshots[:max(len(snapshots) - keep, 0)]
+    for snapshot_path in removed:
+        os.remove(snapshot_path)
+    return removed
+
+
+def write_manifest_entry(folder, result):
+    """
+    Appends the result of a backup to the manifest so duration and size can be followed over time.
+
+    :param folder: The backup folder.
+    :param result: The result dictionary of the backup.
+    """
+    with open(os.path.join(folder, backup_manifest), "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
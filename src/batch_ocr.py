@@ -0,0 +1,327 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import csv
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import db_related
+import field_registry
+from stat_db_connection import StatDBConnection
+
+image_extensions = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+locales_folder = "../locales"
+progress_interval_seconds = 10
+# a date and optional time in a file name, e.g. Screenshot_2024-03-05-18-22-41.png or IMG_20240305_182241.jpg
+filename_time = re.compile(r"(20\d\d)[-_.]?(\d\d)[-_.]?(\d\d)(?:[-_. T]?(\d\d)[-_.:h]?(\d\d)(?:[-_.:m]?(\d\d))?)?")
+
+# set in each worker process by init_worker
+worker_translations = None
+worker_loop = None
+
+
+def load_translations():
+    translations = dict()
+    for filename in os.listdir(locales_folder):
+        if filename.endswith(".json"):
+            with open(os.path.join(locales_folder, filename), "r", encoding="utf-8") as f:
+                translations[filename.split('.')[0]] = json.load(f)
+    return translations
+
+
+def schema_columns():
+    """
+    Returns the stat columns of the playerstats table, without opening the stats database.
+    """
+    return list(field_registry.data_columns)
+
+
+def screenshot_time(path):
+    """
+    Returns when a screenshot was taken, from the date in its file name or else its modification time, in UTC.
+
+    :return: A timestamp string in the format of the database.
+    """
+    match = filename_time.search(os.path.basename(path))
+    if match:
+        try:
+            parts = [int(part) if part else 0 for part in match.groups()]
+            # cameras name their files in local time
+            return datetime(*parts).astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        except (ValueError, OverflowError, OSError):
+            pass  # not a date after all
+    return datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def parse_time(value):
+    """
+    Parses a timestamp of a manifest, an ISO 8601 string or a unix time, to the format of the database in UTC.
+    """
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        moment = datetime.fromtimestamp(float(value), timezone.utc)
+    else:
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def directory_jobs(folder, player, language):
+    """
+    Lists the screenshots below a folder. Without a player name, each screenshot belongs to the player its folder
+    is named after, e.g. screenshots/Kari/2024-03-05.png.
+    """
+    jobs = []
+    for root, _, filenames in os.walk(folder):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(image_extensions):
+                path = os.path.abspath(os.path.join(root, filename))
+                jobs.append({'path': path, 'playername': player or os.path.basename(root),
+                             'timestamp': screenshot_time(path), 'language': language})
+    return jobs
+
+
+def manifest_jobs(manifest, language):
+    """
+    Reads a CSV or JSON Lines manifest with the columns path and playername, and optionally timestamp, discordid,
+    second (the path of a second screenshot of the same stats) and language. Relative paths are relative to the
+    manifest.
+    """
+    folder = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, encoding="utf-8", newline="") as f:
+        if manifest.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    jobs = []
+    for row in rows:
+        path = os.path.join(folder, row['path'])
+        job = {'path': os.path.abspath(path), 'playername': row['playername'],
+               'timestamp': parse_time(row['timestamp']) if row.get('timestamp') else screenshot_time(path),
+               'language': row.get('language') or language}
+        if row.get('discordid'):
+            job['discordid'] = int(row['discordid'])
+        if row.get('second'):
+            job['second'] = os.path.abspath(os.path.join(folder, row['second']))
+        jobs.append(job)
+    return jobs
+
+
+def init_worker(columns, tesseract_cmd, verbose):
+    global worker_translations, worker_loop
+    import category_related
+    import ocr_related
+
+    worker_translations = load_translations()
+    category_related.load(worker_translations, columns)
+    if tesseract_cmd:
+        ocr_related.pytesseract.tesseract_cmd = tesseract_cmd
+    ocr_related.debug_image_path = None  # every worker would overwrite the same file
+    ocr_related.debug_text = verbose
+    worker_loop = asyncio.new_event_loop()
+
+
+def read_screenshot(path, language_file):
+    import ocr_related
+
+    with open(path, "rb") as f:
+        img = ocr_related.decode_image(f.read())
+    lines = ocr_related.ocr_processing(img, language_file).strip().split("\n")
+    playerstats, visited = worker_loop.run_until_complete(ocr_related.process_text_tess(lines, language_file))
+    return ocr_related.sanitize_ocr_results(playerstats), visited
+
+
+def process_job(job):
+    """
+    Reads the screenshots of a job in a worker process, like /upload_stats reads an upload.
+
+    :return: The job with the recognized stats, or with the error that stopped it.
+    """
+    import ocr_related
+
+    st = time.perf_counter()
+    result = dict(job)
+    try:
+        language_file = worker_translations[job['language']]
+        playerstats, visited = read_screenshot(job['path'], language_file)
+        if job.get('second'):
+            playerstats2, visited2 = read_screenshot(job['second'], language_file)
+            ocr_related.merge_ocr_results(playerstats, visited, playerstats2, visited2)
+        if not playerstats:
+            raise ValueError("no stats recognized")
+        result['stats'] = playerstats
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = round(time.perf_counter() - st, 3)
+    return result
+
+
+def read_results(output):
+    """
+    Reads the results of earlier runs, the checkpoint of the batch. A line cut off by a crash is removed.
+
+    :return: A dictionary mapping screenshot paths to their last result.
+    """
+    results = dict()
+    if not os.path.exists(output):
+        return results
+    with open(output, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].decode("utf-8").splitlines():
+        if line.strip():
+            result = json.loads(line)
+            results[result['path']] = result
+    return results
+
+
+async def run_ocr(jobs, output, workers, columns, tesseract_cmd, verbose):
+    """
+    Reads the screenshots on every core and appends each result to the output as soon as it is known.
+
+    :return: The number of read and of failed screenshots.
+    """
+    # Tesseract would start a thread per core for every image, one thread per worker process keeps the cores busy
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    loop = asyncio.get_running_loop()
+    done = failed = 0
+    st = last_report = time.perf_counter()
+    pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker,
+                                                  initargs=(columns, tesseract_cmd, verbose))
+    with pool, open(output, "a", encoding="utf-8") as out:
+        pending = set()
+        queue = iter(jobs)
+        while True:
+            # a few jobs per worker in flight, so the results stream out instead of piling up
+            for job in queue:
+                pending.add(loop.run_in_executor(pool, process_job, job))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                done += 1
+                if 'error' in result:
+                    failed += 1
+                    print(f"{result['path']}: {result['error']}")
+            out.flush()
+            now = time.perf_counter()
+            if now - last_report >= progress_interval_seconds:
+                last_report = now
+                print(f"{done}/{len(jobs)} screenshots, {done / (now - st):.2f} images per second, {failed} failed")
+    elapsed = time.perf_counter() - st
+    print(f"Read {done} screenshots in {elapsed:.1f} seconds ({done / max(elapsed, 1e-9):.2f} images per second), "
+          f"{failed} failed")
+    return done, failed
+
+
+def backfill_records(results, record_times, columns):
+    """
+    Turns the results into records to insert. Like uploads, a player keeps the first and the last record of a day.
+    Records older than a player's existing ones are inserted too, the latest record stays the newest one. A record
+    at the same time as an existing record of the player is left out, so inserting the same results again is a no-op.
+
+    :param results: The successful results.
+    :param record_times: The (player name, timestamp) tuples of the records already in the guild.
+    :param columns: The stat columns.
+    :return: The records sorted by time and the number of records left out as already in the guild.
+    """
+    days = dict()  # (player, day) -> [first, last]
+    for result in sorted(results, key=lambda result: result['timestamp']):
+        key = (result['playername'], result['timestamp'][:10])
+        if key in days:
+            days[key][1] = result
+        else:
+            days[key] = [result, result]
+    records = []
+    existing = 0
+    for first, last in days.values():
+        for result in ([first] if first is last else [first, last]):
+            if (result['playername'], result['timestamp']) in record_times:
+                existing += 1
+                continue
+            record = {'discordid': result.get('discordid'), 'timestamp': result['timestamp'],
+                      'playername': result['playername']}
+            record.update({column: result['stats'].get(column) for column in columns})
+            records.append(record)
+    records.sort(key=lambda record: record['timestamp'])
+    return records, existing
+
+
+async def insert_results(guild_id, results, batch_size):
+    """
+    Inserts the read stats into a guild with their screenshot times, in one transaction.
+
+    :return: The number of inserted records.
+    """
+    record_times = await db_related.get_record_times(guild_id)
+    records, existing = backfill_records(results, record_times, db_related.get_column_names())
+    if existing:
+        print(f"Skipping {existing} records the players already have at the same time")
+    if not records:
+        return 0
+    return await db_related.insert_records_bulk(guild_id, records, batch_size)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Reads a folder or manifest of stats screenshots on every core, "
+                                                 "writes the stats to JSON Lines and optionally inserts them")
+    parser.add_argument("source", help="folder of screenshots, or a .csv or .jsonl manifest")
+    parser.add_argument("--output", required=True, help="JSON Lines results, also the checkpoint to resume from")
+    parser.add_argument("--player", help="player of every screenshot in the folder, instead of the folder names")
+    parser.add_argument("--language", default="en", help="language of the screenshots")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--tesseract", help="Tesseract executable, if it is not on the PATH")
+    parser.add_argument("--retry-failed", action="store_true", help="read screenshots that failed before again")
+    parser.add_argument("--insert", action="store_true", help="insert the results into the guild afterwards")
+    parser.add_argument("--guild", type=int, help="ID of the discord server to insert into")
+    parser.add_argument("--db", default=StatDBConnection.path, help="path of the player stats database")
+    parser.add_argument("--batch-size", type=int, default=5000, help="records per executemany of the insert")
+    parser.add_argument("--verbose", action="store_true", help="show the text read from every screenshot")
+    args = parser.parse_args()
+    if args.insert and args.guild is None:
+        parser.error("--insert needs --guild")
+
+    if os.path.isdir(args.source):
+        jobs = directory_jobs(args.source, args.player, args.language)
+    else:
+        jobs = manifest_jobs(args.source, args.language)
+    results = read_results(args.output)
+    todo = [job for job in jobs
+            if job['path'] not in results or (args.retry_failed and 'error' in results[job['path']])]
+    print(f"{len(jobs)} screenshots, {len(jobs) - len(todo)} already read")
+    if todo:
+        await run_ocr(todo, args.output, args.workers, schema_columns(), args.tesseract, args.verbose)
+
+    if args.insert:
+        StatDBConnection.path = args.db
+        await db_related.setup_db()
+        try:
+            st = time.perf_counter()
+            paths = {job['path'] for job in jobs}
+            successful = [result for path, result in read_results(args.output).items()
+                          if path in paths and 'stats' in result]
+            inserted = await insert_results(args.guild, successful, args.batch_size)
+            print(f"Inserted {inserted} records into guild {args.guild} in {time.perf_counter() - st:.2f} seconds")
+        finally:
+            await db_related.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import bisect
+from functools import lru_cache
+
+from fuzzywuzzy import fuzz, process
+
+min_score = 80  # confidence needed to accept a typed category
+prefix_score = 95  # confidence of a prefix that only one category starts with
+prefix_min_length = 3
+max_choices = 25  # discord shows at most 25 autocomplete choices
+
+columns = []  # the categories that can be entered, in column order
+label_maps = dict()  # tuple of the labels of one language -> {normalized label: column}
+all_labels = dict()  # normalized label of any language or column name -> column
+display_labels = dict()  # normalized label -> label as written in its translation file
+sorted_labels = []  # the keys of all_labels, sorted for prefix search
+
+
+def load(translations, column_names):
+    """
+    Precompiles the label to column maps of every language. Called whenever the translations are loaded.
+
+    :param translations: Language code -> translation dictionary.
+    :param column_names: The categories that can be entered.
+    """
+    columns[:] = column_names
+    label_maps.clear()
+    all_labels.clear()
+    display_labels.clear()
+    for language_file in translations.values():
+        for column in columns:
+            label = language_file.get(column, column)
+            all_labels.setdefault(normalize_label(label), column)
+            display_labels.setdefault(normalize_label(label), label)
+        localized_columns(language_file)
+    for column in columns:
+        all_labels.setdefault(column, column)
+        display_labels.setdefault(column, column)
+    sorted_labels[:] = sorted(all_labels)
+    match_category.cache_clear()
+
+
+def normalize_label(label):
+    return ''.join(str(label).split()).lower()
+
+
+def language_labels(language_file):
+    return tuple(language_file.get(column, column) for column in columns)
+
+
+def localized_columns(language_file):
+    """
+    Returns the map of normalized localized labels to columns of a language, building it on first use.
+
+    :param language_file: The translation dictionary of the language.
+    :return: A dictionary mapping normalized labels to column names.
+    """
+    labels = language_labels(language_file)
+    label_map = label_maps.get(labels)
+    if label_map is None:
+        label_map = {normalize_label(label): column for label, column in zip(labels, columns)}
+        label_maps[labels] = label_map
+    return label_map
+
+
+def resolve_category(text, language_file):
+    """
+    Resolves a category typed by a user to its column. Labels of the user's language win, but labels of the other
+    languages and unique prefixes are understood too.
+
+    :param text: The typed category.
+    :param language_file: The translation dictionary of the user's language.
+    :return: A tuple (column, score) with a score from 0 to 100, where column is None if nothing matched.
+    """
+    return match_category(normalize_label(text), language_labels(language_file))
+
+
+@lru_cache(maxsize=4096)
+def match_category(key, labels):
+    own_labels = label_maps.get(labels) or {normalize_label(label): column for label, column in zip(labels, columns)}
+    if key in own_labels:
+        return own_labels[key], 100
+    if key in all_labels:
+        return all_labels[key], 100
+
+    if len(key) >= prefix_min_length:
+        prefixed_columns = {all_labels[label] for label in labels_with_prefix(key)}
+        if len(prefixed_columns) == 1:
+            return prefixed_columns.pop(), prefix_score
+
+    match = process.extractOne(key, list(own_labels) + list(all_labels), scorer=fuzz.ratio)
+    if match is None:
+        return None, 0
+    label, score = match
+    return own_labels.get(label, all_labels.get(label)), score
+
+
+def labels_with_prefix(key, limit=None):
+    start = bisect.bisect_left(sorted_labels, key)
+    labels = []
+    for label in sorted_labels[start:]:
+        if not label.startswith(key) or (limit and len(labels) >= limit):
+            break
+        labels.append(label)
+    return labels
+
+
+def complete_category(text, limit=max_choices):
+    """
+    Returns category labels for autocompletion: labels of any language starting with the text, then labels
+    containing it.
+
+    :param text: What the user typed so far.
+    :param limit: The maximum number of labels.
+    :return: A list of labels, as written in the translation files.
+    """
+    key = normalize_label(text or "")
+    keys = labels_with_prefix(key, limit)
+    if len(keys) < limit and key:
+        keys += [label for label in sorted_labels if key in label and label not in keys][:limit - len(keys)]
+    return [display_labels[label] for label in keys]
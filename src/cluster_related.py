@@ -0,0 +1,166 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import discord
+
+# set by the cluster launcher for the bot processes it starts, a bot started on its own runs all shards itself
+cluster_id = os.getenv('CLUSTER_ID')
+shard_count = os.getenv('SHARD_COUNT')
+shard_ids = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id]
+writer_address = os.getenv('WRITER_ADDRESS', '127.0.0.1:8790')  # "host:port" or "unix:/path/to/socket"
+api_url = os.getenv('DISCORD_API_URL')  # e.g. the fake gateway of benchmarks/fake_gateway.py
+restart_delay_seconds = 5
+writer_start_timeout_seconds = 120
+
+
+def is_worker():
+    """
+    Returns whether this process is a bot process of a cluster, whose writes go through the writer service.
+    """
+    return cluster_id is not None
+
+
+def create_bot(intents):
+    """
+    Creates the bot of this process: an auto-sharded bot owning the shards assigned by the cluster launcher,
+    or a plain bot when running on its own. Only the first bot process of a cluster syncs the slash commands.
+
+    :param intents: The gateway intents.
+    :return: The bot.
+    """
+    if api_url:
+        discord.http.Route.API_BASE_URL = api_url
+    if not is_worker():
+        return discord.Bot(intents=intents)
+    return discord.AutoShardedBot(intents=intents, shard_count=int(shard_count), shard_ids=shard_ids,
+                                  auto_sync_commands=cluster_id == '0')
+
+
+def recommended_shard_count(token):
+    """
+    Asks Discord how many shards the bot should use.
+
+    :param token: The bot token.
+    :return: The recommended shard count.
+    """
+    base_url = (api_url or discord.http.Route.API_BASE_URL).format(API_VERSION=discord.http.API_VERSION)
+    request = urllib.request.Request(f"{base_url}/gateway/bot",
+                                     headers={'Authorization': f"Bot {token}", 'User-Agent': 'KariBot'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.load(response)['shards']
+
+
+def assign_shards(total_shards, processes):
+    """
+    Splits the shards into contiguous blocks, one per process.
+
+    :return: A list with the shard ids of every process.
+    """
+    processes = max(1, min(processes, total_shards))
+    return [list(range(total_shards * i // processes, total_shards * (i + 1) // processes)) for i in range(processes)]
+
+
+def wait_for_writer(process, address):
+    deadline = time.monotonic() + writer_start_timeout_seconds
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The writer service exited with code {process.returncode}")
+        try:
+            if address.startswith('unix:'):
+                with socket.socket(socket.AF_UNIX) as probe:
+                    probe.connect(address[5:])
+            else:
+                host, port = address.rsplit(':', 1)
+                socket.create_connection((host, int(port)), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("The writer service did not start in time")
+
+
+def start_writer():
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "writer"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_bot(cluster, total_shards, cluster_shard_ids):
+    env = dict(os.environ, CLUSTER_ID=str(cluster), SHARD_COUNT=str(total_shards),
+               SHARD_IDS=','.join(map(str, cluster_shard_ids)), WRITER_ADDRESS=writer_address)
+    if os.getenv('METRICS_PORT'):
+        # the writer serves its metrics on METRICS_PORT, the bot processes on the following ports
+        env['METRICS_PORT'] = str(int(os.getenv('METRICS_PORT')) + 1 + cluster)
+    print(f"Starting cluster {cluster} with shards {cluster_shard_ids}")
+    return subprocess.Popen([sys.executable, "kari.py"], cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+
+
+def run_cluster(processes, total_shards=None):
+    """
+    Runs the writer service and the bot processes and restarts them when they exit.
+
+    :param processes: The number of bot processes.
+    :param total_shards: Optional; the number of shards. Defaults to Discord's recommendation.
+    """
+    total_shards = total_shards or recommended_shard_count(os.getenv('TOKEN'))
+    assignment = assign_shards(total_shards, processes)
+    writer = start_writer()
+    bots = dict()
+    try:
+        wait_for_writer(writer, writer_address)
+        for cluster, cluster_shard_ids in enumerate(assignment):
+            bots[cluster] = start_bot(cluster, total_shards, cluster_shard_ids)
+        while True:
+            time.sleep(restart_delay_seconds)
+            if writer.poll() is not None:
+                # the bot processes reconnect to the new writer and reload their caches
+                print(f"Writer service exited with code {writer.returncode}, restarting it")
+                writer = start_writer()
+                wait_for_writer(writer, writer_address)
+            for cluster, process in bots.items():
+                if process.poll() is not None:
+                    print(f"Cluster {cluster} exited with code {process.returncode}, restarting it")
+                    bots[cluster] = start_bot(cluster, total_shards, assignment[cluster])
+    finally:
+        for process in list(bots.values()) + [writer]:
+            if process.poll() is None:
+                process.terminate()
+        for process in list(bots.values()) + [writer]:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    writer_address = os.getenv('WRITER_ADDRESS', writer_address)
+    if sys.argv[1:] == ["writer"]:
+        import writer_service
+
+        try:
+            asyncio.run(writer_service.run_writer(writer_address))
+        except KeyboardInterrupt:
+            pass
+    else:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            run_cluster(int(os.getenv('CLUSTER_PROCESSES', str(os.cpu_count() or 1))),
+                        int(os.getenv('SHARD_COUNT') or 0) or None)
+        except KeyboardInterrupt:
+            pass
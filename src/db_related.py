@@ -6,51 +6,91 @@ Permission is hereby granted, free of charge, to any person obtaining a copy of
 The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
 """
 
+import asyncio
+import json
+import sqlite3
 from datetime import datetime, timedelta
 
+import aggregate_related
+import field_registry
+import kingdom_related
+import leaderboard_cache
+import metrics
+import player_index
+import writer_service
 from lang_db_connection import LangDBConnection
-from stat_db_connection import StatDBConnection
+from stat_db_connection import StatDBConnection, transaction_lock, write_transaction
 
 column_names = None
-create_statdb_query = """
-CREATE TABLE IF NOT EXISTS playerstats (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    guildid INTEGER,
-    discordid INTEGER, 
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    playername TEXT,
-    level INTEGER,
-    ascensionlevel INTEGER,
-    kingdom TEXT,
-    datecreated DATE,
-    playtime INTEGER,
-    travelersguild INTEGER,
-    anglersguild INTEGER,
-    circleofanguish INTEGER,
-    titanfelledguild INTEGER,
-    bladesoffinesse INTEGER,
-    spelunkingguild INTEGER,
-    seersguild INTEGER,
-    monumentalguild INTEGER,
-    globalrank INTEGER,
-    regionalrank INTEGER,
-    competitiverank INTEGER,
-    monstersslain INTEGER,
-    bossesslain INTEGER,
-    playersdefeated INTEGER,
-    questscompleted INTEGER,
-    areasexplored INTEGER,
-    areastaken INTEGER,
-    dungeonscleared INTEGER,
-    coliseumwins INTEGER,
-    itemsupgraded INTEGER,
-    fishcaught INTEGER,
-    distancetravelled INTEGER,
-    reputation INTEGER,
-    endlessrecord INTEGER,
-    entriescompleted INTEGER
+internal_columns = field_registry.internal_columns  # maintained by the bot, not shown to or entered by users
+# functions called with (guild id, player name) after a player's records changed in this process or in the writer;
+# the player name is None when a whole guild changed and both are None when anything may have changed
+record_listeners = []
+# uploads of the same player are decided and written one at a time, those of different players only share a stripe
+# when their names hash alike
+record_lock_stripes = 64
+record_locks = [asyncio.Lock() for _ in range(record_lock_stripes)]
+# an upload whose transaction timed out waiting for another process's write lock is rolled back and tried again
+upload_write_attempts = 3
+create_statdb_query = field_registry.create_table_sql("playerstats")
+# a player's latest record is the one with the newest timestamp, the higher id among records of the same second;
+# imported and backfilled records can be older than records with a lower id
+latest_order = "timestamp DESC, id DESC"
+# one row per (guild, player) holding a copy of the player's latest record, kept up to date by triggers
+create_latestdb_queries = [
+    "CREATE TABLE IF NOT EXISTS latest_playerstats AS SELECT * FROM playerstats WHERE 0",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_latest_player ON latest_playerstats (guildid, playername)",
+]
+# messages that show a leaderboard and are edited by live_scoreboard when its top entries change
+create_live_scoreboard_query = """
+CREATE TABLE IF NOT EXISTS live_scoreboards (
+id INTEGER PRIMARY KEY AUTOINCREMENT,
+guildid INTEGER,
+channelid INTEGER,
+messageid INTEGER,
+category TEXT,
+allservers INTEGER,
+period TEXT,
+size INTEGER,
+language TEXT,
+periodkey TEXT,
+entries TEXT
 );
 """
+# opt-in archive of uploaded screenshots, stored once under their content hash, see screenshot_archive
+create_screenshot_archive_queries = [
+    """
+    CREATE TABLE IF NOT EXISTS screenshots (
+    hash TEXT PRIMARY KEY,
+    filename TEXT,
+    size INTEGER,
+    storedsize INTEGER,
+    created DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS screenshot_uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recordid INTEGER,
+    guildid INTEGER,
+    image1 TEXT,
+    image2 TEXT,
+    language TEXT,
+    ocrversion TEXT,
+    checkedversion TEXT,
+    stats TEXT,
+    created DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_screenshot_uploads_record ON screenshot_uploads (recordid)",
+    # the screenshots of deleted records are not kept, the files are removed by prune_screenshots
+    """
+    CREATE TRIGGER IF NOT EXISTS screenshot_uploads_after_delete AFTER DELETE ON playerstats
+    BEGIN
+        DELETE FROM screenshot_uploads WHERE recordid = OLD.id;
+    END
+    """,
+]
 create_langdb_query = """
 CREATE TABLE IF NOT EXISTS langprefs (
 discordid INTEGER PRIMARY KEY,
@@ -59,29 +99,244 @@ language TEXT
 """
 
 
-async def setup_db():
+async def setup_db(wal=False):
     """
     Asynchronously sets up databases for storing player statistics and language preferences.
     Creates the necessary tables if they do not exist and initializes global variables.
+
+    :param wal: Optional; whether to switch the databases to write-ahead logging, so the bot processes of a cluster
+                can read while the writer service writes and backups can be taken while uploads are written.
     """
     # Stat DB
     global column_names
     stat_db = await StatDBConnection.get_instance()
     conn = await stat_db.get_connection()
-    cur = await conn.cursor()
-    await cur.execute(create_statdb_query)
-    await conn.execute("CREATE INDEX IF NOT EXISTS idx_guildid ON playerstats (guildid)")
-    await conn.commit()
-    column_names = await fetch_column_names(cur, True)
+    if wal:
+        await conn.execute("PRAGMA journal_mode=WAL")
+    # the schema and the derived tables are written before any other write may run
+    async with transaction_lock:
+        cur = await conn.cursor()
+        await cur.execute(create_statdb_query)
+        await add_missing_column(conn, "playerstats", "kingdomid INTEGER")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_guildid ON playerstats (guildid)")
+        # a player's records in time order, also for finding a record's previous and next record
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_guild_player ON playerstats (guildid, playername, timestamp)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_kingdomid ON playerstats (kingdomid)")
+        await conn.execute("DROP INDEX IF EXISTS idx_player_records")  # covered by idx_guild_player
+        # all servers progress is looked up by player name alone
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_playername ON playerstats (playername)")
+        await cur.execute(create_live_scoreboard_query)
+        for query in create_screenshot_archive_queries:
+            await conn.execute(query)
+        await conn.commit()
+        column_names = await fetch_column_names(cur, True)
+        await kingdom_related.load_kingdoms(conn)
+        rebuild_aggregates = await aggregate_related.setup_tables(conn, ranked_categories())
+        await setup_latest_table(conn)
+        # after the triggers are set up, they move the derived rows of merged kingdoms
+        if await kingdom_related.renormalize_kingdoms(conn):
+            await kingdom_related.load_kingdoms(conn)
+        await backfill_kingdom_ids(conn)
+        if rebuild_aggregates:
+            await aggregate_related.rebuild(conn)
+        await leaderboard_cache.load(conn, ranked_categories())
+        await player_index.load(conn)
 
     # Lang DB
     lang_db = await LangDBConnection.get_instance()
     conn = await lang_db.get_connection()
+    if wal:
+        await conn.execute("PRAGMA journal_mode=WAL")
     cur = await conn.cursor()
     await cur.execute(create_langdb_query)
     await conn.commit()
 
 
+async def setup_db_reader():
+    """
+    Sets up the read connections of a cluster bot process. The writer service owns the schema and every write,
+    so only the in-memory state is loaded here. Also called after the connection to the writer was lost.
+    """
+    global column_names
+    conn = await get_stat_connection()
+    await conn.execute("PRAGMA query_only = ON")
+    cur = await conn.cursor()
+    column_names = await fetch_column_names(cur, True)
+    await kingdom_related.load_kingdoms(conn)
+    aggregate_related.categories[:] = ranked_categories()
+    aggregate_related.invalidate()
+    leaderboard_cache.persist = False
+    await leaderboard_cache.load(conn, ranked_categories())
+    await player_index.load(conn)
+    notify_record_listeners(None, None)  # events may have been missed, everything counts as changed
+
+    lang_db = await LangDBConnection.get_instance()
+    conn = await lang_db.get_connection()
+    await conn.execute("PRAGMA query_only = ON")
+
+
+writer_service.event_handler("resync")(setup_db_reader)
+
+
+async def setup_latest_table(conn):
+    """
+    Creates the latest record table with its triggers and per category indexes,
+    and fills it from the existing records the first time it is created.
+
+    :param conn: The stat database connection.
+    """
+    for query in create_latestdb_queries:
+        await conn.execute(query)
+    await add_missing_column(conn, "latest_playerstats", "kingdomid INTEGER")
+    async with conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'latest_after_insert'") \
+            as cur:
+        trigger = await cur.fetchone()
+    ordered_by_time = trigger is not None and "timestamp" in trigger[0]
+    # the triggers are generated from the categories, so they are recreated on every start
+    for query in latest_trigger_queries() + aggregate_related.create_trigger_queries():
+        await conn.execute(query)
+    for category in ranked_categories():
+        # id is part of the index so keyset pages of a scoreboard need no extra sort for ties
+        await conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_latest_{category} ON latest_playerstats ({category}, id)")
+        await conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_latest_guild_{category} ON latest_playerstats (guildid, {category}, id)")
+        await conn.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_latest_kingdom_{category} ON latest_playerstats (kingdomid, {category}, id)
+        """)
+
+    async with conn.execute("SELECT EXISTS (SELECT 1 FROM latest_playerstats)") as cur:
+        has_rows, = await cur.fetchone()
+    if not has_rows or not ordered_by_time:
+        # databases filled while the latest record was the one with the highest id are filled again once
+        await conn.execute("DELETE FROM latest_playerstats")
+        await conn.execute(f"""
+            INSERT INTO latest_playerstats
+            SELECT * FROM playerstats WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY guildid, playername ORDER BY {latest_order}) AS position
+                    FROM playerstats
+                ) WHERE position = 1
+            )
+        """)
+    await conn.commit()
+
+
+def latest_trigger_queries():
+    """
+    Returns the queries (re)creating the triggers that copy the latest record of a player into the latest record
+    table. The old latest record is deleted before the new one is inserted, so the triggers of the latest record
+    table see both.
+    """
+    newest_record = f"""
+        INSERT INTO latest_playerstats SELECT * FROM playerstats
+        WHERE guildid = {{0}}.guildid AND playername = {{0}}.playername ORDER BY {latest_order} LIMIT 1;
+    """
+    return [
+        "DROP TRIGGER IF EXISTS latest_after_insert",
+        "DROP TRIGGER IF EXISTS latest_after_update",
+        "DROP TRIGGER IF EXISTS latest_after_delete",
+        """
+        CREATE TRIGGER latest_after_insert AFTER INSERT ON playerstats
+        WHEN NOT EXISTS (SELECT 1 FROM latest_playerstats WHERE guildid = NEW.guildid AND playername = NEW.playername
+                         AND (timestamp, id) > (NEW.timestamp, NEW.id))
+        BEGIN
+            DELETE FROM latest_playerstats WHERE guildid = NEW.guildid AND playername = NEW.playername;
+            INSERT INTO latest_playerstats SELECT * FROM playerstats WHERE id = NEW.id;
+        END
+        """,
+        # an update of the latest record may also change its time, so the latest record is looked up again
+        f"""
+        CREATE TRIGGER latest_after_update AFTER UPDATE ON playerstats
+        WHEN NOT EXISTS (SELECT 1 FROM latest_playerstats WHERE guildid = NEW.guildid AND playername = NEW.playername
+                         AND (timestamp, id) > (NEW.timestamp, NEW.id) AND id != NEW.id)
+        OR NEW.id = (SELECT id FROM latest_playerstats WHERE guildid = NEW.guildid AND playername = NEW.playername)
+        BEGIN
+            DELETE FROM latest_playerstats WHERE guildid = NEW.guildid AND playername = NEW.playername;
+            {newest_record.format('NEW')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER latest_after_delete AFTER DELETE ON playerstats
+        WHEN OLD.id = (SELECT id FROM latest_playerstats WHERE guildid = OLD.guildid AND playername = OLD.playername)
+        BEGIN
+            DELETE FROM latest_playerstats WHERE guildid = OLD.guildid AND playername = OLD.playername;
+            {newest_record.format('OLD')}
+        END
+        """,
+    ]
+
+
+async def add_missing_column(conn, table, column_definition):
+    """
+    Adds a column to an existing table of an older database.
+
+    :param conn: The stat database connection.
+    :param table: The name of the table.
+    :param column_definition: The column name followed by its type.
+    """
+    async with conn.execute(f"PRAGMA table_info({table})") as cur:
+        existing_columns = [column[1] for column in await cur.fetchall()]
+    if column_definition.split()[0] not in existing_columns:
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column_definition}")
+
+
+async def backfill_kingdom_ids(conn):
+    """
+    Links records that were stored before the kingdom table existed to their kingdom.
+
+    :param conn: The stat database connection.
+    """
+    async with conn.execute("""
+        SELECT DISTINCT kingdom FROM playerstats WHERE kingdomid IS NULL AND kingdom IS NOT NULL
+    """) as cur:
+        kingdoms = [row[0] for row in await cur.fetchall()]
+    for kingdom in kingdoms:
+        kingdom_id = await kingdom_related.resolve_kingdom(conn, kingdom)
+        if kingdom_id is not None:
+            await conn.execute("UPDATE playerstats SET kingdomid = ? WHERE kingdom = ? AND kingdomid IS NULL",
+                               (kingdom_id, kingdom))
+    await conn.commit()
+
+
+def kingdom_filter_id(kingdom):
+    """
+    Resolves a user typed kingdom name for filtering. Unknown kingdoms map to -1, which matches no record.
+
+    :param kingdom: The kingdom name.
+    :return: The kingdom id to filter by.
+    """
+    kingdom_id = kingdom_related.find_kingdom(kingdom)
+    return kingdom_id if kingdom_id is not None else -1
+
+
+def ranked_categories():
+    """
+    Returns the data columns that players can be ranked by.
+    """
+    return [column for column in column_names if column in field_registry.ranked_columns]
+
+
+async def close_db():
+    """
+    Closes the database connections, e.g. at the end of a command line tool.
+    """
+    for connection_class in (StatDBConnection, LangDBConnection):
+        if connection_class._instance is not None:
+            conn = await connection_class._instance.get_connection()
+            await conn.close()
+            connection_class._instance = None
+
+
+async def get_stat_connection():
+    """
+    Returns the shared connection of the player statistics database.
+    """
+    db = await StatDBConnection.get_instance()
+    return await db.get_connection()
+
+
 def get_column_names():
     """
     Returns a list of column names from the player statistics database.
@@ -89,56 +344,97 @@ def get_column_names():
     return column_names
 
 
+def player_lock(guild_id, playername):
+    """
+    Returns the lock serializing the writes to a player's records.
+    """
+    return record_locks[hash((guild_id, playername)) % record_lock_stripes]
+
+
+@writer_service.writer_call
 async def check_and_update_record(playerstats, guild_id, playername):
     """
     Checks existing records for a player in the database and updates or inserts data accordingly.
+    The decision and the write happen under the player's lock and in one immediate transaction, so two uploads
+    arriving at the same time are merged instead of both inserting, also when another process writes the database.
 
     :param playerstats: Dictionary containing player statistics.
     :param guild_id: The guild ID associated with the player's record.
     :param playername: The name of the player.
     :return: A tuple containing a response message, the changed record and if applicable the differences.
     """
+    db = await StatDBConnection.get_instance()
+    conn = await db.get_connection()
+
+    async with player_lock(guild_id, playername):
+        cur = await conn.cursor()
+        for attempt in range(upload_write_attempts):
+            try:
+                async with write_transaction(conn):
+                    # the writes add columns to the stats, every attempt starts from the uploaded ones
+                    response, changed_row_id, differences = await upsert_record(cur, conn, dict(playerstats),
+                                                                                guild_id, playername)
+                break
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == upload_write_attempts - 1:
+                    raise
+                print(f"Upload of {playername} waited too long for the database's write lock, trying again")
+        await cur.close()
+        await records_changed(conn, guild_id, playername)
+        # closed right away, an unfinished statement keeps the connection's read snapshot and the next write
+        # transaction of any task on it fails at once when another process wrote in between
+        async with conn.execute("SELECT * FROM playerstats WHERE id = ?", (changed_row_id,)) as cur:
+            changed_record = field_registry.record_from_row(await cur.fetchone())
+
+    return response, changed_record, differences
+
+
+async def upsert_record(cur, conn, playerstats, guild_id, playername):
+    """
+    Merges an upload into the player's most recent record, updates the last record of the day or inserts a new
+    one. The caller holds the player's lock and the transaction.
+
+    :return: A tuple containing the response message, the ID of the changed record and the differences.
+    """
     day_str = datetime.utcnow().strftime('%Y-%m-%d')
     current_time = datetime.utcnow()
     response = "recordinserted"
-    changed_row_id = None
     differences = None
-    global column_names
-
-    db = await StatDBConnection.get_instance()
-    conn = await db.get_connection()
-    cur = await conn.cursor()
 
     # check if there are already two records for this day
-    await cur.execute("""
+    await cur.execute(f"""
                 SELECT *
                 FROM playerstats
                 WHERE guildid = ? AND playername = ?
-                ORDER BY timestamp DESC
+                ORDER BY {latest_order}
                 LIMIT 2
             """, (guild_id, playername))
 
     records = await cur.fetchall()
 
+    # link the recognized kingdom to its normalized kingdom
+    if playerstats.get('kingdom'):
+        playerstats['kingdomid'] = await kingdom_related.resolve_kingdom(conn, playerstats['kingdom'])
+
     if not records:
         # Insert a new record if there are no existing records
         changed_row_id = await insert_new_record(cur, playerstats)
     else:
-        most_recent_record = records[0]
-        most_recent_record_id = most_recent_record[0]
-        most_recent_timestamp_str = most_recent_record[3]
-        most_recent_timestamp = datetime.strptime(most_recent_timestamp_str, '%Y-%m-%d %H:%M:%S')
+        most_recent_record = field_registry.Record(records[0])
+        most_recent_record_id = most_recent_record.id
+        most_recent_timestamp = datetime.strptime(most_recent_record.timestamp, '%Y-%m-%d %H:%M:%S')
 
         if current_time - most_recent_timestamp < timedelta(minutes=1):
             # merge and update the most recent record if its less than 1 minute old
-            current_record_dict = {column_names[i]: most_recent_record[i + 5] for i in range(len(column_names))}
-            merged_data = merge_record(current_record_dict, playerstats)
+            merged_data = merge_record(most_recent_record.stats(), playerstats)
+            if merged_data.get('kingdom'):
+                merged_data['kingdomid'] = await kingdom_related.resolve_kingdom(conn, merged_data['kingdom'])
 
             # update the record in the database
             changed_row_id = await update_merged_record(cur, merged_data, most_recent_record_id)
             response = "recordmerged"
-        elif len(records) >= 2 and datetime.strptime(records[1][3], '%Y-%m-%d %H:%M:%S').strftime(
-                '%Y-%m-%d') == day_str:
+        elif len(records) >= 2 and datetime.strptime(field_registry.Record(records[1]).timestamp,
+                                                     '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d') == day_str:
             # if there are two or more records this day, update the most recent
             changed_row_id = await update_record(cur, playerstats, most_recent_record_id)
             response = "recordupdated"
@@ -150,12 +446,32 @@ async def check_and_update_record(playerstats, guild_id, playername):
         if response != "recordmerged":
             differences = calc_latest_difference(playerstats, most_recent_record)
 
-    await conn.commit()
-    await cur.execute("SELECT * FROM playerstats WHERE id = ?", (changed_row_id,))
-    changed_record = await cur.fetchone()
-    changed_record = changed_record[5:]  # extract the correct column values
+    return response, changed_row_id, differences
+
+
+async def records_changed(conn, guild_id, playername):
+    """
+    Brings the caches derived from the records up to date after a committed write to a player's records.
+
+    :param conn: The stat database connection.
+    :param guild_id: The guild ID of the player.
+    :param playername: The name of the player.
+    """
+    await leaderboard_cache.player_changed(conn, guild_id, playername)
+    await player_index.player_changed(conn, guild_id, playername)
+    aggregate_related.invalidate()
+    notify_record_listeners(guild_id, playername)
+    writer_service.publish("records_changed", guild_id, playername)
 
-    return response, changed_record, differences
+
+@writer_service.event_handler("records_changed")
+async def apply_records_changed(guild_id, playername):
+    await records_changed(await get_stat_connection(), guild_id, playername)
+
+
+def notify_record_listeners(guild_id, playername):
+    for listener in record_listeners:
+        listener(guild_id, playername)
 
 
 def calc_latest_difference(playerstats, latest_record):
@@ -163,11 +479,11 @@ def calc_latest_difference(playerstats, latest_record):
     Calculates differences between inserted record and the previous record.
 
     :param playerstats: Dictionary containing the inserted record player stats.
-    :param latest_record: Latest record from the database
+    :param latest_record: Latest record from the database, as a field_registry.Record
     :return: Dictionary containing differences between inserted record and the previous
     """
     differences = dict()
-    for column, value in zip(column_names, latest_record[5:]):
+    for column, value in latest_record.stats().items():
         try:
             safe_value = int(value) if value is not None else 0
         except ValueError:
@@ -191,7 +507,8 @@ async def fetch_column_names(cur, data_columns=False):
     columns = await cur.fetchall()
     if data_columns:
         # Start at column 'level'
-        return [column[1] for column in columns][5:]
+        return [column[1] for column in columns[field_registry.first_data_index:]
+                if column[1] not in internal_columns]
     else:
         return [column[1] for column in columns]
 
@@ -213,6 +530,7 @@ async def update_record(cur, playerstats, record_id):
     return record_id
 
 
+@writer_service.writer_call
 async def update_latest_record(discord_id, category, new_value):
     """
     Updates the latest record for a given Discord ID with a new value for a specified category.
@@ -226,23 +544,24 @@ async def update_latest_record(discord_id, category, new_value):
     conn = await db.get_connection()
 
     cur = await conn.cursor()
-    await cur.execute("""
-                SELECT id FROM playerstats
+    await cur.execute(f"""
+                SELECT id, guildid, playername FROM playerstats
                 WHERE discordid = ?
-                ORDER BY timestamp DESC
+                ORDER BY {latest_order}
                 LIMIT 1
     """, (discord_id,))
     latest_record = await cur.fetchone()
     if latest_record:
-        latest_record_id = latest_record[0]
+        latest_record_id, guild_id, playername = latest_record
 
         # Update the specific column in the latest record
-        update_query = f"UPDATE playerstats SET {category} = ? WHERE id = ?"
-        await cur.execute(update_query, (new_value, latest_record_id))
-        await conn.commit()
+        async with write_transaction(conn):
+            await update_category(conn, latest_record_id, category, new_value)
+        await records_changed(conn, guild_id, playername)
     return latest_record
 
 
+@writer_service.writer_call
 async def update_specific_record(guild_id, playername, year, month, day, which, category, new_value):
     """
     Updates a specific record for a player with a new value for a specified category.
@@ -267,7 +586,7 @@ async def update_specific_record(guild_id, playername, year, month, day, which,
     query_find_id = f"""
         SELECT id FROM playerstats p1
         WHERE guildid = ? AND playername = ? AND {time_frame_filter}
-        ORDER BY timestamp {order_by}
+        ORDER BY timestamp {order_by}, id {order_by}
         LIMIT 1
     """
     cur = await conn.cursor()
@@ -277,12 +596,30 @@ async def update_specific_record(guild_id, playername, year, month, day, which,
         record_id = record[0]
 
         # update the specific record
-        query_update_record = f"UPDATE playerstats SET {category} = ? WHERE id = ?"
-        await cur.execute(query_update_record, (new_value, record_id))
-        await conn.commit()
+        async with write_transaction(conn):
+            await update_category(conn, record_id, category, new_value)
+        await records_changed(conn, guild_id, playername)
     return record
 
 
+async def update_category(conn, record_id, category, new_value):
+    """
+    Sets a single category of a record, keeping the kingdom link in sync when the kingdom changes.
+
+    :param conn: The stat database connection.
+    :param record_id: The ID of the record to update.
+    :param category: The name of the statistic to update.
+    :param new_value: The new value for the category.
+    """
+    if category == "kingdom":
+        kingdom_id = await kingdom_related.resolve_kingdom(conn, new_value)
+        await conn.execute("UPDATE playerstats SET kingdom = ?, kingdomid = ? WHERE id = ?",
+                           (new_value, kingdom_id, record_id))
+    else:
+        await conn.execute(f"UPDATE playerstats SET {category} = ? WHERE id = ?", (new_value, record_id))
+
+
+@writer_service.writer_call
 async def delete_specific_record(record_id):
     """
     deletes a specific record for a player
@@ -292,9 +629,13 @@ async def delete_specific_record(record_id):
     db = await StatDBConnection.get_instance()
     conn = await db.get_connection()
     cur = await conn.cursor()
+    await cur.execute("SELECT guildid, playername FROM playerstats WHERE id = ?", (record_id,))
+    record = await cur.fetchone()
     query_delete_record = f"DELETE FROM playerstats WHERE id = ?"
-    await cur.execute(query_delete_record, (record_id,))
-    await conn.commit()
+    async with write_transaction(conn):
+        await cur.execute(query_delete_record, (record_id,))
+    if record:
+        await records_changed(conn, *record)
 
 
 async def fetch_specific_record(guild_id, playername, year, month, day, which):
@@ -319,18 +660,19 @@ async def fetch_specific_record(guild_id, playername, year, month, day, which):
     query_find_record = f"""
            SELECT * FROM playerstats p1
            WHERE guildid = ? AND playername = ? AND {time_frame_filter}
-           ORDER BY timestamp {order_by}
+           ORDER BY timestamp {order_by}, id {order_by}
            LIMIT 1
        """
     cur = await conn.cursor()
     await cur.execute(query_find_record, (guild_id, playername))
     record = await cur.fetchone()
     if record:
-        return record[5:], record[0]
+        return field_registry.Record(record), record[0]
     else:
         return None
 
 
+@writer_service.writer_call
 async def purge_player_records(guild_id, playername):
     """
     deletes all records of a player
@@ -344,9 +686,10 @@ async def purge_player_records(guild_id, playername):
     conn = await db.get_connection()
     cur = await conn.cursor()
     query_delete_records = f"DELETE FROM playerstats WHERE guildid = ? AND playername=?"
-    await cur.execute(query_delete_records, (guild_id, playername))
-    await conn.commit()
+    async with write_transaction(conn):
+        await cur.execute(query_delete_records, (guild_id, playername))
     deleted_count = cur.rowcount
+    await records_changed(conn, guild_id, playername)
     return deleted_count
 
 
@@ -398,29 +741,25 @@ async def calculate_changes(guild_id, category, scope, year, month=None, day=Non
     """
     params = [] if scope else [guild_id]
 
-    # create the query
+    # the first and the last record of every player in the time frame, found in one pass over the time frame.
+    # Without a guild or kingdom to narrow it down the table is read in order, reading it in the order of the
+    # playername index looks up every record one by one
     query = f"""
-    SELECT p1.playername, p1.guildid, p1.{category} as before, p2.{category} as after
-    FROM playerstats p1
-    INNER JOIN playerstats p2 ON p1.playername = p2.playername {("" if scope else "AND p1.guildid = p2.guildid")}
-    WHERE {construct_time_frame_filter(1, year, month, day, week)} {("" if scope else "AND p1.guildid = ?")}
-  AND p1.id = (
-        SELECT MIN(p3.id)
-        FROM playerstats p3
-        WHERE p3.playername = p1.playername {("" if scope else "AND p3.guildid = p1.guildid")}
-        AND {construct_time_frame_filter(3, year, month, day, week)} {("" if not kingdom else "AND p3.kingdom = ?")}
-    )
-    AND p2.id = (
-        SELECT MAX(p4.id)
-        FROM playerstats p4
-        WHERE p4.playername = p2.playername {("" if scope else "AND p4.guildid = p2.guildid")}
-        AND {construct_time_frame_filter(4, year, month, day, week)} {("" if not kingdom else "AND p4.kingdom = ?")}
+    SELECT playername, guildid, before, after FROM (
+        SELECT p1.playername, FIRST_VALUE(p1.guildid) OVER w AS guildid, FIRST_VALUE(p1.{category}) OVER w AS before,
+               LAST_VALUE(p1.{category}) OVER w AS after, ROW_NUMBER() OVER w AS position
+        FROM playerstats p1 {("NOT INDEXED" if scope and not kingdom else "")}
+        WHERE {construct_time_frame_filter(1, year, month, day, week)} {("" if scope else "AND p1.guildid = ?")}
+        {("" if not kingdom else "AND p1.kingdomid = ?")}
+        WINDOW w AS (PARTITION BY p1.playername ORDER BY p1.timestamp, p1.id
+                     ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
     )
+    WHERE position = 1
     """
 
-    # append kingdom to params if specified for subqueries
+    # append kingdom to params if specified
     if kingdom:
-        params.extend([kingdom, kingdom])
+        params.append(kingdom_filter_id(kingdom))
 
     db = await StatDBConnection.get_instance()
     conn = await db.get_connection()
@@ -461,49 +800,542 @@ async def get_scoreboard(guild_id, category, scope, ascending, limit, kingdom=No
     :param kingdom: Optional; the kingdom to filter the scoreboard by.
     :return: A list of dictionaries representing the scoreboard, or None if no records were found.
     """
-    order = 'ASC' if ascending else 'DESC'
+    db = await StatDBConnection.get_instance()
+    conn = await db.get_connection()
 
-    where_clause = f'WHERE p.{category} IS NOT NULL {("" if scope else "AND p.guildid = ? ")}'
+    if scope and not kingdom:
+        # all servers scoreboards are served from the in memory top lists
+        page = await leaderboard_cache.get_page(conn, category, ascending, limit)
+        if page is not None:
+            return page[0] or None
+
+    order = 'ASC' if ascending else 'DESC'
 
-    # if kingdom is specified, add it to the WHERE clause
+    # the same entries as the top lists: one per player and guild, ties broken by record id
+    where_clause = f"WHERE {category} IS NOT NULL {('' if scope else 'AND guildid = ? ')}"
+    params = [] if scope else [guild_id]
     if kingdom:
-        where_clause += "AND p.kingdom = ?"
+        where_clause += "AND kingdomid = ? "
+        params.append(kingdom_filter_id(kingdom))
+    params.append(limit)
+
+    cur = await conn.cursor()
+    await cur.execute(f"""
+        SELECT playername, {category}
+        FROM latest_playerstats
+        {where_clause}
+        ORDER BY {category} {order}, id {order}
+        LIMIT ?
+    """, params)
+    records = await cur.fetchall()
+
+    if records:  # check if any records were returned
+        scoreboard = [{'playername': record[0], "value": record[1]} for record in records]
+        return scoreboard
+    else:
+        return None
+
+
+async def get_group_scoreboard(group_type, category, metric, ascending, limit, year=None, month=None, day=None,
+                               week=None):
+    """
+    Retrieves a scoreboard of guilds or kingdoms. Without a year the groups are ranked by their members' latest
+    values, otherwise by the progress their members made in the time frame.
+
+    :param group_type: 'guild' or 'kingdom'.
+    :param category: The statistic to generate the scoreboard for.
+    :param metric: 'total', 'average' or 'members'.
+    :param ascending: Boolean indicating whether to sort the scoreboard in ascending order.
+    :param limit: The maximum number of groups to include.
+    :param year: Optional; the year of the time frame.
+    :param month: Optional; the month of the time frame.
+    :param day: Optional; the day of the time frame.
+    :param week: Optional; the week number of the time frame.
+    :return: A list of dictionaries with the group id, value and member count.
+    """
+    db = await StatDBConnection.get_instance()
+    conn = await db.get_connection()
+    start_date = end_date = None
+    if year:
+        start_date, end_date = get_start_end_dates(year, month, day, week)
+    return await aggregate_related.get_group_scoreboard(conn, group_type, category, metric, ascending, limit,
+                                                        start_date, end_date)
+
+
+async def stream_guild_records(guild_id, batch_size=5000):
+    """
+    Streams all records of a guild in id order without loading the guild into memory.
+
+    :param guild_id: The ID of the guild to stream the records of.
+    :param batch_size: The number of rows fetched from the cursor at once.
+    :return: An async generator that first yields the list of column names and then each record.
+    """
+    db = await StatDBConnection.get_instance()
+    conn = await db.get_connection()
+    cur = await conn.cursor()
+    cur.arraysize = batch_size
+
+    await cur.execute("SELECT * FROM playerstats WHERE guildid = ? ORDER BY id", (guild_id,))
+    yield [description[0] for description in cur.description]
+    while True:
+        rows = await cur.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+    await cur.close()
+
+
+@writer_service.writer_call
+async def insert_records_bulk(guild_id, records, batch_size=5000):
+    """
+    Bulk inserts records into a guild using batched executemany calls inside a single transaction.
+    Record ids are newly assigned and the guild id is replaced by the target guild.
+
+    :param guild_id: The ID of the guild to import the records into.
+    :param records: An iterable of dictionaries mapping column names to values.
+    :param batch_size: The number of rows inserted per executemany call.
+    :return: The number of imported records.
+    """
+    db = await StatDBConnection.get_instance()
+    conn = await db.get_connection()
+    cur = await conn.cursor()
+    allowed_columns = set(await fetch_column_names(cur)) - {'id', 'guildid'} - set(internal_columns)
+
+    imported = 0
+    batch = []
+    insert_query = None
+    columns = None
+    async with write_transaction(conn):
+        for record in records:
+            if columns is None:
+                # the first record determines the column layout of the whole import
+                columns = [column for column in record if column in allowed_columns]
+                quoted_columns = ', '.join([f'"{column}"' for column in ['guildid', 'kingdomid'] + columns])
+                placeholders = ', '.join(['?'] * (len(columns) + 2))
+                insert_query = f'INSERT INTO playerstats ({quoted_columns}) VALUES ({placeholders})'
+            kingdom = record.get('kingdom')
+            kingdom_id = await kingdom_related.resolve_kingdom(conn, kingdom) if kingdom else None
+            batch.append([guild_id, kingdom_id] + [record.get(column) for column in columns])
+            if len(batch) >= batch_size:
+                await cur.executemany(insert_query, batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            await cur.executemany(insert_query, batch)
+            imported += len(batch)
+    await guild_records_imported(conn, guild_id)
+    return imported
+
+
+async def get_record_times(guild_id):
+    """
+    Returns the times of the records of every player of a guild.
+
+    :param guild_id: The ID of the guild.
+    :return: A set of (playername, timestamp) tuples.
+    """
+    conn = await get_stat_connection()
+    async with conn.execute("SELECT playername, timestamp FROM playerstats WHERE guildid = ?", (guild_id,)) as cur:
+        return set(await cur.fetchall())
+
+
+async def guild_records_imported(conn, guild_id):
+    """
+    Brings the caches derived from the records up to date after a committed bulk import into a guild.
+
+    :param conn: The stat database connection.
+    :param guild_id: The guild the records were imported into.
+    """
+    await leaderboard_cache.invalidate(conn)
+    await player_index.load_guild(conn, guild_id)
+    aggregate_related.invalidate()
+    notify_record_listeners(guild_id, None)
+    writer_service.publish("guild_records_imported", guild_id)
+
+
+@writer_service.event_handler("guild_records_imported")
+async def apply_guild_records_imported(guild_id):
+    await guild_records_imported(await get_stat_connection(), guild_id)
+
+
+async def get_history_points(guild_id, playername, categories, days=None, points=200):
+    """
+    Retrieves a player's values in the given categories over time, downsampled to at most `points` buckets.
+    Each bucket is represented by the latest record inside it.
 
+    :param guild_id: The guild ID associated with the player's records.
+    :param playername: The name of the player.
+    :param categories: A list of category column names.
+    :param days: Optional; only records of the last `days` days are used. All records if None.
+    :param points: The maximum number of points to return.
+    :return: A list of tuples (record id, timestamp, value per category) ordered by time.
+    """
+    selected_columns = ', '.join([f"p.{category}" for category in categories])
+    time_filter = "AND p.timestamp >= datetime('now', ?)" if days else ""
     query = f"""
-            SELECT p.playername, p.{category}
+        WITH player AS (
+            SELECT p.id, p.timestamp, julianday(p.timestamp) AS day, {selected_columns}
             FROM playerstats p
-            INNER JOIN (
-                SELECT playername, MAX(id) as latest
-                FROM playerstats
-                {("" if scope else "WHERE guildid = ?")}
-                GROUP BY playername
-            ) as latest_record ON p.playername = latest_record.playername AND p.id = latest_record.latest
-            {where_clause}
-            ORDER BY p.{category} {order}
-            LIMIT ?
-        """
+            WHERE p.guildid = ? AND p.playername = ? {time_filter}
+        ), bounds AS (
+            SELECT MIN(day) AS first_day, MAX(day) - MIN(day) AS span FROM player
+        )
+        SELECT id AS last_id, MAX(timestamp) AS timestamp, {', '.join(categories)}
+        FROM player, bounds
+        GROUP BY CAST((day - first_day) * ? / MAX(span, 0.000001) AS INTEGER)
+        ORDER BY timestamp
+    """
+    params = [guild_id, playername]
+    if days:
+        params.append(f"-{days} days")
+    params.append(points - 1)
 
     db = await StatDBConnection.get_instance()
     conn = await db.get_connection()
     cur = await conn.cursor()
+    await cur.execute(query, params)
+    return await cur.fetchall()
+
+
+async def get_scoreboard_page(guild_id, category, scope, ascending, limit, kingdom=None, after=None):
+    """
+    Retrieves one page of a scoreboard from the latest record table using a keyset cursor,
+    so every page costs the same no matter how far into the scoreboard it is.
+
+    :param guild_id: The ID of the guild for which to retrieve the scoreboard.
+    :param category: The statistic to generate the scoreboard for.
+    :param scope: The scope boolean of the scoreboard, where true is all servers.
+    :param ascending: Boolean indicating whether to sort the scoreboard in ascending order.
+    :param limit: The number of entries on a page.
+    :param kingdom: Optional; the kingdom to filter the scoreboard by.
+    :param after: Optional; the (value, id) cursor of the last entry of the previous page.
+    :return: A tuple (entries, cursor) where cursor points to the next page, or is None on the last page.
+    """
+    db = await StatDBConnection.get_instance()
+    conn = await db.get_connection()
+
+    if scope and not kingdom:
+        # all servers pages are served from the in memory top lists as long as they reach that far
+        page = await leaderboard_cache.get_page(conn, category, ascending, limit, after)
+        if page is not None:
+            return page
 
-    # lrepare the parameters for the query
-    params = [] if scope else [guild_id, guild_id]
+    order = 'ASC' if ascending else 'DESC'
+    comparison = '>' if ascending else '<'
+
+    where_clause = f"WHERE {category} IS NOT NULL {('' if scope else 'AND guildid = ? ')}"
+    params = [] if scope else [guild_id]
     if kingdom:
-        params.extend([kingdom, limit])
-    else:
-        params.append(limit)
+        where_clause += "AND kingdomid = ? "
+        params.append(kingdom_filter_id(kingdom))
+    if after:
+        where_clause += f"AND ({category}, id) {comparison} (?, ?) "
+        params.extend(after)
+    params.append(limit + 1)  # one more to know whether a next page exists
 
-    await cur.execute(query, params)
+    cur = await conn.cursor()
+    await cur.execute(f"""
+        SELECT playername, {category}, id
+        FROM latest_playerstats
+        {where_clause}
+        ORDER BY {category} {order}, id {order}
+        LIMIT ?
+    """, params)
     records = await cur.fetchall()
 
-    if records:  # check if any records were returned
-        scoreboard = [{'playername': record[0], "value": record[1]} for record in records]
-        return scoreboard
-    else:
+    entries = [{'playername': record[0], 'value': record[1]} for record in records[:limit]]
+    next_cursor = (records[limit - 1][1], records[limit - 1][2]) if len(records) > limit else None
+    return entries, next_cursor
+
+
+async def get_rank(guild_id, playername, category, scope, ascending, kingdom=None):
+    """
+    Retrieves the position of a player on the leaderboard of a category, using the latest record table.
+    The position is a count over the category index instead of a sorted scan of all records.
+
+    :param guild_id: The ID of the guild the player belongs to.
+    :param playername: The name of the player.
+    :param category: The statistic to rank by.
+    :param scope: The scope boolean of the leaderboard, where true is all servers.
+    :param ascending: Boolean indicating whether lower values rank higher.
+    :param kingdom: Optional; the kingdom to restrict the leaderboard to.
+    :return: A dictionary with value, position, total, above and below, or None if the player has no value.
+    """
+    db = await StatDBConnection.get_instance()
+    conn = await db.get_connection()
+    cur = await conn.cursor()
+
+    await cur.execute(f"SELECT {category} FROM latest_playerstats WHERE guildid = ? AND playername = ?",
+                      (guild_id, playername))
+    record = await cur.fetchone()
+    if not record or record[0] is None:
         return None
+    value = record[0]
+
+    scope_filter = "" if scope else "AND guildid = ? "
+    scope_params = [] if scope else [guild_id]
+    if kingdom:
+        scope_filter += "AND kingdomid = ? "
+        scope_params.append(kingdom_filter_id(kingdom))
+    better, worse = ("<", ">") if ascending else (">", "<")
+
+    await cur.execute(f"""
+        SELECT COUNT(*) FROM latest_playerstats WHERE {category} {better} ? {scope_filter}
+    """, [value] + scope_params)
+    better_count, = await cur.fetchone()
+    await cur.execute(f"""
+        SELECT COUNT(*) FROM latest_playerstats WHERE {category} IS NOT NULL {scope_filter}
+    """, scope_params)
+    total, = await cur.fetchone()
+
+    # the closest players right above and below
+    neighbors = []
+    for comparison, order in ((better, "ASC" if not ascending else "DESC"), (worse, "DESC" if not ascending else "ASC")):
+        await cur.execute(f"""
+            SELECT playername, {category} FROM latest_playerstats
+            WHERE {category} {comparison} ? {scope_filter}
+            ORDER BY {category} {order}
+            LIMIT 1
+        """, [value] + scope_params)
+        neighbor = await cur.fetchone()
+        neighbors.append({'playername': neighbor[0], 'value': neighbor[1]} if neighbor else None)
+
+    return {'value': value, 'position': better_count + 1, 'total': total,
+            'above': neighbors[0], 'below': neighbors[1]}
+
+
+async def get_player_value(guild_id, playername, category):
+    """
+    Retrieves a player's latest value in a category from the latest record table.
+
+    :param guild_id: The guild ID of the player.
+    :param playername: The name of the player.
+    :param category: The category column.
+    :return: The value, or None if the player has no value in the category.
+    """
+    conn = await get_stat_connection()
+    cur = await conn.cursor()
+    await cur.execute(f"SELECT {category} FROM latest_playerstats WHERE guildid = ? AND playername = ?",
+                      (guild_id, playername))
+    record = await cur.fetchone()
+    return record[0] if record else None
+
+
+async def get_player_progress(guild_id, playername, category, scope, year, month=None, day=None, week=None):
+    """
+    Calculates a single player's progress in a time frame, the way calculate_changes does for every player.
+
+    :param guild_id: The guild ID of the player.
+    :param playername: The name of the player.
+    :param category: The category column.
+    :param scope: The scope boolean, where true compares the player's records of all servers.
+    :param year: The year of the time frame.
+    :param month: Optional; the month of the time frame.
+    :param day: Optional; the day of the time frame.
+    :param week: Optional; the week number of the time frame.
+    :return: The progress, or None if the player has no records in the time frame.
+    """
+    conn = await get_stat_connection()
+    cur = await conn.cursor()
+    values = []
+    for order in ("ASC", "DESC"):
+        # the first and the last record of the time frame
+        await cur.execute(f"""
+            SELECT p1.{category}
+            FROM playerstats p1
+            WHERE p1.playername = ? {("" if scope else "AND p1.guildid = ?")}
+            AND {construct_time_frame_filter(1, year, month, day, week)}
+            ORDER BY p1.timestamp {order}, p1.id {order}
+            LIMIT 1
+        """, (playername,) if scope else (playername, guild_id))
+        record = await cur.fetchone()
+        if record is None:
+            return None
+        values.append(record[0] if isinstance(record[0], int) else 0)
+    return values[1] - values[0]
+
+
+async def get_live_scoreboards():
+    """
+    Retrieves every registered live scoreboard.
+
+    :return: A list of dictionaries, one per live scoreboard, with the shown entries decoded.
+    """
+    conn = await get_stat_connection()
+    cur = await conn.cursor()
+    await cur.execute("""
+        SELECT id, guildid, channelid, messageid, category, allservers, period, size, language, periodkey, entries
+        FROM live_scoreboards
+    """)
+    keys = ('id', 'guildid', 'channelid', 'messageid', 'category', 'allservers', 'period', 'size', 'language',
+            'periodkey', 'entries')
+    boards = [dict(zip(keys, record)) for record in await cur.fetchall()]
+    for board in boards:
+        board['entries'] = json.loads(board['entries']) if board['entries'] else None
+    return boards
+
+
+@writer_service.writer_call
+async def add_live_scoreboard(guild_id, channel_id, message_id, category, scope, period, size, language, period_key,
+                              entries):
+    """
+    Registers a message as a live scoreboard.
+
+    :param guild_id: The guild the message was posted in.
+    :param channel_id: The channel of the message.
+    :param message_id: The message to keep up to date.
+    :param category: The category of the scoreboard.
+    :param scope: The scope boolean of the scoreboard, where true is all servers.
+    :param period: "all", "daily", "weekly", "monthly" or "yearly".
+    :param size: The number of entries shown.
+    :param language: The language the message is written in.
+    :param period_key: The time frame the shown entries belong to.
+    :param entries: The shown entries as [player name, value] pairs.
+    :return: The ID of the live scoreboard.
+    """
+    conn = await get_stat_connection()
+    cur = await conn.cursor()
+    async with write_transaction(conn):
+        await cur.execute("""
+            INSERT INTO live_scoreboards (guildid, channelid, messageid, category, allservers, period, size, language,
+                                          periodkey, entries)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (guild_id, channel_id, message_id, category, scope, period, size, language, period_key,
+              json.dumps(entries)))
+    writer_service.publish("live_scoreboards_changed")
+    return cur.lastrowid
 
 
+@writer_service.writer_call
+async def remove_live_scoreboard(guild_id, message_id):
+    """
+    Stops updating a live scoreboard message.
+
+    :param guild_id: The guild of the message.
+    :param message_id: The message ID.
+    :return: True if the message was a live scoreboard of the guild.
+    """
+    conn = await get_stat_connection()
+    cur = await conn.cursor()
+    async with write_transaction(conn):
+        await cur.execute("DELETE FROM live_scoreboards WHERE guildid = ? AND messageid = ?", (guild_id, message_id))
+    writer_service.publish("live_scoreboards_changed")
+    return cur.rowcount > 0
+
+
+@writer_service.writer_call
+async def save_live_scoreboard_state(board_id, period_key, entries):
+    """
+    Stores the entries a live scoreboard message shows after it was edited.
+
+    :param board_id: The ID of the live scoreboard.
+    :param period_key: The time frame the entries belong to.
+    :param entries: The shown entries as [player name, value] pairs.
+    """
+    conn = await get_stat_connection()
+    async with write_transaction(conn):
+        await conn.execute("UPDATE live_scoreboards SET periodkey = ?, entries = ? WHERE id = ?",
+                           (period_key, json.dumps(entries), board_id))
+
+
+@writer_service.writer_call
+async def add_screenshot_upload(guild_id, record_id, screenshots, language, stats, ocr_version):
+    """
+    Links the archived screenshots of an upload to the record the upload inserted or changed.
+
+    :param guild_id: The guild of the upload.
+    :param record_id: The ID of the record returned by check_and_update_record.
+    :param screenshots: One or two (hash, filename, size, stored size) tuples of the stored image files.
+    :param language: The language the screenshots were read in.
+    :param stats: The stats read from the screenshots.
+    :param ocr_version: The version of the OCR pipeline that read them.
+    :return: The ID of the upload, None if the record was deleted in the meantime.
+    """
+    conn = await get_stat_connection()
+    cur = await conn.cursor()
+    async with write_transaction(conn):
+        await cur.execute("SELECT id FROM playerstats WHERE id = ?", (record_id,))
+        record = await cur.fetchone()
+        if record is None:
+            return None
+        await cur.executemany(
+            "INSERT OR IGNORE INTO screenshots (hash, filename, size, storedsize) VALUES (?, ?, ?, ?)", screenshots)
+        hashes = [screenshot[0] for screenshot in screenshots] + [None]
+        await cur.execute("""
+            INSERT INTO screenshot_uploads (recordid, guildid, image1, image2, language, ocrversion, stats)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (record[0], guild_id, hashes[0], hashes[1], language, ocr_version, json.dumps(stats)))
+    return cur.lastrowid
+
+
+async def get_reocr_batch(ocr_version, after_id, limit):
+    """
+    Retrieves archived uploads that were not read with an OCR pipeline version yet. Only the last upload of
+    each record is returned, earlier ones were overwritten by it.
+
+    :param ocr_version: The current version of the OCR pipeline.
+    :param after_id: The uploads after this upload ID are returned.
+    :param limit: The maximum number of uploads.
+    :return: A list of dictionaries with the upload, the file names of its screenshots, the stats read back then
+             ('stats') and the current values of the record ('record').
+    """
+    conn = await get_stat_connection()
+    cur = await conn.cursor()
+    record_columns = ', '.join(f'p.{column}' for column in column_names)
+    await cur.execute(f"""
+        SELECT u.id, u.recordid, u.guildid, p.playername, s1.filename, s2.filename, u.language, u.ocrversion,
+               u.stats, {record_columns}
+        FROM screenshot_uploads u
+        JOIN playerstats p ON p.id = u.recordid
+        LEFT JOIN screenshots s1 ON s1.hash = u.image1
+        LEFT JOIN screenshots s2 ON s2.hash = u.image2
+        WHERE u.id > ? AND COALESCE(u.checkedversion, u.ocrversion) != ?
+        AND u.id = (SELECT MAX(id) FROM screenshot_uploads WHERE recordid = u.recordid)
+        ORDER BY u.id
+        LIMIT ?
+    """, (after_id, ocr_version, limit))
+    uploads = []
+    for row in await cur.fetchall():
+        uploads.append({'id': row[0], 'recordid': row[1], 'guildid': row[2], 'playername': row[3],
+                        'filenames': [filename for filename in row[4:6] if filename], 'language': row[6],
+                        'ocrversion': row[7], 'stats': json.loads(row[8]) if row[8] else dict(),
+                        'record': dict(zip(column_names, row[9:]))})
+    return uploads
+
+
+@writer_service.writer_call
+async def mark_screenshot_uploads_checked(upload_ids, ocr_version):
+    """
+    Records that archived uploads were read again with an OCR pipeline version.
+    """
+    conn = await get_stat_connection()
+    async with write_transaction(conn):
+        await conn.executemany("UPDATE screenshot_uploads SET checkedversion = ? WHERE id = ?",
+                               [(ocr_version, upload_id) for upload_id in upload_ids])
+
+
+@writer_service.writer_call
+async def prune_screenshots():
+    """
+    Forgets the archived screenshots no upload links to anymore, e.g. after their records were deleted.
+
+    :return: The file names of the forgotten screenshots, for deleting the files.
+    """
+    conn = await get_stat_connection()
+    cur = await conn.cursor()
+    async with write_transaction(conn):
+        await cur.execute("""
+            SELECT hash, filename FROM screenshots
+            WHERE hash NOT IN (SELECT image1 FROM screenshot_uploads)
+            AND hash NOT IN (SELECT image2 FROM screenshot_uploads WHERE image2 IS NOT NULL)
+        """)
+        orphans = await cur.fetchall()
+        await cur.executemany("DELETE FROM screenshots WHERE hash = ?", [(orphan[0],) for orphan in orphans])
+    return [filename for _, filename in orphans]
+
+
+@writer_service.writer_call
 async def update_language(discord_id, language):
     """
     Updates the language preference for a given Discord ID.
@@ -559,16 +1391,11 @@ async def get_latest_record(guild_id, playername):
 
     await cur.execute("""
                    SELECT *
-                   FROM playerstats
+                   FROM latest_playerstats
                    WHERE guildid = ? AND playername = ?
-                   ORDER BY timestamp DESC
                """, (guild_id, playername))
 
-    record = await cur.fetchone()
-    if record:
-        return record[5:]
-    else:
-        return None
+    return field_registry.record_from_row(await cur.fetchone())
 
 
 # Helper functions
@@ -612,7 +1439,9 @@ def construct_time_frame_filter(i, year, month=None, day=None, week=None):
     elif week:
         # Weekly calculation
         start_date, end_date = get_start_end_dates(year, week=week)  # Get start and end dates for the week
-        return f"p{i}.timestamp >= '{start_date}' AND p{i}.timestamp <= '{end_date}'"
+        # the timestamps of the last day are later than its date, so the end is the start of the next day
+        next_day = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        return f"p{i}.timestamp >= '{start_date}' AND p{i}.timestamp < '{next_day}'"
     else:
         # Yearly calculation
         return f"strftime('%Y', p{i}.timestamp) = '{year}'"
@@ -649,3 +1478,7 @@ def get_start_end_dates(year, month=None, day=None, week=None):
         end_date = datetime(year, 12, 31)
 
     return start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+
+
+# every query function is timed, the bot processes of a cluster measure their writes including the writer round trip
+metrics.time_module_functions(globals(), metrics.db_seconds, skip=("get_stat_connection",))
@@ -0,0 +1,181 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import time
+
+import db_related
+from stat_db_connection import StatDBConnection
+
+export_formats = ("csv", "jsonl")
+max_chunk_bytes = int(os.getenv('EXPORT_CHUNK_BYTES', str(24 * 1024 * 1024)))  # stay below discord's upload limit
+chunk_margin = 256 * 1024  # the compressor may still hold this much unflushed data
+message_overhead = 64 * 1024  # the message text and the form encoding count towards discord's upload limit too
+
+
+class ChunkWriter:
+    """
+    Writes exported rows into gzip compressed files, starting a new part whenever the compressed size
+    of the current part gets close to the chunk limit.
+
+    Attributes:
+        folder (str): The folder the parts are written to.
+        prefix (str): The file name prefix of the parts.
+        export_format (str): Either "csv" or "jsonl".
+        columns (list): The column names of the exported rows.
+        paths (list): The paths of all written parts.
+    """
+
+    def __init__(self, folder, prefix, export_format, columns, chunk_bytes=max_chunk_bytes):
+        self.folder = folder
+        self.prefix = prefix
+        self.export_format = export_format
+        self.columns = columns
+        self.chunk_bytes = chunk_bytes
+        self.paths = []
+        self._raw = None
+        self._gzip = None
+        self._text = None
+        self._csv = None
+
+    def _open_part(self):
+        path = os.path.join(self.folder, f"{self.prefix}-part{len(self.paths) + 1:03d}.{self.export_format}.gz")
+        self.paths.append(path)
+        self._raw = open(path, "wb")
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        self._text = io.TextIOWrapper(self._gzip, encoding="utf-8", newline="")
+        if self.export_format == "csv":
+            self._csv = csv.writer(self._text)
+            self._csv.writerow(self.columns)
+
+    def _close_part(self):
+        if self._text is not None:
+            self._text.close()  # closes the gzip stream as well
+            self._raw.close()
+            self._text = self._gzip = self._raw = self._csv = None
+
+    def write(self, row):
+        if self._text is None or self._raw.tell() >= self.chunk_bytes - chunk_margin:
+            self._close_part()
+            self._open_part()
+        if self.export_format == "csv":
+            self._csv.writerow(["" if value is None else value for value in row])
+        else:
+            self._text.write(json.dumps(dict(zip(self.columns, row))) + "\n")
+
+    def close(self):
+        self._close_part()
+
+
+def upload_chunk_bytes(filesize_limit):
+    """
+    Returns the part size for sending an export to discord, one part per message.
+
+    :param filesize_limit: The upload limit of the guild in bytes, which applies to a whole message.
+    """
+    return min(max_chunk_bytes, filesize_limit - message_overhead)
+
+
+async def export_guild(guild_id, folder, export_format="csv", chunk_bytes=max_chunk_bytes):
+    """
+    Streams all records of a guild into compressed CSV or JSON Lines parts.
+
+    :param guild_id: The ID of the guild to export.
+    :param folder: The folder to write the parts to.
+    :param export_format: Either "csv" or "jsonl".
+    :param chunk_bytes: The maximum size of a single compressed part.
+    :return: A tuple (paths, row_count) with the paths of the written parts and the number of exported rows.
+    """
+    os.makedirs(folder, exist_ok=True)
+    records = db_related.stream_guild_records(guild_id)
+    columns = await records.__anext__()
+    writer = None
+    row_count = 0
+    try:
+        async for row in records:
+            if writer is None:
+                writer = ChunkWriter(folder, f"guild{guild_id}", export_format, columns, chunk_bytes)
+            writer.write(row)
+            row_count += 1
+    finally:
+        if writer is not None:
+            writer.close()
+    return (writer.paths if writer else []), row_count
+
+
+async def import_guild(guild_id, paths):
+    """
+    Imports exported CSV or JSON Lines files (optionally gzip compressed) into a guild.
+
+    :param guild_id: The ID of the guild to import the records into.
+    :param paths: The paths of the files to import.
+    :return: The number of imported records.
+    """
+    imported = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            imported += await db_related.insert_records_bulk(guild_id, read_export_file(f, path))
+    return imported
+
+
+def read_export_file(fileobj, filename):
+    """
+    Lazily parses an exported file into record dictionaries.
+
+    :param fileobj: A binary file object of the exported file.
+    :param filename: The name of the file, used to detect compression and format.
+    :return: A generator of dictionaries mapping column names to values.
+    """
+    if filename.endswith(".gz"):
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+        filename = filename[:-3]
+    text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+
+    if filename.endswith(".csv"):
+        for row in csv.DictReader(text):
+            yield {column: (value if value != "" else None) for column, value in row.items()}
+    elif filename.endswith(".jsonl"):
+        for line in text:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError(f"Unsupported export file: {filename}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Export or import all records of a guild")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("--guild", type=int, required=True, help="ID of the discord server")
+    parser.add_argument("--db", default=StatDBConnection.path, help="path of the player stats database")
+    parser.add_argument("--format", choices=export_formats, default="csv", help="export format")
+    parser.add_argument("--out", default="../exports", help="export folder")
+    parser.add_argument("files", nargs="*", help="files to import")
+    args = parser.parse_args()
+
+    StatDBConnection.path = args.db
+    await db_related.setup_db()
+    st = time.perf_counter()
+    if args.action == "export":
+        paths, row_count = await export_guild(args.guild, args.out, args.format)
+        for path in paths:
+            print(path)
+    else:
+        row_count = await import_guild(args.guild, args.files)
+    elapsed = time.perf_counter() - st
+    print(f"{args.action}ed {row_count} records in {elapsed:.2f} seconds ({row_count / max(elapsed, 1e-9):.0f} rows/s)")
+    await db_related.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
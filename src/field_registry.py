@@ -0,0 +1,250 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import re
+from datetime import datetime
+
+max_stat = 99999999
+max_guild_level = 9999
+
+non_digits = re.compile(r'\D+')
+any_non_digit = re.compile(r'\D')
+
+# the columns every record starts with, before the stats
+meta_columns = (("id", "INTEGER PRIMARY KEY AUTOINCREMENT", int), ("guildid", "INTEGER", int),
+                ("discordid", "INTEGER", int), ("timestamp", "DATETIME DEFAULT CURRENT_TIMESTAMP", str),
+                ("playername", "TEXT", str))
+
+
+def parse_integer(value):
+    """
+    Extracts a number from the text recognized next to a label. A trailing group of one or two digits after the
+    number is dropped, it is a misrecognized question mark icon.
+    """
+    parts = non_digits.sub(' ', value).split()
+    if len(parts) > 1 and 1 <= len(parts[-1]) <= 2:
+        parts = parts[:-1]
+    value = ''.join(parts)
+    return int(value) if value else None
+
+
+def parse_duration(value):
+    """
+    Converts a playtime shown as days and hours, e.g. 12d 05h, to hours.
+    """
+    value = any_non_digit.sub('', value)
+    try:
+        if len(value) <= 2:  # only hours
+            return int(value)
+        return int(value[:-2]) * 24 + int(value[-2:])
+    except ValueError:
+        return 0
+
+
+def parse_date(value):
+    """
+    Converts a date shown as YYYY/MM/DD (any separators) to YYYY-MM-DD, None if it is not a valid date.
+    """
+    try:
+        return datetime.strptime(any_non_digit.sub('', value), '%Y%m%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def parse_text(value):
+    return value
+
+
+def range_validator(minimum, maximum):
+    def validate(value):
+        try:
+            number = int(value)
+        except ValueError:
+            return "invalidinput"
+        return "" if minimum <= number <= maximum else "invalidnumber"
+    return validate
+
+
+def validate_date(value):
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return "invaliddate"
+    return ""
+
+
+def validate_text(value):
+    return ""
+
+
+# kind -> (SQL type, Python type, parser of the recognized text)
+kinds = {
+    "integer": ("INTEGER", int, parse_integer),
+    "duration": ("INTEGER", int, parse_duration),  # stored in hours
+    "date": ("DATE", str, parse_date),
+    "text": ("TEXT", str, parse_text),
+}
+
+
+class Field:
+    """
+    A stat column of the playerstats table and everything the bot knows about it. The parser and the validator
+    are picked once, when the field is defined.
+
+    Attributes:
+        name (str): The column name.
+        label (str): The English name offered in the slash command choices.
+        kind (str): 'integer', 'duration', 'date' or 'text'.
+        sql_type (str): The type of the column.
+        python_type (type): The type of its values.
+        ascending (bool): Whether lower values rank higher.
+        ranked (bool): Whether players can be ranked by it.
+        choice (bool): Whether it is offered as a category choice of the scoreboard commands.
+        internal (bool): Whether it is maintained by the bot, not shown to or entered by users.
+        parse (callable): Converts the text recognized on a screenshot to the value.
+        validate (callable): Checks a value entered by a user, returns the translation key of the error or "".
+    """
+
+    __slots__ = ("name", "label", "kind", "sql_type", "python_type", "ascending", "ranked", "choice", "internal",
+                 "parse", "validate")
+
+    def __init__(self, name, label, kind="integer", minimum=0, maximum=max_stat, ascending=False, choice=True,
+                 internal=False):
+        self.name = name
+        self.label = label
+        self.kind = kind
+        self.sql_type, self.python_type, self.parse = kinds[kind]
+        self.ascending = ascending
+        self.ranked = kind in ("integer", "duration")
+        self.choice = choice and self.ranked
+        self.internal = internal
+        if kind == "date":
+            self.validate = validate_date
+        elif kind == "text":
+            self.validate = validate_text
+        else:
+            self.validate = range_validator(minimum, maximum)
+
+
+def guild(name, label):
+    return Field(name, label, maximum=max_guild_level)
+
+
+def rank(name, label):
+    return Field(name, label, ascending=True)
+
+
+# the stat columns in table order, new columns are added at the end
+fields = (
+    Field("level", "Level", minimum=1, maximum=250, choice=False),
+    Field("ascensionlevel", "Ascension Level"),
+    Field("kingdom", "Kingdom", kind="text"),
+    Field("datecreated", "Date Created", kind="date"),
+    Field("playtime", "Playtime", kind="duration"),
+    guild("travelersguild", "Travelers's Guild"),
+    guild("anglersguild", "Angler's Guild"),
+    guild("circleofanguish", "Circle of Anguish"),
+    guild("titanfelledguild", "Titanfelled Guild"),
+    guild("bladesoffinesse", "Blades of Finesse"),
+    guild("spelunkingguild", "Spelunking Guild"),
+    guild("seersguild", "Seer's Guild"),
+    guild("monumentalguild", "Monumental Guild"),
+    rank("globalrank", "Global Rank"),
+    rank("regionalrank", "Regional Rank"),
+    rank("competitiverank", "Competitive Rank"),
+    Field("monstersslain", "Monsters Slain"),
+    Field("bossesslain", "Bosses Slain"),
+    Field("playersdefeated", "Players Defeated"),
+    Field("questscompleted", "Quests Completed"),
+    Field("areasexplored", "Areas Explored", choice=False),
+    Field("areastaken", "Areas Taken", choice=False),
+    Field("dungeonscleared", "Dungeons Cleared"),
+    Field("coliseumwins", "Coliseum Wins"),
+    Field("itemsupgraded", "Items Upgraded"),
+    Field("fishcaught", "Fish Caught"),
+    Field("distancetravelled", "Distance Travelled"),
+    Field("reputation", "Reputation"),
+    Field("endlessrecord", "Endless Record", maximum=max_guild_level),
+    Field("entriescompleted", "Entries Completed"),
+    Field("kingdomid", "Kingdom ID", internal=True),
+)
+
+field_map = {field.name: field for field in fields}
+all_columns = tuple(name for name, _, _ in meta_columns) + tuple(field.name for field in fields)
+data_columns = tuple(field.name for field in fields if not field.internal)
+internal_columns = tuple(field.name for field in fields if field.internal)
+ranked_columns = frozenset(field.name for field in fields if field.ranked and not field.internal)
+ascending_categories = frozenset(field.name for field in fields if field.ascending)
+parsers = {field.name: field.parse for field in fields}
+validators = {field.name: field.validate for field in fields}
+validate_stat = range_validator(0, max_stat)  # columns the registry does not know yet
+first_data_index = len(meta_columns)
+
+
+def create_table_sql(table):
+    """
+    Returns the CREATE TABLE statement of the records table.
+    """
+    columns = [f"    {name} {sql_type}" for name, sql_type, _ in meta_columns]
+    columns += [f"    {field.name} {field.sql_type}" for field in fields]
+    return f"\nCREATE TABLE IF NOT EXISTS {table} (\n" + ",\n".join(columns) + "\n);\n"
+
+
+def parse_value(column, text):
+    """
+    Converts the text recognized next to a label to the value of its column.
+    """
+    return parsers.get(column, parse_integer)(text)
+
+
+def validate_value(column, value):
+    """
+    Checks a value a user entered for a column.
+
+    :return: The translation key of the error, an empty string if the value is valid.
+    """
+    return validators.get(column, validate_stat)(value)
+
+
+def is_ascending(column):
+    return column in ascending_categories
+
+
+def choices():
+    """
+    Returns the (label, column) pairs of the categories offered by the scoreboard commands.
+    """
+    return [(field.label, field.name) for field in fields if field.choice and not field.internal]
+
+
+class Record:
+    """
+    A row of the playerstats table with its columns as attributes. Iterating a record yields the values of the
+    data columns in column order, like the rows the bot showed before, so it can be zipped with their labels.
+    """
+
+    __slots__ = all_columns
+    __annotations__ = dict([(name, python_type) for name, _, python_type in meta_columns]
+                           + [(field.name, field.python_type) for field in fields])
+
+    def __init__(self, row):
+        for column, value in zip(all_columns, row):
+            setattr(self, column, value)
+
+    def __iter__(self):
+        return (getattr(self, column) for column in data_columns)
+
+    def stats(self):
+        """
+        Returns the data columns as a dictionary.
+        """
+        return {column: getattr(self, column) for column in data_columns}
+
+
+def record_from_row(row):
+    return Record(row) if row is not None else None
@@ -0,0 +1,105 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import asyncio
+import concurrent.futures
+import io
+from collections import OrderedDict
+
+from db_related import get_history_points
+
+history_ranges = {"week": 7, "month": 31, "year": 366, "all": None}  # range name -> number of days
+max_points = 200  # points per series after downsampling
+render_cache_size = 256
+
+render_executor = None  # process pool for rendering, created on first use
+render_cache = OrderedDict()  # (guild, player, categories, points, labels, title) -> png bytes
+
+
+async def get_history_chart(guild_id, playername, categories, history_range, title, labels):
+    """
+    Returns a PNG chart of a player's progress in one or more categories.
+    Charts are cached by the points they show, so repeated views skip rendering until a record in the range is
+    added or edited in place, or the rolling range moves past a record.
+
+    :param guild_id: The guild ID associated with the player's records.
+    :param playername: The name of the player.
+    :param categories: A list of category column names to plot.
+    :param history_range: One of the keys of history_ranges.
+    :param title: The chart title.
+    :param labels: A list of localized category labels, in the order of categories.
+    :return: The PNG image as bytes, or None if the player has no records in the range.
+    """
+    points = await get_history_points(guild_id, playername, categories, history_ranges[history_range], max_points)
+    if not points:
+        return None
+
+    # the points are read anyway, keying on them is cheaper than rendering and never serves a stale chart
+    cache_key = (guild_id, playername, tuple(categories), tuple(points), tuple(labels), title)
+    if cache_key in render_cache:
+        render_cache.move_to_end(cache_key)
+        return render_cache[cache_key]
+
+    timestamps = [point[1] for point in points]
+    series = [[point[i + 2] for point in points] for i in range(len(categories))]
+
+    global render_executor
+    if render_executor is None:
+        render_executor = concurrent.futures.ProcessPoolExecutor(max_workers=2)
+    loop = asyncio.get_running_loop()
+    png = await loop.run_in_executor(render_executor, render_history_chart, title, timestamps, series, labels)
+
+    render_cache[cache_key] = png
+    if len(render_cache) > render_cache_size:
+        render_cache.popitem(last=False)
+    return png
+
+
+def render_history_chart(title, timestamps, series, labels):
+    """
+    Renders a line chart of one or more series. Runs in a worker process, so it only takes plain data.
+
+    :param title: The chart title.
+    :param timestamps: A list of timestamp strings ('%Y-%m-%d %H:%M:%S').
+    :param series: A list of value lists, one per category.
+    :param labels: A list of labels, one per series.
+    :return: The PNG image as bytes.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+    from datetime import datetime
+
+    dates = [datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S') for timestamp in timestamps]
+    fig, first_axis = plt.subplots(figsize=(8, 4.5), dpi=100)
+    axis = first_axis
+    colors = ["#a84232", "#328ba8", "#32a852", "#a89a32"]
+    for i, (values, label) in enumerate(zip(series, labels)):
+        if i > 0:
+            # every further category gets its own y axis since the value ranges differ a lot
+            axis = first_axis.twinx()
+            axis.spines["right"].set_position(("axes", 1 + 0.12 * (i - 1)))
+        color = colors[i % len(colors)]
+        points = [(date, value) for date, value in zip(dates, values) if isinstance(value, (int, float))]
+        axis.plot([point[0] for point in points], [point[1] for point in points], color=color, marker=".",
+                  label=label)
+        axis.set_ylabel(label, color=color)
+        axis.tick_params(axis="y", colors=color)
+
+    locator = AutoDateLocator()
+    first_axis.xaxis.set_major_locator(locator)
+    first_axis.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+    first_axis.set_title(title)
+    first_axis.grid(alpha=0.3)
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    plt.close(fig)
+    return buffer.getvalue()
@@ -6,59 +6,124 @@ Permission is hereby granted, free of charge, to any person obtaining a copy of
 The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
 """
 
+import asyncio
 import calendar
+import importlib
+import io
+import math
 import os
+import signal
+import tempfile
 import discord
 import json
 import time
-from pytesseract import pytesseract
 from db_related import *
 from dotenv import load_dotenv
 from discord.ext.commands import has_permissions
 from discord import guild_only, Option
-from ocr_related import process_images_tess
-from fuzzywuzzy import process
 from confirm_delete import ConfirmDeleteView
+from scoreboard_view import ScoreboardView
+from backup_related import backups_enabled, start_backup_task
+import leaderboard_cache
+import player_index
+import category_related
+import field_registry
+import live_scoreboard
+import metrics
+import screenshot_archive
+import tracing
+import upload_scheduler
+import cluster_related
+import writer_service
+from kingdom_related import kingdom_display_name, kingdom_names
+from export_related import export_guild, export_formats, read_export_file, upload_chunk_bytes
+from history_related import get_history_chart, history_ranges
 
 intents = discord.Intents.default()
-bot = discord.Bot(intents=intents)
+bot = cluster_related.create_bot(intents)
 load_dotenv()
 token = str(os.getenv('TOKEN'))
 translation_cache = dict()  # dictionary to store loaded translations
+ocr_module = None  # ocr_related, imported on the first upload
 
-categories = [
-    discord.OptionChoice(name="Ascension Level", value="ascensionlevel"),
-    discord.OptionChoice(name="Playtime", value="playtime"),
-    discord.OptionChoice(name="Travelers's Guild", value="travelersguild"),
-    discord.OptionChoice(name="Angler's Guild", value="anglersguild"),
-    discord.OptionChoice(name="Circle of Anguish", value="circleofanguish"),
-    discord.OptionChoice(name="Titanfelled Guild", value="titanfelledguild"),
-    discord.OptionChoice(name="Blades of Finesse", value="bladesoffinesse"),
-    discord.OptionChoice(name="Spelunking Guild", value="spelunkingguild"),
-    discord.OptionChoice(name="Seer's Guild", value="seersguild"),
-    discord.OptionChoice(name="Monumental Guild", value="monumentalguild"),
-    discord.OptionChoice(name="Global Rank", value="globalrank"),
-    discord.OptionChoice(name="Regional Rank", value="regionalrank"),
-    discord.OptionChoice(name="Competitive Rank", value="competitiverank"),
-    discord.OptionChoice(name="Monsters Slain", value="monstersslain"),
-    discord.OptionChoice(name="Bosses Slain", value="bossesslain"),
-    discord.OptionChoice(name="Players Defeated", value="playersdefeated"),
-    discord.OptionChoice(name="Quests Completed", value="questscompleted"),
-    discord.OptionChoice(name="Dungeons Cleared", value="dungeonscleared"),
-    discord.OptionChoice(name="Coliseum Wins", value="coliseumwins"),
-    discord.OptionChoice(name="Items Upgraded", value="itemsupgraded"),
-    discord.OptionChoice(name="Fish Caught", value="fishcaught"),
-    discord.OptionChoice(name="Distance Travelled", value="distancetravelled"),
-    discord.OptionChoice(name="Reputation", value="reputation"),
-    discord.OptionChoice(name="Endless Record", value="endlessrecord"),
-    discord.OptionChoice(name="Entries Completed", value="entriescompleted")]
+categories = [discord.OptionChoice(name=label, value=column) for label, column in field_registry.choices()]
+
+
+async def startup():
+    """
+    Runs the one-time setup before the gateway connects: the translations, the databases and the background tasks.
+    on_ready fires again on every reconnect, so it must not do any of this.
+    """
+    create_translation_cache()
+    if cluster_related.is_worker():
+        # the writer service owns the schema, the backups and the persisted top lists
+        await writer_service.connect(cluster_related.writer_address)
+        await setup_db_reader()
+    else:
+        # backups read a consistent snapshot while uploads keep committing, which needs write-ahead logging
+        await setup_db(wal=backups_enabled())
+    category_related.load(translation_cache, get_column_names())
+    # each process edits the live scoreboards of the guilds on its shards
+    await live_scoreboard.start(lambda board: bot.get_guild(board.guild_id) is not None, publish_live_scoreboard)
+    screenshot_archive.start(lambda guild_id: bot.get_guild(guild_id) is not None, translation_cache)
+    await metrics.start()
+    if not cluster_related.is_worker():
+        start_backup_task()
+        leaderboard_cache.start_save_task(get_stat_connection)
+
+
+async def run_bot():
+    """
+    Sets up the bot and keeps it connected until it is closed or the process is terminated.
+    """
+    await startup()
+    try:
+        # stop gracefully when the cluster launcher or a service manager terminates the process
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # not available on Windows
+    try:
+        async with bot:
+            await bot.start(token)
+    finally:
+        await close_db()
 
 
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user}!')
-    await setup_db()
-    create_translation_cache()
+
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+
+@bot.after_invoke
+async def observe_command_duration(ctx):
+    # also runs when the command raised
+    metrics.command_seconds.observe(time.perf_counter() - ctx.started_at, ctx.command.qualified_name)
+
+
+async def process_images(*args):
+    """
+    Runs process_images_tess of ocr_related. The OCR stack (Pillow, pytesseract and numpy) is imported on the
+    first upload instead of at startup, in a worker thread so the event loop is not blocked meanwhile.
+    """
+    global ocr_module
+    if ocr_module is None:
+        ocr_module = await asyncio.get_running_loop().run_in_executor(None, importlib.import_module, "ocr_related")
+    return await ocr_module.process_images_tess(*args)
+
+
+async def playername_autocomplete(ctx: discord.AutocompleteContext):
+    # answered from memory, so it stays well within discord's 3 second limit
+    return player_index.complete(ctx.interaction.guild_id, ctx.value)
+
+
+async def category_autocomplete(ctx: discord.AutocompleteContext):
+    # labels of every language are offered, the resolver understands all of them
+    return category_related.complete_category(ctx.value)
 
 
 @bot.slash_command(name="upload_stats", description="Upload your player stats by providing screenshots")
@@ -68,6 +133,7 @@ async def upload_stats(ctx,
                        image: Option(discord.Attachment, "First image"),
                        secondimage: Option(discord.Attachment, "Second image", required=False)):
     await ctx.defer()  # avoid timeout
+    tracing.annotate(playername=playername)
 
     # fetch user preferred language
     language = await get_language(ctx.author.id)
@@ -78,24 +144,44 @@ async def upload_stats(ctx,
         await ctx.respond(language_file.get("invalidimage"))
         return
 
+    # rate limit the user before queueing any work
+    retry_after = upload_scheduler.take_upload_token(ctx.author.id)
+    if retry_after:
+        await ctx.followup.send(
+            f"{language_file.get('uploadthrottled')} {math.ceil(retry_after)} {language_file.get('seconds')}.")
+        return
+
     # attempt to process the images to extract the player stats information
     playerstats = dict()
-    st = time.time()
+    st = time.perf_counter()
 
+    second_image_url = secondimage.url if secondimage and secondimage.content_type.startswith("image/") else None
+    images = [] if screenshot_archive.enabled else None  # the downloaded files, kept for reading them again later
     try:
-        if secondimage and secondimage.content_type.startswith("image/"):
-            playerstats = await process_images_tess(image.url, playername, ctx.guild.id, ctx.author.id, language_file,
-                                                    secondimage.url)
-        else:
-            playerstats = await process_images_tess(image.url, playername, ctx.guild.id, ctx.author.id, language_file)
+        # the OCR slots are shared fairly between the servers, the job is dropped once nobody waits for it anymore
+        playerstats = await upload_scheduler.run_ocr_job(
+            ctx.guild.id,
+            lambda: process_images(image.url, playername, ctx.guild.id, ctx.author.id, language_file,
+                                   second_image_url, images),
+            deadline=upload_scheduler.interaction_deadline(ctx.interaction.created_at))
+    except upload_scheduler.DeadlineExceeded:
+        await ctx.followup.send(language_file.get("uploadexpired"))
+        return
     except Exception as e:
         await ctx.followup.send(language_file.get("errorimageprocess"))
         print(e)
 
-    print(f"{time.time() - st} seconds")
+    metrics.ocr_stage_seconds.observe(time.perf_counter() - st, "total")
 
     # attempt to insert / update the record in the database
-    response, changed_record, differences = await check_and_update_record(playerstats, ctx.guild.id, playername)
+    with metrics.ocr_stage_seconds.time("db_write"), tracing.span("check_and_update_record"):
+        response, changed_record, differences = await check_and_update_record(playerstats, ctx.guild.id, playername)
+    if images and playerstats and changed_record is not None:
+        try:
+            await screenshot_archive.archive_upload(ctx.guild.id, changed_record.id, images, language, playerstats,
+                                                    ocr_module.pipeline_version)
+        except Exception as e:
+            print(f"Archiving the screenshots failed: {e}")
     column_names = get_column_names()
     localized_column_names = [language_file.get(column, column) for column in column_names]
     message = f"{language_file.get(response)}\n```"
@@ -116,46 +202,92 @@ async def upload_stats(ctx,
     await ctx.followup.send(message)
 
 
+@upload_stats.before_invoke
+async def start_upload_trace(ctx):
+    # every upload gets a trace, from the interaction to the database commit
+    tracing.start_trace("upload_stats", guild_id=ctx.guild.id, user_id=ctx.author.id)
+
+
+@upload_stats.after_invoke
+async def finish_upload_trace(ctx):
+    tracing.finish_trace()
+
+
+@bot.slash_command(name="slowest_uploads", description="Shows the slowest recent uploads of this server")
+@guild_only()
+@has_permissions(administrator=True)
+async def slowest_uploads(ctx, n: Option(int, "Number of uploads (max 10)", default=5, min_value=1, max_value=10)):
+    language = await get_language(ctx.author.id)
+    language_file = translation_cache[language]
+
+    traces = tracing.slowest_traces(ctx.guild.id, n)
+    if not traces:
+        await ctx.respond(language_file.get("notraces"), ephemeral=True)
+        return
+    embed = discord.Embed(title=language_file.get("slowestuploads"), color=0xa84232)
+    for trace in traces:
+        # spans are listed in start order, indented below their parent
+        depths = {0: -1}  # the root span is the trace itself
+        lines = []
+        for span in sorted(trace['spans'], key=lambda span: span['start_ms']):
+            depths[span['id']] = depths.get(span['parent'], 0) + 1
+            lines.append(f"{'  ' * depths[span['id']]}{span['name']} {span['duration_ms'] / 1000:.2f}s")
+        value = "```\n" + "\n".join(lines)[:1000] + "\n```"
+        embed.add_field(name=f"{trace['duration_ms'] / 1000:.1f}s · {trace['attributes'].get('playername', '?')} · "
+                             f"{trace['trace_id']}", value=value, inline=False)
+    await ctx.respond(embed=embed, ephemeral=True)
+
+
+@bot.slash_command(name="upload_queue", description="Shows how long uploads of this server waited for processing")
+@guild_only()
+@has_permissions(administrator=True)
+async def upload_queue(ctx):
+    language = await get_language(ctx.author.id)
+    language_file = translation_cache[language]
+
+    stats = upload_scheduler.scheduler.wait_stats(ctx.guild.id)
+    embed = discord.Embed(title=language_file.get("uploadqueue"), color=0xa84232)
+    embed.add_field(name=language_file.get("uploadsprocessed"), value=stats['uploads'], inline=False)
+    embed.add_field(name=language_file.get("averagewait"), value=f"{stats['average_wait']:.1f}s", inline=True)
+    embed.add_field(name="p95", value=f"{stats['p95_wait']:.1f}s", inline=True)
+    embed.add_field(name="max", value=f"{stats['max_wait']:.1f}s", inline=True)
+    embed.add_field(name=language_file.get("uploadsqueued"), value=f"{stats['queued']} / {stats['running']}",
+                    inline=False)
+    embed.add_field(name=language_file.get("uploadsexpired"), value=f"{stats['dropped']} / {stats['cancelled']}",
+                    inline=True)
+    embed.add_field(name=language_file.get("wastedocrtime"), value=f"{stats['wasted_seconds']:.1f}s", inline=True)
+    await ctx.respond(embed=embed, ephemeral=True)
+
+
 @bot.slash_command(name="correct_latest", description="Update a category in your latest record")
 @guild_only()
 async def correct_latest(ctx,
-                         category: Option(str, "Specify the category (e.g., bosses slain)", max_length=40),
+                         category: Option(str, "Specify the category (e.g., bosses slain)", max_length=40,
+                                          autocomplete=category_autocomplete),
                          new_value: Option(str, "Enter the new value for the stat", max_length=40)):
     await ctx.defer()  # avoid timeout
 
-    # fetch user preferred language and obtain localized column names
+    # fetch user preferred language
     language = await get_language(ctx.author.id)
     language_file = translation_cache[language]
 
-    column_names = get_column_names()
-    localized_column_names = dict()
-    for column in column_names:
-        localized_column_names[''.join(language_file.get(column,
-                                                         column).split()).lower()] = column  # dicitonary that maps localized column names to original column names
-
-    # fuzzy match the input category
-    match = process.extractOne(category, localized_column_names.keys())
-    best_match = None
-    if match:
-        best_match, score = match
-        if score < 90:
-            await ctx.followup.send(language_file.get("invalidcategoryname"))
-            return
-    else:
+    # resolve the input category, the label maps of all languages are precompiled
+    column, score = category_related.resolve_category(category, language_file)
+    if column is None or score < category_related.min_score:
         await ctx.followup.send(language_file.get("invalidcategoryname"))
         return
 
     # check some input values
-    error_message = is_valid_input(localized_column_names[best_match], new_value)
+    error_message = field_registry.validate_value(column, new_value)
     if error_message != "":
         await ctx.followup.send(language_file.get(error_message))
         return
 
     # try to update the record
-    latest_record = await update_latest_record(ctx.author.id, localized_column_names[best_match], new_value)
+    latest_record = await update_latest_record(ctx.author.id, column, new_value)
     if latest_record:
         await ctx.followup.send(
-            f'{language_file.get("recordupdated")} {language_file.get(localized_column_names[best_match])} → {new_value}')
+            f'{language_file.get("recordupdated")} {language_file.get(column)} → {new_value}')
     else:
         await ctx.followup.send(language_file.get("norecordfound"))
 
@@ -164,11 +296,13 @@ async def correct_latest(ctx,
 @guild_only()
 @has_permissions(administrator=True)
 async def alter_record(ctx,
-                       playername: Option(str, "Enter the player's name", max_length=40),
+                       playername: Option(str, "Enter the player's name", max_length=40,
+                                          autocomplete=playername_autocomplete),
                        date: Option(str, "Enter the date of the record in yyyy-mm-dd format"),
                        record_option: Option(str, "Choose first (oldest) or second (latest) record on this date",
                                              choices=["first", "second"]),
-                       category: Option(str, "Specify the category (e.g., bosses slain)", max_length=40),
+                       category: Option(str, "Specify the category (e.g., bosses slain)", max_length=40,
+                                        autocomplete=category_autocomplete),
                        new_value: Option(str, "Enter the new value", max_length=40)):
     await ctx.defer()
 
@@ -183,27 +317,14 @@ async def alter_record(ctx,
         await ctx.followup.send(language_file.get("invaliddate"))
         return
 
-    #  obtain localized column names
-    column_names = get_column_names()
-    localized_column_names = dict()
-    for column in column_names:
-        localized_column_names[''.join(language_file.get(column,
-                                                         column).split()).lower()] = column  # dicitonary that maps localized column names to original column names
-
-    # fuzzy match the input category
-    match = process.extractOne(category, localized_column_names.keys())
-    best_match = None
-    if match:
-        best_match, score = match
-        if score < 90:
-            await ctx.followup.send(language_file.get("invalidcategoryname"))
-            return
-    else:
+    # resolve the input category, the label maps of all languages are precompiled
+    column, score = category_related.resolve_category(category, language_file)
+    if column is None or score < category_related.min_score:
         await ctx.followup.send(language_file.get("invalidcategoryname"))
         return
 
     # check some input values
-    error_message = is_valid_input(localized_column_names[best_match], new_value)
+    error_message = field_registry.validate_value(column, new_value)
     if error_message != "":
         await ctx.followup.send(language_file.get(error_message))
         return
@@ -213,19 +334,20 @@ async def alter_record(ctx,
 
     # try to update the record
     result = await update_specific_record(ctx.guild.id, playername, year, month, day, record_option,
-                                          localized_column_names[best_match], new_value)
+                                          column, new_value)
     if result:
         await ctx.followup.send(
-            f'{language_file.get("recordaltered")} {language_file.get(localized_column_names[best_match])} → {new_value}')
+            f'{language_file.get("recordaltered")} {language_file.get(column)} → {new_value}')
     else:
-        await ctx.followup.send(f'{language_file.get("norecordfound")}')
+        await ctx.followup.send(player_not_found_message(language_file, ctx.guild.id, playername))
 
 
 @bot.slash_command(name="delete_record", description="Delete a specific player's record")
 @guild_only()
 @has_permissions(administrator=True)
 async def delete_record(ctx,
-                        playername: Option(str, "Enter the player's name", max_length=40),
+                        playername: Option(str, "Enter the player's name", max_length=40,
+                                           autocomplete=playername_autocomplete),
                         date: Option(str, "Enter the date of the record in yyyy-mm-dd format"),
                         record_option: Option(str, "Choose first (oldest) or second (latest) record on this date",
                                               choices=["first", "second"])):
@@ -250,7 +372,7 @@ async def delete_record(ctx,
     if fetch_record:
         record, record_id = fetch_record
     else:
-        await ctx.followup.send(language_file.get("norecordfound"))
+        await ctx.followup.send(player_not_found_message(language_file, ctx.guild.id, playername))
         return
 
     column_names = get_column_names()
@@ -280,13 +402,18 @@ async def delete_record(ctx,
 @guild_only()
 @has_permissions(administrator=True)
 async def purge_records(ctx,
-                        playername: Option(str, "Enter the player's name", max_length=40)):
+                        playername: Option(str, "Enter the player's name", max_length=40,
+                                           autocomplete=playername_autocomplete)):
     await ctx.defer()
 
     # fetch user preferred language
     language = await get_language(ctx.author.id)
     language_file = translation_cache[language]
 
+    if not player_index.is_known(ctx.guild.id, playername):
+        await ctx.followup.send(player_not_found_message(language_file, ctx.guild.id, playername))
+        return
+
     view = ConfirmDeleteView(confirm_label=language_file.get("confirmdelete"), cancel_label=language_file.get("cancel"),
                              not_allowed_msg=language_file.get("notallowed"),initiator_id=ctx.author.id)
     message = f"{language_file.get('purgerecords')} {playername}?"
@@ -304,6 +431,55 @@ async def purge_records(ctx,
         await ctx.followup.send(language_file.get("deletecancelled"))
 
 
+@bot.slash_command(name="export_records", description="Exports all records of this server")
+@guild_only()
+@has_permissions(administrator=True)
+async def export_records(ctx,
+                         export_format: Option(str, "The file format of the export", choices=list(export_formats),
+                                               default="csv")):
+    await ctx.defer()
+
+    # fetch user preferred language
+    language = await get_language(ctx.author.id)
+    language_file = translation_cache[language]
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths, row_count = await export_guild(ctx.guild.id, folder, export_format,
+                                              upload_chunk_bytes(ctx.guild.filesize_limit))
+        if not paths:
+            await ctx.followup.send(language_file.get("norecordfound"))
+            return
+
+        # the upload limit applies to a whole message, so every part is sent on its own
+        for path in paths:
+            await ctx.followup.send(f"{language_file.get('recordsexported')} {row_count}", file=discord.File(path))
+
+
+@bot.slash_command(name="import_records", description="Imports records from an export file into this server")
+@guild_only()
+@has_permissions(administrator=True)
+async def import_records(ctx,
+                         file: Option(discord.Attachment, "Export file (.csv, .jsonl, optionally .gz)")):
+    await ctx.defer()
+
+    # fetch user preferred language
+    language = await get_language(ctx.author.id)
+    language_file = translation_cache[language]
+
+    if not file.filename.endswith((".csv", ".jsonl", ".csv.gz", ".jsonl.gz")):
+        await ctx.followup.send(language_file.get("invalidimportfile"))
+        return
+
+    try:
+        data = io.BytesIO(await file.read())
+        imported = await insert_records_bulk(ctx.guild.id, read_export_file(data, file.filename))
+    except (ValueError, KeyError, OSError) as e:
+        print(e)
+        await ctx.followup.send(language_file.get("invalidimportfile"))
+        return
+    await ctx.followup.send(f"{language_file.get('recordsimported')} {imported}")
+
+
 @bot.slash_command(name="scoreboard", description="Get the scoreboard for a specific category")
 @guild_only()
 async def scoreboard(ctx,
@@ -311,7 +487,7 @@ async def scoreboard(ctx,
                      kingdom: Option(str, "Name of the kingdom", default=None, max_length=40),
                      scope: Option(str, "The scope of the leaderboard", choices=["This Server", "All Servers"],
                                    default="This Server"),
-                     n: Option(int, "Number of players on the leaderboard (max 25)", default=10, min_value=1,
+                     n: Option(int, "Number of players per page (max 25)", default=10, min_value=1,
                                max_value=25)):
     await ctx.defer()  # avoid timeout
 
@@ -320,24 +496,193 @@ async def scoreboard(ctx,
     language_file = translation_cache[language]
 
     # categories for which the order should be reversed
-    asc_categories = ["globalrank", "regionalrank", "competitiverank"]
-    asc = category in asc_categories
+    asc = field_registry.is_ascending(category)
 
-    # fetch scoreboard
-    scoreboard = await get_scoreboard(ctx.guild.id, category, scope == "All Servers", asc, n, kingdom)
     title = f"{language_file.get('scoreboardfor')} {language_file.get(category)}"
     if kingdom:
-        title = f"({kingdom}) {title}"
+        title = f"({kingdom_display_name(kingdom)}) {title}"
 
-    if scoreboard:  # Check if a valid scoreboard was returned
+    # pages are fetched with a keyset cursor when the user browses the scoreboard
+    async def fetch_page(cursor):
+        return await get_scoreboard_page(ctx.guild.id, category, scope == "All Servers", asc, n, kingdom, cursor)
+
+    def make_embed(entries, page_index):
         embed = discord.Embed(title=title, color=0xa84232)
-        for entry in scoreboard:
-            embed.add_field(name=entry['playername'], value=entry['value'], inline=False)
-        await ctx.followup.send(embed=embed)
+        for position, entry in enumerate(entries, start=page_index * n + 1):
+            embed.add_field(name=f"{position}. {entry['playername']}", value=entry['value'], inline=False)
+        embed.set_footer(text=f"{language_file.get('page')} {page_index + 1}")
+        return embed
+
+    view = ScoreboardView(fetch_page, make_embed, previous_label=language_file.get("previouspage"),
+                          next_label=language_file.get("nextpage"), not_allowed_msg=language_file.get("notallowed"),
+                          initiator_id=ctx.author.id)
+    embed = await view.load_first_page()
+    if embed:  # Check if a valid scoreboard was returned
+        await ctx.followup.send(embed=embed, view=view)
     else:
         await ctx.followup.send(language_file.get("noscoreboarddata"))
 
 
+@bot.slash_command(name="live_scoreboard", description="Posts a scoreboard that updates itself when its top players change")
+@guild_only()
+@has_permissions(administrator=True)
+async def create_live_scoreboard(ctx,
+                                 category: Option(str, "The leaderboard category", choices=categories),
+                                 scope: Option(str, "The scope of the leaderboard",
+                                               choices=["This Server", "All Servers"], default="This Server"),
+                                 period: Option(str, "The time frame of the leaderboard", choices=[
+                                     discord.OptionChoice(name="All Time", value="all"),
+                                     discord.OptionChoice(name="Yearly", value="yearly"),
+                                     discord.OptionChoice(name="Monthly", value="monthly"),
+                                     discord.OptionChoice(name="Weekly", value="weekly"),
+                                     discord.OptionChoice(name="Daily", value="daily")], default="all"),
+                                 n: Option(int, "Number of players shown (max 25)", default=10, min_value=1,
+                                           max_value=25)):
+    await ctx.defer(ephemeral=True)
+
+    # fetch user preferred language
+    language = await get_language(ctx.author.id)
+    language_file = translation_cache[language]
+
+    if live_scoreboard.guild_board_count(ctx.guild.id) >= live_scoreboard.max_boards_per_guild:
+        await ctx.followup.send(language_file.get("livescoreboardlimit").format(live_scoreboard.max_boards_per_guild))
+        return
+
+    board = live_scoreboard.LiveBoard({'id': None, 'guildid': ctx.guild.id, 'channelid': ctx.channel.id,
+                                       'messageid': None, 'category': category, 'allservers': scope == "All Servers",
+                                       'period': period, 'size': n, 'language': language, 'periodkey': None,
+                                       'entries': None})
+    frame = live_scoreboard.current_frame(period)
+    entries = await live_scoreboard.compute_entries(board, frame)
+    try:
+        message = await ctx.channel.send(embed=live_scoreboard_embed(board, entries, frame))
+    except discord.Forbidden:
+        await ctx.followup.send(language_file.get("livescoreboardforbidden"))
+        return
+    await live_scoreboard.add(ctx.guild.id, ctx.channel.id, message.id, category, scope == "All Servers", period, n,
+                              language, entries)
+    await ctx.followup.send(language_file.get("livescoreboardcreated"))
+
+
+@bot.slash_command(name="remove_live_scoreboard", description="Stops updating a live scoreboard message")
+@guild_only()
+@has_permissions(administrator=True)
+async def delete_live_scoreboard(ctx,
+                                 message_id: Option(str, "The ID of the live scoreboard message", max_length=20)):
+    await ctx.defer(ephemeral=True)
+
+    # fetch user preferred language
+    language = await get_language(ctx.author.id)
+    language_file = translation_cache[language]
+
+    if not message_id.isdigit() or not await live_scoreboard.remove(ctx.guild.id, int(message_id)):
+        await ctx.followup.send(language_file.get("livescoreboardnotfound"))
+        return
+    await ctx.followup.send(language_file.get("livescoreboardremoved"))
+
+
+@bot.slash_command(name="rank", description="Shows a player's position on the leaderboard of a category")
+@guild_only()
+async def rank(ctx,
+               playername: Option(str, "Enter the player's name", max_length=40,
+                                  autocomplete=playername_autocomplete),
+               category: Option(str, "The leaderboard category", choices=categories),
+               kingdom: Option(str, "Name of the kingdom", default=None, max_length=40),
+               scope: Option(str, "The scope of the leaderboard", choices=["This Server", "All Servers"],
+                             default="This Server")):
+    await ctx.defer()  # avoid timeout
+
+    # fetch user preferred language
+    language = await get_language(ctx.author.id)
+    language_file = translation_cache[language]
+
+    # categories for which the order should be reversed
+    asc = field_registry.is_ascending(category)
+
+    result = await get_rank(ctx.guild.id, playername, category, scope == "All Servers", asc, kingdom)
+    if result is None:
+        await ctx.followup.send(player_not_found_message(language_file, ctx.guild.id, playername))
+        return
+
+    title = f"{language_file.get('rankof')} {playername} ({language_file.get(category)})"
+    if kingdom:
+        title = f"({kingdom_display_name(kingdom)}) {title}"
+    percentile = 100 * result['position'] / result['total']
+    embed = discord.Embed(title=title, color=0xa84232)
+    embed.add_field(name=language_file.get("position"),
+                    value=f"#{result['position']} / {result['total']} ({language_file.get('top')} {percentile:.1f}%)",
+                    inline=False)
+    if result['above']:
+        embed.add_field(name=f"↑ {result['above']['playername']}", value=result['above']['value'], inline=False)
+    embed.add_field(name=f"→ {playername}", value=result['value'], inline=False)
+    if result['below']:
+        embed.add_field(name=f"↓ {result['below']['playername']}", value=result['below']['value'], inline=False)
+    await ctx.followup.send(embed=embed)
+
+
+@bot.slash_command(name="group_scoreboard", description="Ranks kingdoms or servers by the combined stats of their players")
+@guild_only()
+async def group_scoreboard(ctx,
+                           category: Option(str, "The leaderboard category", choices=categories),
+                           group: Option(str, "Rank kingdoms or servers", choices=[
+                               discord.OptionChoice(name="Kingdoms", value="kingdom"),
+                               discord.OptionChoice(name="Servers", value="guild")], default="kingdom"),
+                           metric: Option(str, "How the players of a group are combined", choices=[
+                               discord.OptionChoice(name="Total", value="total"),
+                               discord.OptionChoice(name="Average", value="average"),
+                               discord.OptionChoice(name="Members", value="members")], default="total"),
+                           period: Option(str, "Latest values or progress in the current day, week, month or year",
+                                          choices=[discord.OptionChoice(name="Latest", value="latest"),
+                                                   discord.OptionChoice(name="Day", value="daily"),
+                                                   discord.OptionChoice(name="Week", value="weekly"),
+                                                   discord.OptionChoice(name="Month", value="monthly"),
+                                                   discord.OptionChoice(name="Year", value="yearly")],
+                                          default="latest"),
+                           n: Option(int, "Number of groups (max 25)", default=10, min_value=1, max_value=25)):
+    await ctx.defer()  # avoid timeout
+
+    # fetch user preferred language
+    language = await get_language(ctx.author.id)
+    language_file = translation_cache[language]
+
+    # categories for which the order should be reversed
+    asc = field_registry.is_ascending(category)
+
+    # progress is shown for the current period, like the progress scoreboards do by default
+    current_date = datetime.utcnow()
+    year = month = day = week = None
+    if period != "latest":
+        year = current_date.year
+        if period in ("monthly", "daily"):
+            month = current_date.month
+        if period == "daily":
+            day = current_date.day
+        if period == "weekly":
+            week = current_date.isocalendar()[1]
+
+    entries = await get_group_scoreboard(group, category, metric, asc, n, year, month, day, week)
+    if not entries:
+        await ctx.followup.send(language_file.get("noscoreboarddata"))
+        return
+
+    title = f"{language_file.get('kingdoms' if group == 'kingdom' else 'servers')}: " \
+            f"{language_file.get('scoreboardfor')} {language_file.get(category)} ({language_file.get(metric)})"
+    if year:
+        start_date, end_date = get_start_end_dates(year, month, day, week)
+        title = f"{language_file.get(period)} {title} {start_date} — {end_date}"
+    embed = discord.Embed(title=title, color=0x32a852)
+    for position, entry in enumerate(entries, start=1):
+        if group == "kingdom":
+            name = kingdom_names.get(entry['groupid'], entry['groupid'])
+        else:
+            guild = bot.get_guild(entry['groupid'])
+            name = guild.name if guild else entry['groupid']
+        value = round(entry['value'], 1) if metric == "average" else entry['value']
+        embed.add_field(name=f"{position}. {name}",
+                        value=f"{value} ({entry['members']} {language_file.get('members')})", inline=False)
+    await ctx.followup.send(embed=embed)
+
+
 @bot.slash_command(name="year_scoreboard", description="Get the yearly scoreboard for a specific category")
 @guild_only()
 async def yearly_scoreboard(ctx, category: Option(str, "The leaderboard category", choices=categories),
@@ -345,7 +690,7 @@ async def yearly_scoreboard(ctx, category: Option(str, "The leaderboard category
                             scope: Option(str, "The scope of the leaderboard", choices=["This Server", "All Servers"],
                                           default="This Server"),
                             year: Option(int, "Enter the year", default=None, min_value=1, max_value=999999),
-                            n: Option(int, "Number of players on the leaderboard (max 25)", default=10, min_value=1,
+                            n: Option(int, "Number of players per page (max 25)", default=10, min_value=1,
                                       max_value=25)):
     await generate_scoreboard(ctx, "yearly", category, kingdom=kingdom, scope=scope, year=year, n=n)
 
@@ -358,7 +703,7 @@ async def monthly_scoreboard(ctx, category: Option(str, "The leaderboard categor
                                            default="This Server"),
                              year: Option(int, "Enter the year", default=None, min_value=1, max_value=999999),
                              month: Option(int, "Enter the month number", default=None, min_value=1, max_value=12),
-                             n: Option(int, "Number of players on the leaderboard (max 25)", default=10, min_value=1,
+                             n: Option(int, "Number of players per page (max 25)", default=10, min_value=1,
                                        max_value=25)):
     await generate_scoreboard(ctx, "monthly", category, kingdom=kingdom, scope=scope, year=year, month=month, n=n)
 
@@ -372,7 +717,7 @@ async def day_scoreboard(ctx, category: Option(str, "The leaderboard category",
                          year: Option(int, "Enter the year", default=None, min_value=1, max_value=999999),
                          month: Option(int, "Enter the month number", default=None, min_value=1, max_value=12),
                          day: Option(int, "Enter the day number", default=None, min_value=1, max_value=31),
-                         n: Option(int, "Number of players on the leaderboard (max 25)", default=10, min_value=1,
+                         n: Option(int, "Number of players per page (max 25)", default=10, min_value=1,
                                    max_value=25)):
     await generate_scoreboard(ctx, "daily", category, kingdom=kingdom, scope=scope, year=year, month=month, day=day,
                               n=n)
@@ -386,7 +731,7 @@ async def weekly_scoreboard(ctx, category: Option(str, "The leaderboard category
                                           default="This Server"),
                             year: Option(int, "Enter the year", default=None, min_value=1, max_value=999999),
                             week: Option(int, "Enter the week number", default=None, min_value=1, max_value=53),
-                            n: Option(int, "Number of players on the leaderboard (max 25)", default=10, min_value=1,
+                            n: Option(int, "Number of players per page (max 25)", default=10, min_value=1,
                                       max_value=25)):
     await generate_scoreboard(ctx, "weekly", category, kingdom=kingdom, scope=scope, year=year, week=week, n=n)
 
@@ -414,16 +759,30 @@ async def help_command(ctx):
                     value=language_file.get("help_uploadstats"), inline=False)
     embed.add_field(name="/correct_latest",
                     value=language_file.get("help_correctlatest"), inline=False)
+    embed.add_field(name="/upload_queue",
+                    value=language_file.get("help_uploadqueue"), inline=False)
+    embed.add_field(name="/slowest_uploads",
+                    value=language_file.get("help_slowestuploads"), inline=False)
     embed.add_field(name="/alter_record",
                     value=language_file.get("help_alterrecord"), inline=False)
     embed.add_field(name="/get_record",
                     value=language_file.get("help_getrecord"), inline=False)
+    embed.add_field(name="/history",
+                    value=language_file.get("help_history"), inline=False)
     embed.add_field(name="/delete_record",
                     value=language_file.get("help_deleterecord"), inline=False)
     embed.add_field(name="/purge_records",
                     value=language_file.get("help_purgerecords"), inline=False)
+    embed.add_field(name="/export_records",
+                    value=language_file.get("help_exportrecords"), inline=False)
+    embed.add_field(name="/import_records",
+                    value=language_file.get("help_importrecords"), inline=False)
     embed.add_field(name="/scoreboard",
                     value=language_file.get("help_scoreboard"), inline=False)
+    embed.add_field(name="/rank",
+                    value=language_file.get("help_rank"), inline=False)
+    embed.add_field(name="/group_scoreboard",
+                    value=language_file.get("help_groupscoreboard"), inline=False)
     embed.add_field(name="/year_scoreboard",
                     value=language_file.get("help_year_scoreboard"), inline=False)
     embed.add_field(name="/month_scoreboard",
@@ -432,13 +791,18 @@ async def help_command(ctx):
                     value=language_file.get("help_week_scoreboard"), inline=False)
     embed.add_field(name="/day_scoreboard",
                     value=language_file.get("help_day_scoreboard"), inline=False)
+    embed.add_field(name="/live_scoreboard",
+                    value=language_file.get("help_livescoreboard"), inline=False)
+    embed.add_field(name="/remove_live_scoreboard",
+                    value=language_file.get("help_removelivescoreboard"), inline=False)
     await ctx.respond(embed=embed)
 
 
 @bot.slash_command(name="get_record", description="Shows the latest record of a specific player")
 @guild_only()
 async def get_record(ctx,
-                     playername: Option(str, "Enter the player's name", max_length=40)):
+                     playername: Option(str, "Enter the player's name", max_length=40,
+                                        autocomplete=playername_autocomplete)):
     await ctx.defer()
     # fetch user preferred language and obtain localized column names
     language = await get_language(ctx.author.id)
@@ -453,10 +817,37 @@ async def get_record(ctx,
             message += f"\n{localized_attribute}: {value}"
         message += "```"
     else:
-        message = f"{language_file.get('norecordfound')}"
+        message = player_not_found_message(language_file, ctx.guild.id, playername)
     await ctx.followup.send(message)
 
 
+@bot.slash_command(name="history", description="Shows a chart of a player's progress over time")
+@guild_only()
+async def history(ctx,
+                  playername: Option(str, "Enter the player's name", max_length=40,
+                                     autocomplete=playername_autocomplete),
+                  category: Option(str, "The category to plot", choices=categories),
+                  second_category: Option(str, "Optional second category to plot", choices=categories,
+                                          default=None),
+                  history_range: Option(str, "The time range of the chart", choices=list(history_ranges),
+                                        default="month")):
+    await ctx.defer()
+
+    # fetch user preferred language
+    language = await get_language(ctx.author.id)
+    language_file = translation_cache[language]
+
+    plotted_categories = [category] if second_category in (None, category) else [category, second_category]
+    labels = [language_file.get(plotted_category, plotted_category) for plotted_category in plotted_categories]
+    title = f"{language_file.get('historyfor')} {playername} ({language_file.get(history_range)})"
+
+    png = await get_history_chart(ctx.guild.id, playername, plotted_categories, history_range, title, labels)
+    if png is None:
+        await ctx.followup.send(player_not_found_message(language_file, ctx.guild.id, playername))
+        return
+    await ctx.followup.send(file=discord.File(io.BytesIO(png), filename="history.png"))
+
+
 # Helper functions
 async def generate_scoreboard(ctx, scoreboard_type, category, scope, kingdom=None, year=None, month=None, day=None,
                               week=None,
@@ -497,24 +888,99 @@ async def generate_scoreboard(ctx, scoreboard_type, category, scope, kingdom=Non
         await ctx.respond(language_file.get(message_key))
         return
 
-    asc_categories = ["globalrank", "regionalrank", "competitiverank"]
-    asc = category in asc_categories
+    asc = field_registry.is_ascending(category)
 
-    # Calculate the progress and sort the records
+    # Calculate the progress and sort the records, once per interaction; the pages are slices of this result
     changes = await calculate_changes(ctx.guild.id, category, scope == "All Servers", year, month, day, week, kingdom)
-    sorted_changes = sorted(changes, key=lambda x: x['differences'].get(category, 0), reverse=not asc)[:n]
+    sorted_changes = sorted(changes, key=lambda x: x['differences'].get(category, 0), reverse=not asc)
 
     # determine start and end dates for the embed title, then add the embed fields
     start_date, end_date = get_start_end_dates(year, month, day, week)
     title = f"{language_file.get(scoreboard_type)} {language_file.get('scoreboardfor')} {language_file.get(category)} {start_date} — {end_date}"
     if kingdom:
-        title = f"({kingdom}) {title}"
-    embed = discord.Embed(title=title, color=0x328ba8)
-    for entry in sorted_changes:
-        player_name = entry['playername']
-        category_progress = entry['differences'].get(category, 0)
-        embed.add_field(name=player_name, value=f"{language_file.get(category)}: {category_progress}", inline=False)
-    await ctx.followup.send(embed=embed)
+        title = f"({kingdom_display_name(kingdom)}) {title}"
+
+    async def fetch_page(cursor):
+        offset = cursor or 0
+        next_offset = offset + n if offset + n < len(sorted_changes) else None
+        return sorted_changes[offset:offset + n], next_offset
+
+    def make_embed(entries, page_index):
+        embed = discord.Embed(title=title, color=0x328ba8)
+        for position, entry in enumerate(entries, start=page_index * n + 1):
+            player_name = entry['playername']
+            category_progress = entry['differences'].get(category, 0)
+            embed.add_field(name=f"{position}. {player_name}",
+                            value=f"{language_file.get(category)}: {category_progress}", inline=False)
+        embed.set_footer(text=f"{language_file.get('page')} {page_index + 1}")
+        return embed
+
+    view = ScoreboardView(fetch_page, make_embed, previous_label=language_file.get("previouspage"),
+                          next_label=language_file.get("nextpage"), not_allowed_msg=language_file.get("notallowed"),
+                          initiator_id=ctx.author.id)
+    embed = await view.load_first_page()
+    if embed:
+        await ctx.followup.send(embed=embed, view=view)
+    else:
+        await ctx.followup.send(embed=make_embed([], 0))
+
+
+def live_scoreboard_embed(board, entries, frame):
+    """
+        Builds the embed of a live scoreboard message in the language of the board, like the scoreboard commands do.
+
+        :param board: The LiveBoard.
+        :param entries: The entries to show as [player name, value] pairs.
+        :param frame: The (year, month, day, week) time frame of the entries, None for all-time boards.
+        :return: The embed.
+        """
+    language_file = translation_cache[board.language]
+    if frame is None:
+        embed = discord.Embed(title=f"{language_file.get('scoreboardfor')} {language_file.get(board.category)}",
+                              color=0xa84232)
+    else:
+        start_date, end_date = get_start_end_dates(*frame)
+        embed = discord.Embed(title=f"{language_file.get(board.period)} {language_file.get('scoreboardfor')} "
+                                    f"{language_file.get(board.category)} {start_date} — {end_date}", color=0x328ba8)
+    for position, (player_name, value) in enumerate(entries, start=1):
+        embed.add_field(name=f"{position}. {player_name}",
+                        value=value if frame is None else f"{language_file.get(board.category)}: {value}",
+                        inline=False)
+    if not entries:
+        embed.description = language_file.get("noscoreboarddata")
+    embed.set_footer(text=language_file.get("liveleaderboard"))
+    embed.timestamp = discord.utils.utcnow()
+    return embed
+
+
+async def publish_live_scoreboard(board, entries, frame):
+    """
+        Edits a live scoreboard message to show new entries.
+
+        :return: False if the message or its channel no longer exists, True otherwise.
+        """
+    message = bot.get_partial_messageable(board.channel_id).get_partial_message(board.message_id)
+    try:
+        await message.edit(embed=live_scoreboard_embed(board, entries, frame))
+    except discord.NotFound:
+        return False
+    return True
+
+
+def player_not_found_message(language_file, guild_id, playername):
+    """
+        Builds the "no record found" message for a player, suggesting a similarly named player of the server if there is one.
+
+        :param language_file: The translations of the user's language.
+        :param guild_id: The ID of the server.
+        :param playername: The player name the user entered.
+        :return: The message.
+        """
+    message = language_file.get("norecordfound")
+    suggestion = player_index.suggest(guild_id, playername)
+    if suggestion:
+        message += f" {language_file.get('didyoumean')} **{suggestion}**?"
+    return message
 
 
 def is_valid_date(year, month=None, week=None, day=None):
@@ -545,40 +1011,6 @@ def is_valid_date(year, month=None, week=None, day=None):
     return ""
 
 
-def is_valid_input(category, new_value):
-    """
-       Validates a new value for a specified category against predefined rules and formats.
-
-       :param category: The category of the input to validate (e.g., "kingdom", "datecreated").
-       :param new_value: The new value to validate for the specified category.
-       :return: A string indicating the type of validation error, if any; an empty string indicates valid input.
-       """
-    if category == "kingdom":
-        return ""
-    elif category == "datecreated":
-        try:
-            # Attempt to convert the string to a datetime object
-            date_obj = datetime.strptime(new_value, "%Y-%m-%d")
-        except ValueError:
-            return "invaliddate"
-
-    # general integer conversion for the other categories
-    try:
-        new_value = int(new_value)
-    except ValueError:
-        return "invalidinput"
-
-    if category == "level":
-        return "" if 1 <= int(new_value) <= 250 else "invalidnumber"
-    elif category in (
-            "travelersguild", "anglersguild", "circleofanguish", "titanfelledguild", "bladesoffinesse",
-            "spelunkingguild",
-            "seersguild", "monumentalguild", "endlessrecord"):
-        return "" if 0 <= int(new_value) <= 9999 else "invalidnumber"
-    else:
-        return "" if 0 <= int(new_value) <= 99999999 else "invalidnumber"
-
-
 def create_translation_cache():
     """
     Loads translation files from a specified folder into a cache for quick access.
@@ -596,4 +1028,7 @@ def create_translation_cache():
 
 
 if __name__ == "__main__":
-    bot.run(token)
+    try:
+        asyncio.run(run_bot())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,162 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import unicodedata
+
+from fuzzywuzzy import fuzz, process
+
+import aggregate_related
+import writer_service
+
+create_kingdomdb_query = """
+CREATE TABLE IF NOT EXISTS kingdoms (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    normalized TEXT UNIQUE
+);
+"""
+ocr_match_threshold = 88  # fuzzy score needed to map an OCR'd name onto an existing kingdom
+user_match_threshold = 80  # user typed names in filters may be a bit sloppier
+
+kingdom_ids = dict()  # normalized name -> kingdom id
+kingdom_names = dict()  # kingdom id -> display name
+
+
+async def load_kingdoms(conn):
+    """
+    Creates the kingdom table if needed and loads all kingdoms into memory.
+
+    :param conn: The stat database connection.
+    """
+    await conn.execute(create_kingdomdb_query)
+    await conn.commit()
+    kingdom_ids.clear()
+    kingdom_names.clear()
+    async with conn.execute("SELECT id, name FROM kingdoms ORDER BY id") as cur:
+        for kingdom_id, name in await cur.fetchall():
+            # normalized again, the stored column may be from an older normalization, see renormalize_kingdoms
+            normalized = normalize_kingdom(name)
+            if normalized in kingdom_ids:
+                print(f"Kingdom {name} ({kingdom_id}) has the same normalized name as kingdom "
+                      f"{kingdom_names[kingdom_ids[normalized]]} ({kingdom_ids[normalized]}), keeping the first")
+                continue
+            kingdom_ids[normalized] = kingdom_id
+            kingdom_names[kingdom_id] = name
+
+
+async def renormalize_kingdoms(conn):
+    """
+    Brings the stored normalized names up to date after the normalization changed. Kingdoms that now have the same
+    normalized name, e.g. "Straße" and "Strasse", are merged into the one that already has it, or else the oldest:
+    their records are moved to it and the duplicates are deleted. The record triggers move the latest records and the
+    group aggregates along, the emptied aggregates of the duplicates are deleted. The caller commits.
+
+    :param conn: The stat database connection.
+    :return: Whether kingdoms were merged, the kingdoms have to be loaded again then.
+    """
+    groups = dict()  # new normalized name -> [(id, stored normalized name)]
+    async with conn.execute("SELECT id, name, normalized FROM kingdoms ORDER BY id") as cur:
+        for kingdom_id, name, normalized in await cur.fetchall():
+            groups.setdefault(normalize_kingdom(name), []).append((kingdom_id, normalized))
+
+    merged = False
+    outdated = []
+    for normalized, kingdoms in groups.items():
+        survivor = next((kingdom_id for kingdom_id, stored in kingdoms if stored == normalized), kingdoms[0][0])
+        for kingdom_id, _ in kingdoms:
+            if kingdom_id == survivor:
+                continue
+            print(f"Merging kingdom {kingdom_id} into kingdom {survivor}, both are normalized to {normalized}")
+            await conn.execute("UPDATE playerstats SET kingdomid = ? WHERE kingdomid = ?", (survivor, kingdom_id))
+            await aggregate_related.remove_group(conn, "kingdom", kingdom_id)
+            await conn.execute("DELETE FROM kingdoms WHERE id = ?", (kingdom_id,))
+            merged = True
+        if dict(kingdoms)[survivor] != normalized:
+            outdated.append((normalized, survivor))
+    # cleared first, an outdated name may be the new name of another kingdom
+    await conn.executemany("UPDATE kingdoms SET normalized = NULL WHERE id = ?", [(kingdom_id,) for _, kingdom_id in outdated])
+    await conn.executemany("UPDATE kingdoms SET normalized = ? WHERE id = ?", outdated)
+    return merged
+
+
+def normalize_kingdom(name):
+    """
+    Normalizes a kingdom name so that case, accents, punctuation and whitespace differences disappear. Letters and
+    digits of every script are kept, so names written in e.g. Cyrillic or Chinese stay distinct.
+
+    :param name: The kingdom name as typed or recognized.
+    :return: The normalized name, an empty string if nothing is left.
+    """
+    name = unicodedata.normalize("NFKD", str(name).casefold())
+    return ''.join(character for character in name if character.isalnum() and not unicodedata.combining(character))
+
+
+def find_kingdom(name, threshold=user_match_threshold):
+    """
+    Finds the id of a known kingdom by exact normalized name or, failing that, by fuzzy matching.
+
+    :param name: The kingdom name.
+    :param threshold: The minimum fuzzy score for a match.
+    :return: The kingdom id or None.
+    """
+    normalized = normalize_kingdom(name)
+    if not normalized:
+        return None
+    if normalized in kingdom_ids:
+        return kingdom_ids[normalized]
+    if kingdom_ids:
+        match = process.extractOne(normalized, kingdom_ids.keys(), scorer=fuzz.ratio, score_cutoff=threshold)
+        if match:
+            return kingdom_ids[match[0]]
+    return None
+
+
+async def resolve_kingdom(conn, name):
+    """
+    Returns the id of the kingdom an OCR'd or entered kingdom name belongs to, creating the kingdom if it is new.
+    The caller commits the surrounding write.
+
+    :param conn: The stat database connection.
+    :param name: The kingdom name.
+    :return: The kingdom id, or None for an empty name.
+    """
+    kingdom_id = find_kingdom(name, ocr_match_threshold)
+    if kingdom_id is not None or not normalize_kingdom(name):
+        return kingdom_id
+
+    normalized = normalize_kingdom(name)
+    display_name = ' '.join(str(name).split())
+    async with conn.execute("INSERT OR IGNORE INTO kingdoms (name, normalized) VALUES (?, ?)",
+                            (display_name, normalized)):
+        pass
+    async with conn.execute("SELECT id, name FROM kingdoms WHERE normalized = ?", (normalized,)) as cur:
+        kingdom_id, display_name = await cur.fetchone()
+    kingdom_added(kingdom_id, display_name, normalized)
+    writer_service.publish("kingdom_added", kingdom_id, display_name, normalized)
+    return kingdom_id
+
+
+def kingdom_added(kingdom_id, name, normalized):
+    kingdom_ids[normalized] = kingdom_id
+    kingdom_names[kingdom_id] = name
+
+
+@writer_service.event_handler("kingdom_added")
+async def apply_kingdom_added(kingdom_id, name, normalized):
+    kingdom_added(kingdom_id, name, normalized)
+
+
+def kingdom_display_name(name):
+    """
+    Returns the stored spelling of a kingdom for titles, or the given name if the kingdom is unknown.
+
+    :param name: The kingdom name as typed by the user.
+    :return: The display name.
+    """
+    kingdom_id = find_kingdom(name)
+    return kingdom_names.get(kingdom_id, name)
@@ -6,6 +6,8 @@ Permission is hereby granted, free of charge, to any person obtaining a copy of
 The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
 """
 
+import os
+
 import aiosqlite
 from asyncio import Lock
 
@@ -20,6 +22,7 @@ class LangDBConnection:
         _instance (LangDBConnection): The singleton instance of the LangDBConnection class.
         _lock (Lock): An asyncio Lock object to ensure thread-safe initialization of the singleton instance.
         _connection (aiosqlite.Connection): The SQLite database connection.
+        path (str): The path of the SQLite database file.
 
     Methods:
         get_instance: Returns the singleton instance of the LangDBConnection class, creating it if it does not exist.
@@ -27,6 +30,7 @@ class LangDBConnection:
     """
     _instance = None
     _lock = Lock()
+    path = os.getenv('LANG_DB_PATH', '../langprefs.db')
 
     def __init__(self):
         if LangDBConnection._instance is not None:
@@ -44,7 +48,7 @@ class LangDBConnection:
 
     async def _initialize(self):
         if self._connection is None:
-            self._connection = await aiosqlite.connect('../langprefs.db')
+            self._connection = await aiosqlite.connect(LangDBConnection.path)
 
     async def get_connection(self):
         return self._connection
@@ -0,0 +1,303 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import asyncio
+import bisect
+import os
+import sqlite3
+
+import field_registry
+import metrics
+from stat_db_connection import write_transaction
+
+top_k_size = int(os.getenv('GLOBAL_TOP_K', '200'))
+save_interval_seconds = 60
+
+create_topk_queries = [
+    """
+    CREATE TABLE IF NOT EXISTS global_topk (
+        category TEXT,
+        position INTEGER,
+        value INTEGER,
+        recordid INTEGER,
+        guildid INTEGER,
+        playername TEXT,
+        PRIMARY KEY (category, position)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS global_topk_state (
+        category TEXT PRIMARY KEY,
+        exhaustive INTEGER,
+        clean INTEGER
+    )
+    """,
+]
+# a change of a latest record flags the saved lists as outdated in the transaction of the change itself, so a crash
+# right after it leads to a rebuild
+create_topk_queries += [f"""
+    CREATE TRIGGER IF NOT EXISTS global_topk_unclean_after_{event.lower()} AFTER {event} ON latest_playerstats
+    BEGIN
+        UPDATE global_topk_state SET clean = 0 WHERE clean = 1;
+    END
+    """ for event in ("INSERT", "UPDATE", "DELETE")]
+
+top_k = dict()  # category -> TopK
+dirty = set()  # categories changed since the last save
+marked_unclean = False  # whether the persisted lists have been flagged as outdated since the last save
+persist = True  # whether this process saves the lists, the bot processes of a cluster only keep them in memory
+save_task = None
+
+
+class TopK:
+    """
+    The best entries of one category over all servers, kept sorted.
+
+    The entries are always the true top len(entries) of the category. When a listed player drops out, the entry that
+    would move up is unknown, so the list shrinks instead of guessing; reads that need more entries rebuild it.
+
+    Attributes:
+        ascending (bool): Whether lower values rank higher.
+        entries (list): Sorted list of (sort key, value, record id, guild id, playername).
+        exhaustive (bool): Whether entries holds every player with a value in this category.
+    """
+
+    def __init__(self, ascending, entries=None, exhaustive=False):
+        self.ascending = ascending
+        self.entries = sorted(entries or [])
+        self.exhaustive = exhaustive
+
+    def sort_key(self, value, record_id):
+        return (value, record_id) if self.ascending else (-value, -record_id)
+
+    def make_entry(self, value, record_id, guild_id, playername):
+        return self.sort_key(value, record_id), value, record_id, guild_id, playername
+
+    def remove_player(self, guild_id, playername):
+        for i, entry in enumerate(self.entries):
+            if entry[3] == guild_id and entry[4] == playername:
+                del self.entries[i]
+                return True
+        return False
+
+    def update_player(self, guild_id, playername, value, record_id):
+        """
+        Applies the latest value of a player. Returns whether the list changed.
+        """
+        changed = self.remove_player(guild_id, playername)
+        if isinstance(value, int):
+            entry = self.make_entry(value, record_id, guild_id, playername)
+            # a player below the last entry may only be added when every player is listed,
+            # otherwise unlisted players between the last entry and this one could be skipped
+            if self.exhaustive or (self.entries and entry[0] < self.entries[-1][0]):
+                bisect.insort(self.entries, entry)
+                changed = True
+        if len(self.entries) > top_k_size:
+            del self.entries[top_k_size:]
+            self.exhaustive = False
+        return changed
+
+    def page(self, limit, after=None):
+        """
+        Returns a page of entries and the cursor of the next page, or None if the list cannot answer the request.
+        """
+        start = 0
+        if after is not None:
+            # sort keys are unique, so this lands right behind the cursor entry
+            start = bisect.bisect_right(self.entries, (self.sort_key(*after), float('inf')))
+        end = start + limit
+        if end > len(self.entries) and not self.exhaustive:
+            return None
+        page_entries = self.entries[start:end]
+        has_next = end < len(self.entries) or not self.exhaustive
+        next_cursor = (page_entries[-1][1], page_entries[-1][2]) if has_next and page_entries else None
+        return [{'playername': entry[4], 'value': entry[1]} for entry in page_entries], next_cursor
+
+
+async def load(conn, categories):
+    """
+    Loads the persisted top lists. Categories whose lists were not saved after the last change are rebuilt
+    from the latest record table.
+
+    :param conn: The stat database connection.
+    :param categories: The rankable categories.
+    """
+    global marked_unclean
+    for query in create_topk_queries:
+        await conn.execute(query)
+    await conn.commit()
+
+    async with conn.execute("SELECT category, exhaustive FROM global_topk_state WHERE clean = 1") as cur:
+        clean_categories = {category: bool(exhaustive) for category, exhaustive in await cur.fetchall()}
+
+    top_k.clear()
+    for category in categories:
+        ascending = field_registry.is_ascending(category)
+        if category in clean_categories:
+            async with conn.execute("""
+                SELECT value, recordid, guildid, playername FROM global_topk WHERE category = ? ORDER BY position
+            """, (category,)) as cur:
+                rows = await cur.fetchall()
+            table = TopK(ascending, exhaustive=clean_categories[category])
+            table.entries = [table.make_entry(*row) for row in rows]
+            top_k[category] = table
+        else:
+            await rebuild(conn, category)
+    marked_unclean = False
+
+
+async def rebuild(conn, category):
+    """
+    Rebuilds the top list of a category from the category index of the latest record table.
+
+    :param conn: The stat database connection.
+    :param category: The category to rebuild.
+    :return: The rebuilt TopK.
+    """
+    ascending = field_registry.is_ascending(category)
+    order = "ASC" if ascending else "DESC"
+    async with conn.execute(f"""
+        SELECT {category}, id, guildid, playername FROM latest_playerstats
+        WHERE {category} IS NOT NULL AND typeof({category}) = 'integer'
+        ORDER BY {category} {order}, id {order}
+        LIMIT ?
+    """, (top_k_size + 1,)) as cur:
+        rows = await cur.fetchall()
+
+    table = TopK(ascending, exhaustive=len(rows) <= top_k_size)
+    table.entries = [table.make_entry(*row) for row in rows[:top_k_size]]
+    top_k[category] = table
+    dirty.add(category)
+    return table
+
+
+async def player_changed(conn, guild_id, playername):
+    """
+    Updates every top list with the latest record of a player after a write.
+
+    :param conn: The stat database connection.
+    :param guild_id: The guild ID of the player.
+    :param playername: The name of the player.
+    """
+    if not top_k:
+        return
+    categories = list(top_k)
+    async with conn.execute(f"""
+        SELECT id, {', '.join(categories)} FROM latest_playerstats WHERE guildid = ? AND playername = ?
+    """, (guild_id, playername)) as cur:
+        record = await cur.fetchone()
+
+    for i, category in enumerate(categories):
+        if record:
+            changed = top_k[category].update_player(guild_id, playername, record[i + 1], record[0])
+        else:
+            changed = top_k[category].remove_player(guild_id, playername)
+        if changed:
+            dirty.add(category)
+    await mark_unclean(conn)
+
+
+async def invalidate(conn):
+    """
+    Drops all top lists, e.g. after a bulk import. They are rebuilt on their next read.
+
+    :param conn: The stat database connection.
+    """
+    for category in list(top_k):
+        top_k[category] = TopK(field_registry.is_ascending(category))
+        dirty.add(category)
+    await mark_unclean(conn)
+
+
+async def get_page(conn, category, ascending, limit, after=None):
+    """
+    Serves a page of the all servers scoreboard of a category from memory, rebuilding the list on a miss.
+
+    :param conn: The stat database connection.
+    :param category: The statistic of the scoreboard.
+    :param ascending: Boolean indicating whether the scoreboard is sorted in ascending order.
+    :param limit: The number of entries on the page.
+    :param after: Optional; the (value, id) cursor of the last entry of the previous page.
+    :return: A tuple (entries, cursor) or None if the request has to fall back to a query.
+    """
+    table = top_k.get(category)
+    if table is None or table.ascending != ascending:
+        metrics.cache_lookup("leaderboard", False)
+        return None
+    result = table.page(limit, after)
+    if result is None and len(table.entries) < top_k_size:
+        # the list shrank below the request, fill it up again
+        metrics.cache_lookup("leaderboard", False)
+        return (await rebuild(conn, category)).page(limit, after)
+    metrics.cache_lookup("leaderboard", result is not None)
+    return result
+
+
+async def mark_unclean(conn):
+    """
+    Flags the persisted lists as outdated on the first change after a save, so a crash before the next save
+    leads to a rebuild instead of loading stale lists. The change itself flagged them already, this covers a save
+    that ran between the change and the update of the lists in memory.
+    """
+    global marked_unclean
+    if persist and not marked_unclean:
+        try:
+            async with write_transaction(conn):
+                await conn.execute("UPDATE global_topk_state SET clean = 0")
+        except sqlite3.OperationalError as e:
+            # the change is committed, failing it here would report it as lost; the next change tries again
+            print(f"Flagging the saved top lists as outdated failed: {e}")
+            return
+        marked_unclean = True
+
+
+async def save(conn):
+    """
+    Persists the changed top lists.
+
+    :param conn: The stat database connection.
+    """
+    global marked_unclean
+    if not dirty:
+        return
+    categories = list(dirty)
+    dirty.clear()
+    async with write_transaction(conn):
+        for category in categories:
+            table = top_k[category]
+            await conn.execute("DELETE FROM global_topk WHERE category = ?", (category,))
+            await conn.executemany(
+                "INSERT INTO global_topk (category, position, value, recordid, guildid, playername) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(category, position, entry[1], entry[2], entry[3], entry[4])
+                 for position, entry in enumerate(table.entries)])
+            await conn.execute(
+                "INSERT OR REPLACE INTO global_topk_state (category, exhaustive, clean) VALUES (?, ?, 1)",
+                (category, int(table.exhaustive)))
+        await conn.execute("UPDATE global_topk_state SET clean = 1")
+    marked_unclean = False
+
+
+async def save_loop(get_connection):
+    while True:
+        await asyncio.sleep(save_interval_seconds)
+        try:
+            await save(await get_connection())
+        except Exception as e:
+            print(f"Saving the global top lists failed: {e}")
+
+
+def start_save_task(get_connection):
+    """
+    Starts the task that periodically persists the top lists, if it is not already running.
+
+    :param get_connection: An async function returning the stat database connection.
+    """
+    global save_task
+    if save_task is None or save_task.done():
+        save_task = asyncio.create_task(save_loop(get_connection))
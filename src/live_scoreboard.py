@@ -0,0 +1,264 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+
+import db_related
+import field_registry
+import writer_service
+
+# a board is edited once its records were quiet for the debounce time, or at the latest after the maximum delay
+debounce_seconds = float(os.getenv('LIVE_SCOREBOARD_DEBOUNCE', '30'))
+max_delay_seconds = max(debounce_seconds, float(os.getenv('LIVE_SCOREBOARD_MAX_DELAY', '120')))
+check_interval_seconds = 5
+max_boards_per_guild = 10
+max_pending_changes = 10000  # beyond this every board is recomputed instead of checking the players one by one
+periods = ("all", "daily", "weekly", "monthly", "yearly")
+
+boards = dict()  # live scoreboard id -> LiveBoard
+changes = set()  # (guild id, player name) changed since the last check
+update_task = None
+
+
+class LiveBoard:
+    """
+    A registered live scoreboard message, the entries it shows and the changes that may affect them.
+    """
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.guild_id = row['guildid']
+        self.channel_id = row['channelid']
+        self.message_id = row['messageid']
+        self.category = row['category']
+        self.all_servers = bool(row['allservers'])
+        self.period = row['period']
+        self.size = row['size']
+        self.language = row['language']
+        self.period_key = row['periodkey']
+        self.entries = row['entries']
+        self.players = set()  # (guild id, player name) to check against the entries
+        self.full = True  # recompute without checking, e.g. after a restart or an import
+        self.first_change = self.last_change = time.monotonic()
+
+    @property
+    def ascending(self):
+        return field_registry.is_ascending(self.category)
+
+    def mark(self, guild_id, playername):
+        if not self.all_servers and guild_id is not None and guild_id != self.guild_id:
+            return
+        if guild_id is None or playername is None:
+            self.full = True
+        else:
+            self.players.add((guild_id, playername))
+        now = time.monotonic()
+        if not self.is_pending():
+            self.first_change = now
+        self.last_change = now
+
+    def is_pending(self):
+        return self.full or bool(self.players)
+
+    def is_due(self, now):
+        return self.is_pending() and (now - self.last_change >= debounce_seconds or
+                                      now - self.first_change >= max_delay_seconds)
+
+
+def current_frame(period):
+    """
+    Returns the current time frame of a period as (year, month, day, week), with the defaults of the
+    year, month, week and day scoreboards.
+    """
+    current_date = datetime.utcnow()
+    if period == "daily":
+        return current_date.year, current_date.month, current_date.day, None
+    if period == "weekly":
+        return current_date.year, None, None, current_date.isocalendar()[1]
+    if period == "monthly":
+        return current_date.year, current_date.month, None, None
+    if period == "yearly":
+        return current_date.year, None, None, None
+    return None
+
+
+def frame_key(frame):
+    return "" if frame is None else "-".join(str(part or 0) for part in frame)
+
+
+async def compute_entries(board, frame):
+    """
+    Runs the full scoreboard query of a board.
+
+    :return: The top entries as [player name, value] pairs.
+    """
+    if frame is None:
+        entries, _ = await db_related.get_scoreboard_page(board.guild_id, board.category, board.all_servers,
+                                                          board.ascending, board.size)
+        return [[entry['playername'], entry['value']] for entry in entries]
+    changed = await db_related.calculate_changes(board.guild_id, board.category, board.all_servers, *frame)
+    changed.sort(key=lambda x: x['differences'].get(board.category, 0), reverse=not board.ascending)
+    return [[entry['playername'], entry['differences'].get(board.category, 0)] for entry in changed[:board.size]]
+
+
+def affects(board, playername, value):
+    """
+    Returns whether a player's new value can change the entries a board shows.
+
+    :param board: The LiveBoard.
+    :param playername: The name of the changed player.
+    :param value: The player's value on the board now, None if the player does not appear on it at all.
+    """
+    shown = [entry for entry in board.entries if entry[0] == playername]
+    if shown:
+        return [playername, value] not in shown
+    if value is None:
+        return False
+    if len(board.entries) < board.size:
+        return True
+    last_value = board.entries[-1][1]
+    if not isinstance(value, int) or not isinstance(last_value, int):
+        return True  # text values sort after numbers, leave the order to the full query
+    return value <= last_value if board.ascending else value >= last_value
+
+
+async def needs_recompute(board, players, frame):
+    # one indexed lookup per changed player instead of the scoreboard query
+    for guild_id, playername in players:
+        if frame is None:
+            value = await db_related.get_player_value(guild_id, playername, board.category)
+        else:
+            value = await db_related.get_player_progress(guild_id, playername, board.category, board.all_servers,
+                                                         *frame)
+        if affects(board, playername, value):
+            return True
+    return False
+
+
+async def refresh(board, publish):
+    """
+    Brings a board's message up to date if its entries changed.
+
+    :param board: The LiveBoard.
+    :param publish: The async function showing the entries, see start.
+    """
+    frame = current_frame(board.period)
+    period_key = frame_key(frame)
+    players, full = board.players, board.full
+    board.players, board.full = set(), False
+    try:
+        if not full and board.entries is not None and period_key == board.period_key:
+            if not await needs_recompute(board, players, frame):
+                return
+        entries = await compute_entries(board, frame)
+        if entries == board.entries and period_key == board.period_key:
+            return
+        if not await publish(board, entries, frame):
+            print(f"Live scoreboard message {board.message_id} is gone, removing it")
+            await remove(board.guild_id, board.message_id)
+            return
+        board.entries, board.period_key = entries, period_key
+        await db_related.save_live_scoreboard_state(board.id, period_key, entries)
+    except Exception as e:
+        print(f"Updating live scoreboard {board.id} failed: {e}")
+        board.mark(None, None)
+
+
+async def update_loop(is_owner, publish):
+    global changes
+    while True:
+        await asyncio.sleep(check_interval_seconds)
+        changed, changes = changes, set()
+        now = time.monotonic()
+        for board in list(boards.values()):
+            if not is_owner(board):
+                continue
+            for guild_id, playername in changed:
+                board.mark(guild_id, playername)
+            rolled_over = frame_key(current_frame(board.period)) != board.period_key
+            if board.is_due(now) or (rolled_over and not board.is_pending()):
+                await refresh(board, publish)
+
+
+def record_changed(guild_id, playername):
+    # called after every write, only remembers the player until the update loop looks at it
+    if len(changes) >= max_pending_changes:
+        changes.clear()
+        guild_id = playername = None
+    changes.add((guild_id, playername))
+
+
+async def load():
+    """
+    Loads the registered boards, keeping the pending changes of boards that were loaded before.
+    """
+    rows = await db_related.get_live_scoreboards()
+    loaded = dict()
+    for row in rows:
+        board = LiveBoard(row)
+        previous = boards.get(board.id)
+        if previous is not None:
+            board.entries, board.period_key = previous.entries, previous.period_key
+            board.players, board.full = previous.players, previous.full
+            board.first_change, board.last_change = previous.first_change, previous.last_change
+        loaded[board.id] = board
+    boards.clear()
+    boards.update(loaded)
+
+
+@writer_service.event_handler("live_scoreboards_changed")
+async def apply_live_scoreboards_changed():
+    await load()
+
+
+def guild_board_count(guild_id):
+    return sum(1 for board in boards.values() if board.guild_id == guild_id)
+
+
+async def add(guild_id, channel_id, message_id, category, scope, period, size, language, entries):
+    """
+    Registers a posted message as a live scoreboard.
+
+    :param entries: The entries the message shows, as [player name, value] pairs.
+    :return: The ID of the live scoreboard.
+    """
+    board_id = await db_related.add_live_scoreboard(guild_id, channel_id, message_id, category, scope, period, size,
+                                                    language, frame_key(current_frame(period)), entries)
+    await load()
+    boards[board_id].full = False
+    return board_id
+
+
+async def remove(guild_id, message_id):
+    """
+    Stops updating a live scoreboard message.
+
+    :return: True if the message was a live scoreboard of the guild.
+    """
+    removed = await db_related.remove_live_scoreboard(guild_id, message_id)
+    await load()
+    return removed
+
+
+async def start(is_owner, publish):
+    """
+    Loads the live scoreboards and starts the task that keeps their messages up to date.
+
+    :param is_owner: A function returning whether this process shows a board, i.e. is connected to its guild.
+    :param publish: An async function (board, entries, frame) that edits the board's message and returns False
+                    if the message no longer exists. frame is None for all-time boards.
+    """
+    global update_task
+    await load()
+    if record_changed not in db_related.record_listeners:
+        db_related.record_listeners.append(record_changed)
+    if update_task is None:
+        update_task = asyncio.create_task(update_loop(is_owner, publish))
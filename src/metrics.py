@@ -0,0 +1,225 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import asyncio
+import functools
+import inspect
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiohttp import web
+
+metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+metrics_port = int(os.getenv('METRICS_PORT') or 0)  # the endpoint is only served when a port is set
+loop_lag_interval_seconds = 0.5
+
+# latency buckets in seconds, from a cached lookup to an upload that waited for its OCR slot
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+registry = []  # every metric, in the order they are exposed
+lag_task = None
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """
+    A Prometheus histogram. Observing a value is a bisect and two additions, the cumulative bucket counts are
+    only built when the metrics are scraped.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = dict()  # label values -> [count per bucket (the last one is +Inf), sum]
+        registry.append(self)
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """
+        Observes the duration of the with block, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in list(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """
+    A Prometheus counter.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = dict()  # label values -> count
+        registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    A gauge or counter whose values are read from a function when the metrics are scraped, e.g. a queue length,
+    so the code that owns the value does not have to report it.
+    """
+
+    def __init__(self, name, documentation, function, labelnames=(), kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.function = function  # returns a number, or a dictionary mapping label value tuples to numbers
+        self.labelnames = labelnames
+        self.kind = kind
+        registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self.function()
+        except Exception as e:
+            print(f"Reading the metric {self.name} failed: {e}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+command_seconds = Histogram("karibot_command_duration_seconds", "Time from invoking a slash command to its return",
+                            ("command",))
+ocr_stage_seconds = Histogram("karibot_ocr_stage_duration_seconds",
+                              "Time spent per stage of reading an uploaded screenshot", ("stage",))
+db_seconds = Histogram("karibot_db_query_duration_seconds", "Time spent per db_related function call",
+                       ("function",))
+cache_requests = Counter("karibot_cache_requests_total", "Lookups in the in-memory caches", ("cache", "result"))
+loop_lag_seconds = Histogram("karibot_event_loop_lag_seconds",
+                             "How late the event loop ran a timer, i.e. how long callbacks blocked it",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+
+def register_callback(name, documentation, function, labelnames=(), kind="gauge"):
+    """
+    Exposes a value that is read when the metrics are scraped. See CallbackMetric.
+    """
+    return CallbackMetric(name, documentation, function, labelnames, kind)
+
+
+def cache_lookup(cache, hit):
+    cache_requests.inc(cache, "hit" if hit else "miss")
+
+
+def timed(histogram, *labels):
+    """
+    Decorator observing the duration of every call of an async function in the histogram.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+
+        return wrapper
+
+    return decorator
+
+
+def time_module_functions(namespace, histogram, skip=()):
+    """
+    Wraps the async functions defined in a module, labelled with their names, so every call is timed.
+    Call it at the end of the module with globals().
+
+    :param namespace: The globals() of the module.
+    :param histogram: The histogram to observe the durations in.
+    :param skip: Optional; names of functions that are not worth timing.
+    """
+    module_name = namespace['__name__']
+    for name, value in list(namespace.items()):
+        if inspect.iscoroutinefunction(value) and value.__module__ == module_name and name not in skip:
+            namespace[name] = timed(histogram, name)(value)
+
+
+def render():
+    """
+    Returns every metric in the Prometheus text format.
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def monitor_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + loop_lag_interval_seconds
+        await asyncio.sleep(loop_lag_interval_seconds)
+        loop_lag_seconds.observe(max(0.0, loop.time() - scheduled))
+
+
+async def serve(request):
+    return web.Response(body=render().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def start():
+    """
+    Starts the event loop lag monitor and, if METRICS_PORT is set, serves the metrics on
+    http://METRICS_HOST:METRICS_PORT/metrics.
+    """
+    global lag_task
+    if lag_task is None:
+        lag_task = asyncio.create_task(monitor_loop_lag())
+    if not metrics_port:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", serve)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, metrics_host, metrics_port).start()
+    print(f"Serving metrics on http://{metrics_host}:{metrics_port}/metrics")
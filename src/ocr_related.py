@@ -7,21 +7,37 @@ The above copyright notice and this permission notice shall be included in all c
 """
 
 import re
-from datetime import datetime
 import concurrent.futures
+from functools import lru_cache
 import aiohttp
 import asyncio
 import io
-import db_related
+import os
+import category_related
+import field_registry
+import metrics
+import tracing
 from fuzzywuzzy import fuzz
 from PIL import Image, ImageOps, ImageEnhance
-from pytesseract import image_to_string
+from pytesseract import image_to_string, pytesseract
 
 
 executor = concurrent.futures.ThreadPoolExecutor()  # global executor
-
-
-async def process_images_tess(image_url, playername, guild_id, discord_id, language_file, second_image_url=None):
+label_separator = re.compile(r"\s{2,}")  # between a label and its value on a recognized line
+debug_image_path = os.getenv('OCR_DEBUG_IMAGE', 'latest.png')  # the last preprocessed image, empty to not save it
+debug_text = os.getenv('OCR_DEBUG_TEXT', '0') == '1'  # prints the text read from every screenshot
+# bump when the preprocessing, the parser or the traineddata change, archived screenshots are then read again
+pipeline_version = os.getenv('OCR_PIPELINE_VERSION', '1')
+metrics.register_callback("karibot_ocr_executor_queue_depth", "Image jobs waiting for a thread of the OCR executor",
+                          lambda: executor._work_queue.qsize())
+metrics.register_callback("karibot_ocr_label_match_cache_total", "Lookups in the fuzzy label match cache",
+                          lambda: {("hit",): find_best_match.cache_info().hits,
+                                   ("miss",): find_best_match.cache_info().misses}, ("result",), "counter")
+
+
+@tracing.traced("process_images_tess")
+async def process_images_tess(image_url, playername, guild_id, discord_id, language_file, second_image_url=None,
+                              images=None):
     """
         Asynchronously processes one or two images for OCR to extract player stats.
         Handles image fetching, OCR, and post-processing.
@@ -32,21 +48,20 @@ async def process_images_tess(image_url, playername, guild_id, discord_id, langu
         :param discord_id: Discord ID of the player.
         :param language_file: A dict containing OCR language and mappings for column names.
         :param second_image_url: Optional URL of the second image to process.
+        :param images: Optional; a list the downloaded image files are appended to, e.g. to archive them.
         :return: A dictionary containing sanitized OCR results including player stats.
         """
     playerstats = {}
     async with aiohttp.ClientSession() as session:
-        playerstats, visited = await fetch_and_process_image(session, image_url, ocr_processing, language_file)
+        playerstats, visited = await fetch_and_process_image(session, image_url, ocr_processing_async,
+                                                             language_file, images)
         playerstats = sanitize_ocr_results(playerstats)
 
         if second_image_url:
-            playerstats2, visited2 = await fetch_and_process_image(session, second_image_url, ocr_processing,
-                                                                   language_file)
+            playerstats2, visited2 = await fetch_and_process_image(session, second_image_url, ocr_processing_async,
+                                                                   language_file, images)
             playerstats2 = sanitize_ocr_results(playerstats2)
-            # merge dictionaries
-            for key, value in playerstats2.items():
-                if key in visited2 and (key not in visited or visited2[key] > visited[key]):
-                    playerstats[key] = value
+            merge_ocr_results(playerstats, visited, playerstats2, visited2)
 
         playerstats['playername'] = playername
         playerstats['guildid'] = guild_id
@@ -55,31 +70,91 @@ async def process_images_tess(image_url, playername, guild_id, discord_id, langu
     return playerstats
 
 
+def merge_ocr_results(playerstats, visited, playerstats2, visited2):
+    """
+    Merges the stats read from a second screenshot into those of the first, keeping the value whose label was
+    recognized with the higher score.
+
+    :param playerstats: The stats of the first image, updated in place.
+    :param visited: The label scores of the first image, updated in place.
+    :param playerstats2: The stats of the second image.
+    :param visited2: The label scores of the second image.
+    """
+    for key, value in playerstats2.items():
+        if key in visited2 and (key not in visited or visited2[key] > visited[key]):
+            playerstats[key] = value
+            visited[key] = visited2[key]
+
+
 # asynchronously fetch the image and call the ocr and post processing function
-async def fetch_and_process_image(session, url, ocr_processing_func, language_file):
+@tracing.traced("fetch_and_process_image")
+async def fetch_and_process_image(session, url, ocr_processing_func, language_file, images=None):
     """
     Asynchronously fetches an image from a URL, performs OCR, and processes the text.
 
     :param session: The aiohttp ClientSession object for making HTTP requests.
     :param url: The URL of the image to fetch and process.
-    :param ocr_processing_func: The OCR processing function to use.
+    :param ocr_processing_func: The async OCR processing function to use.
     :param language_file: A dict containing OCR language and mappings for column names.
+    :param images: Optional; a list the downloaded image file is appended to.
     :return: A tuple (playerstats, visited) where playerstats is a dict of extracted information,
              and visited tracks which fields have been processed.
     """
-    async with session.get(url) as response:
-        response.raise_for_status()
-        image_data = await response.read()
-        byte_stream = io.BytesIO(image_data)
-        img = Image.open(byte_stream)
-        loop = asyncio.get_running_loop()
-        img_text = await loop.run_in_executor(executor, ocr_processing_func, img,
-                                              language_file)  # run ocr in separate thread
+    with metrics.ocr_stage_seconds.time("download"), tracing.span("download"):
+        async with session.get(url) as response:
+            response.raise_for_status()
+            image_data = await response.read()
+    if images is not None:
+        images.append(image_data)
+    return await process_image_data(image_data, ocr_processing_func, language_file)
+
+
+async def process_image_data(image_data, ocr_processing_func, language_file):
+    """
+    Decodes an image file, performs OCR, and processes the text.
+
+    :param image_data: The bytes of the image file.
+    :param ocr_processing_func: The async OCR processing function to use.
+    :param language_file: A dict containing OCR language and mappings for column names.
+    :return: A tuple (playerstats, visited) like fetch_and_process_image.
+    """
+    with metrics.ocr_stage_seconds.time("decode"):
+        img = await tracing.run_in_executor(executor, "decode", decode_image, image_data)
+    img_text = await ocr_processing_func(img, language_file)  # run ocr in a separate process
+    if debug_text:
         print(img_text)
-        lines = img_text.strip().split("\n")
+    lines = img_text.strip().split("\n")
+    with metrics.ocr_stage_seconds.time("parse"):
         playerstats, visited = await process_text_tess(lines,
                                                        language_file)  # post process
-        return playerstats, visited
+    return playerstats, visited
+
+
+async def process_stored_images(images, language_file):
+    """
+    Reads the stats from the image files of an earlier upload, like process_images_tess reads a new one.
+
+    :param images: The bytes of the first and optionally the second image file.
+    :param language_file: A dict containing OCR language and mappings for column names.
+    :return: A dictionary containing the sanitized stats.
+    """
+    playerstats, visited = dict(), dict()
+    for image_data in images:
+        stats, seen = await process_image_data(image_data, ocr_processing_async, language_file)
+        merge_ocr_results(playerstats, visited, sanitize_ocr_results(stats), seen)
+    return playerstats
+
+
+def decode_image(image_data):
+    """
+    Decodes a downloaded image. PIL only reads the header on open, so the pixels are loaded here as well.
+
+    :param image_data: The bytes of the image file.
+    :return: The PIL Image object.
+    """
+    img = Image.open(io.BytesIO(image_data))
+    img.load()
+    return img
 
 
 # function that preprocesses and performs ocr on the image
@@ -91,6 +166,50 @@ def ocr_processing(img, language_file):
     :param language_file: A dict containing OCR language and mappings for column names.
     :return: The extracted text as a string.
     """
+    img = preprocess_image(img)
+    img_text = image_to_string(img, config=tesseract_config(language_file))
+    return img_text
+
+
+@tracing.traced("ocr_processing")
+async def ocr_processing_async(img, language_file):
+    """
+    Preprocesses an image and performs OCR to extract text, like ocr_processing. Tesseract runs in a child process
+    that is killed when the coroutine is cancelled, e.g. at the deadline of the upload.
+
+    :param img: The PIL Image object to process.
+    :param language_file: A dict containing OCR language and mappings for column names.
+    :return: The extracted text as a string.
+    """
+    with metrics.ocr_stage_seconds.time("preprocess"):
+        # preprocess in separate thread
+        png = await tracing.run_in_executor(executor, "preprocess", preprocess_image_png, img)
+    with metrics.ocr_stage_seconds.time("tesseract"), tracing.span("tesseract"):
+        process = await asyncio.create_subprocess_exec(
+            pytesseract.tesseract_cmd, "stdin", "stdout", *tesseract_config(language_file).split(),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await process.communicate(png)
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+    if process.returncode != 0:
+        raise RuntimeError(f"Tesseract failed: {stderr.decode(errors='replace').strip()}")
+    return stdout.decode("utf-8")
+
+
+def tesseract_config(language_file):
+    return f'--psm 6 --oem 1 -c preserve_interword_spaces=1 -l {language_file.get("tesseractmodel")}'
+
+
+def preprocess_image(img):
+    """
+    Scales, inverts and enhances a screenshot for OCR.
+
+    :param img: The PIL Image object to process.
+    :return: The preprocessed image.
+    """
     width, height = img.size
     smallest_dim = min(width, height)
 
@@ -110,13 +229,19 @@ def ocr_processing(img, language_file):
     img = ImageOps.invert(img)
     enhancer = ImageEnhance.Contrast(img)
     img = enhancer.enhance(2)
-    img.save("latest.png")  # for debugging
-    img_text = image_to_string(img,
-                               config=f'--psm 6 --oem 1 -c preserve_interword_spaces=1 -l {language_file.get("tesseractmodel")}')
-    return img_text
+    if debug_image_path:
+        img.save(debug_image_path)  # for debugging
+    return img
+
+
+def preprocess_image_png(img):
+    buffer = io.BytesIO()
+    preprocess_image(img).save(buffer, format="PNG")
+    return buffer.getvalue()
 
 
 # post process
+@tracing.traced("process_text_tess")
 async def process_text_tess(img_text, language_file):
     """
     Processes OCR text to extract and map information to database column names.
@@ -126,26 +251,27 @@ async def process_text_tess(img_text, language_file):
     :return: A tuple (processed, visited) where processed is a dict of extracted information,
              and visited tracks which fields have been processed.
     """
-    column_names = db_related.get_column_names()  # db column names
-    localized_column_names = dict()
+    if not category_related.columns:
+        # the label maps are precompiled when the bot loads its translations, tools without the bot load them here
+        category_related.load({}, list(field_registry.data_columns))
+    # maps localized column names to original column names
+    localized_column_names = category_related.localized_columns(language_file)
+    localized_labels = tuple(localized_column_names)
     processed = dict()
     visited = dict()
 
-    for column in column_names:
-        localized_column_names[''.join(language_file.get(column,
-                                                         column).split()).lower()] = column  # dicitonary that maps localized column names to original column names
-
     for line in img_text:
-        key_value = re.split(r"\s{2,}", line, maxsplit=1)
+        key_value = label_separator.split(line, maxsplit=1)
 
         # if the line correctly splits into two parts
         if len(key_value) == 2:
             key, value = key_value
-            print(f"key: {key}, value: {value}")
+            if debug_text:
+                print(f"key: {key}, value: {value}")
 
             # fuzzy match the key with localized column names
             key_no_spaces = ''.join(key.split()).lower()
-            match = find_best_match(key_no_spaces, localized_column_names.keys())
+            match = find_best_match(key_no_spaces, localized_labels)
             if match:
                 best_match, score = match
                 column_key = localized_column_names[best_match]  # get the db column name from the localized column name
@@ -153,84 +279,12 @@ async def process_text_tess(img_text, language_file):
                 if column_key in visited and visited[column_key] > score:  # go to next iteration if no better match
                     continue
 
-                if column_key in ['kingdom', 'class']:
-                    processed[column_key] = value
-                else:
-                    processed[column_key] = extract_numeric_value(column_key,value)
+                processed[column_key] = field_registry.parse_value(column_key, value)  # the column's parser
                 visited[column_key] = score
 
     return processed, visited
 
 
-# post process numeric values
-def extract_numeric_value(key, value):
-    """
-       Processes numeric attributes to extract the correct values.
-
-       :param key: The attribute
-       :param value: The unprocessed attribute value
-       :return: The processed attribute value
-       """
-    # handle the general extraction of digits and possible trailing single/double digit removal (caused by misrecognized question marks)
-    if key != 'playtime' and key != 'datecreated':
-        value = re.sub(r'\D+', ' ', value)  # replace one or more non digit chars with a single space
-        value.strip()
-        parts = value.split()
-        if len(parts) > 1 and parts[-2].isdigit() and parts[-1].isdigit() and 1 <= len(parts[-1]) <= 2:
-            # remove the last part if it's 1 or 2 digits following a single number (misrecognized question mark)
-            value = ' '.join(parts[:-1])
-        else:
-            value = value
-
-    value = ''.join(filter(str.isdigit, value))  # remove remaining non digits
-
-    if key == 'playtime':
-        try:
-            return convert_to_hours(value)
-        except ValueError:
-            return 0
-
-    if key == 'datecreated':
-        return format_date_string(value)
-
-    try:
-        return int(value)
-    except ValueError:
-        return None if value == "" else value
-
-
-def format_date_string(date_str):
-    """
-    Converts a date string from 'YYYYMMDD' format to 'YYYY-MM-DD' format.
-
-    :param date_str: A string representing a date in 'YYYYMMDD' format.
-    :return: A string representing the formatted date in 'YYYY-MM-DD' format,
-             or None if the input string is not a valid date.
-    """
-    try:
-        date_obj = datetime.strptime(date_str, '%Y%m%d')
-        formatted_date = date_obj.strftime('%Y-%m-%d')
-        return formatted_date
-    except ValueError:
-        # return the original string if it's not a valid date
-        return None
-
-
-def convert_to_hours(playtime):
-    """
-    Converts a string representing the playtime in days and hours to the playtime in hours. 
-
-    :param playtime: A string representing a time duration.
-    :return: An integer representing the total number of hours.
-    """
-    if len(playtime) <= 2:  # if the string is 2 characters or less, it's only hours
-        return int(playtime)
-    else:
-        days = int(playtime[:-2])
-        hours = int(playtime[-2:])
-        return days * 24 + hours
-
-
 def sanitize_ocr_results(ocr_results):
     """
     Sanitizes OCR results by enforcing type constraints and value ranges
@@ -280,13 +334,15 @@ def similarity_score(score, best_match, key):
     return weighted_score
 
 
+@lru_cache(maxsize=4096)
 def find_best_match(key, column_names):
     """
     Finds the best match for a given key within a list of column names using
     fuzzy matching and a custom similarity scoring function.
+    Results are cached, since the same labels are recognized on every screenshot.
 
     :param key: The key string to find a match for.
-    :param column_names: A list of column name strings to search within.
+    :param column_names: A tuple of column name strings to search within.
     :return: A tuple (best_match, highest_score) where best_match is the column
              name that best matches the key, and highest_score is the score of
              that match.
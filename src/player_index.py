@@ -0,0 +1,180 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import bisect
+from collections import Counter
+
+from fuzzywuzzy import fuzz
+
+max_choices = 25  # discord shows at most 25 autocomplete choices
+suggestion_threshold = 70  # fuzzy score needed for a "did you mean" suggestion
+rescored_candidates = 20  # candidates with the most shared trigrams that get a full fuzzy score
+
+guild_players = dict()  # guild id -> GuildPlayers
+
+
+class GuildPlayers:
+    """
+    The names of the players of one guild, with a sorted list for prefix search and a trigram index for fuzzy search.
+    Lookups are case insensitive.
+
+    Attributes:
+        names (dict): Case folded name -> name as stored in the records.
+        sorted_keys (list): The case folded names, sorted.
+        trigrams (dict): Trigram -> set of case folded names containing it.
+    """
+
+    def __init__(self):
+        self.names = dict()
+        self.sorted_keys = []
+        self.trigrams = dict()
+
+    def add(self, name):
+        key = name.casefold()
+        if key in self.names:
+            self.names[key] = name
+            return
+        self.names[key] = name
+        bisect.insort(self.sorted_keys, key)
+        for trigram in get_trigrams(key):
+            self.trigrams.setdefault(trigram, set()).add(key)
+
+    def remove(self, name):
+        key = name.casefold()
+        if self.names.get(key) != name:
+            return
+        del self.names[key]
+        del self.sorted_keys[bisect.bisect_left(self.sorted_keys, key)]
+        for trigram in get_trigrams(key):
+            keys = self.trigrams.get(trigram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.trigrams[trigram]
+
+    def with_prefix(self, prefix, limit):
+        """
+        Returns up to limit case folded names starting with prefix, in alphabetical order.
+        """
+        start = bisect.bisect_left(self.sorted_keys, prefix)
+        keys = []
+        for key in self.sorted_keys[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            keys.append(key)
+        return keys
+
+    def similar(self, query, limit):
+        """
+        Returns up to limit (score, case folded name) pairs of the names most similar to query, best first.
+        """
+        shared = Counter()
+        for trigram in get_trigrams(query):
+            shared.update(self.trigrams.get(trigram, ()))
+        candidates = [key for key, _ in shared.most_common(rescored_candidates)]
+        scored = sorted(((fuzz.ratio(query, key), key) for key in candidates), key=lambda match: (-match[0], match[1]))
+        return scored[:limit]
+
+
+def get_trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+async def load(conn):
+    """
+    Loads the names of all players that have records into memory.
+
+    :param conn: The stat database connection.
+    """
+    guild_players.clear()
+    async with conn.execute("SELECT guildid, playername FROM latest_playerstats") as cur:
+        for guild_id, playername in await cur.fetchall():
+            if playername:
+                guild_players.setdefault(guild_id, GuildPlayers()).add(playername)
+
+
+async def load_guild(conn, guild_id):
+    """
+    Reloads the player names of one guild, e.g. after an import.
+
+    :param conn: The stat database connection.
+    :param guild_id: The guild ID.
+    """
+    players = GuildPlayers()
+    async with conn.execute("SELECT playername FROM latest_playerstats WHERE guildid = ?", (guild_id,)) as cur:
+        for playername, in await cur.fetchall():
+            if playername:
+                players.add(playername)
+    guild_players[guild_id] = players
+
+
+async def player_changed(conn, guild_id, playername):
+    """
+    Adds or removes a player after a write, depending on whether the player still has records.
+
+    :param conn: The stat database connection.
+    :param guild_id: The guild ID of the player.
+    :param playername: The name of the player.
+    """
+    if not playername:
+        return
+    async with conn.execute("SELECT 1 FROM latest_playerstats WHERE guildid = ? AND playername = ?",
+                            (guild_id, playername)) as cur:
+        exists = await cur.fetchone() is not None
+    if exists:
+        guild_players.setdefault(guild_id, GuildPlayers()).add(playername)
+    elif guild_id in guild_players:
+        guild_players[guild_id].remove(playername)
+
+
+def complete(guild_id, query, limit=max_choices):
+    """
+    Returns player names for autocompletion: names starting with the query first, then the most similar names.
+
+    :param guild_id: The guild ID.
+    :param query: What the user typed so far.
+    :param limit: The maximum number of names.
+    :return: A list of player names.
+    """
+    players = guild_players.get(guild_id)
+    if players is None:
+        return []
+    query = (query or "").strip().casefold()
+    keys = players.with_prefix(query, limit)
+    if len(keys) < limit and query:
+        keys += [key for _, key in players.similar(query, limit) if key not in keys][:limit - len(keys)]
+    return [players.names[key] for key in keys]
+
+
+def is_known(guild_id, playername):
+    """
+    Returns whether a player with exactly this name has records in the guild.
+    """
+    players = guild_players.get(guild_id)
+    return players is not None and players.names.get(playername.casefold()) == playername
+
+
+def suggest(guild_id, playername):
+    """
+    Returns the name of the player most similar to a name that was not found, for a "did you mean" hint.
+
+    :param guild_id: The guild ID.
+    :param playername: The name that was not found.
+    :return: A player name or None.
+    """
+    players = guild_players.get(guild_id)
+    if players is None:
+        return None
+    key = playername.strip().casefold()
+    if key in players.names and players.names[key] != playername:
+        return players.names[key]  # only the case differs
+    for score, match in players.similar(key, 1):
+        if score >= suggestion_threshold and players.names[match] != playername:
+            return players.names[match]
+    return None
@@ -0,0 +1,192 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import metrics
+
+slow_query_seconds = float(os.getenv('SLOW_QUERY_SECONDS', '0.1'))
+slow_query_file = os.getenv('SLOW_QUERY_FILE', '../slow_queries.jsonl')
+slow_query_file_max_bytes = int(os.getenv('SLOW_QUERY_FILE_MAX_BYTES', str(10 * 1024 * 1024)))
+slow_query_file_backups = 5
+max_parameters_length = 500  # parameters are shortened in the log, a record insert binds every column
+max_cached_plans = 256
+watched_table = "playerstats"
+sql_keywords = {"WHERE", "JOIN", "LEFT", "INNER", "CROSS", "ON", "USING", "GROUP", "ORDER", "LIMIT", "SET", "VALUES",
+                "UNION", "EXCEPT", "INTERSECT", "WINDOW", "HAVING", "INDEXED", "NOT", "DEFAULT", "SELECT", "AS"}
+
+explainable = re.compile(r"^\s*(SELECT|WITH|INSERT|REPLACE|UPDATE|DELETE)\b", re.IGNORECASE)
+string_literal = re.compile(r"'(?:[^']|'')*'")
+number_literal = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+placeholder_list = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+plans = OrderedDict()  # normalized SQL -> (plan lines, flags), the plan of each query shape is only asked once
+slow_logger = None
+
+statement_seconds = metrics.Histogram("karibot_sql_statement_duration_seconds",
+                                      "Time SQLite spent executing a statement of the stats database", ("statement",))
+slow_statements = metrics.Counter("karibot_sql_slow_statements_total",
+                                  f"Statements slower than SLOW_QUERY_SECONDS ({slow_query_seconds}s) by plan problem",
+                                  ("flag",))
+
+
+def normalize_sql(sql):
+    """
+    Reduces a statement to its shape: literals become ?, lists of placeholders one (?, ...) and whitespace single
+    spaces. The columns and filters the f-strings of db_related put in stay, they are what tells the shapes apart.
+    """
+    sql = string_literal.sub("?", sql)
+    sql = number_literal.sub("?", sql)
+    sql = placeholder_list.sub("(?, ...)", sql)
+    return " ".join(sql.split())
+
+
+def statement_kind(sql):
+    words = sql.split(None, 1)
+    kind = words[0].upper() if words else ""
+    return kind.lower() if kind in ("SELECT", "WITH", "INSERT", "REPLACE", "UPDATE", "DELETE") else "other"
+
+
+def table_names(sql):
+    """
+    Returns the names the watched table goes by in a statement, itself and its aliases, which the plan uses.
+    """
+    names = set()
+    for match in re.finditer(rf"\b{watched_table}\b(?:\s+AS)?(?:\s+(\w+))?", sql, re.IGNORECASE):
+        names.add(watched_table)
+        alias = match.group(1)
+        if alias and alias.upper() not in sql_keywords:
+            names.add(alias)
+    return names
+
+
+def plan_flags(plan_lines, sql):
+    """
+    Returns the problems of a query plan: full scans of the watched table and temporary B-trees of queries on it.
+    """
+    names = table_names(sql)
+    if not names:
+        return []
+    flags = set()
+    for detail in plan_lines:
+        scan = re.match(r"SCAN (?:TABLE )?(\w+)(.*)", detail)
+        if scan and scan.group(1) in names and "USING" not in scan.group(2):
+            flags.add("full_scan")
+        elif detail.startswith("USE TEMP B-TREE"):
+            flags.add("temp_btree")
+    return sorted(flags)
+
+
+def explain(connection, sql, parameters):
+    """
+    Returns the EXPLAIN QUERY PLAN lines of a statement as an indented tree, and its flags.
+    """
+    normalized = normalize_sql(sql)
+    cached = plans.get(normalized)
+    if cached is not None:
+        plans.move_to_end(normalized)
+        return cached
+    plan_lines = []
+    if explainable.match(sql):
+        try:
+            rows = sqlite3.Cursor(connection).execute("EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+            depths = {0: -1}
+            for node_id, parent_id, _, detail in rows:
+                depths[node_id] = depths.get(parent_id, -1) + 1
+                plan_lines.append("  " * depths[node_id] + detail)
+        except sqlite3.Error as e:
+            plan_lines = [f"EXPLAIN failed: {e}"]
+    result = (plan_lines, plan_flags([line.strip() for line in plan_lines], sql))
+    plans[normalized] = result
+    if len(plans) > max_cached_plans:
+        plans.popitem(last=False)
+    return result
+
+
+def short_parameters(parameters):
+    text = repr(parameters)
+    return text if len(text) <= max_parameters_length else text[:max_parameters_length] + "..."
+
+
+def statement_slow(connection, sql, parameters, seconds, many=False):
+    # runs on the database thread, the connection is free for the EXPLAIN
+    normalized = normalize_sql(sql)
+    plan_lines, flags = ([], []) if many else explain(connection, sql, parameters)
+    for flag in flags or ["none"]:
+        slow_statements.inc(flag)
+    flag_text = f" [{', '.join(flags)}]" if flags else ""
+    print(f"Slow query ({seconds * 1000:.0f} ms){flag_text}: {normalized[:200]}")
+    write_slow_query({'time': datetime.now(timezone.utc).isoformat(), 'duration_ms': round(seconds * 1000, 3),
+                      'sql': normalized, 'parameters': "executemany" if many else short_parameters(parameters),
+                      'plan': plan_lines, 'flags': flags})
+
+
+def write_slow_query(record):
+    global slow_logger
+    try:
+        if slow_logger is None:
+            handler = logging.handlers.RotatingFileHandler(slow_query_file, maxBytes=slow_query_file_max_bytes,
+                                                           backupCount=slow_query_file_backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            slow_logger = logging.getLogger("karibot.slow_queries")
+            slow_logger.propagate = False
+            slow_logger.setLevel(logging.INFO)
+            slow_logger.addHandler(handler)
+        slow_logger.info(json.dumps(record, separators=(',', ':'), default=str))
+    except OSError as e:
+        print(f"Writing the slow query log failed: {e}")
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    A sqlite3 cursor timing every statement it executes. aiosqlite wraps it like a plain cursor and calls it on
+    its database thread. The time is that of executing the statement, which includes sorting and aggregating,
+    fetching the rows afterwards is not counted.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        result = super().execute(sql, parameters)
+        seconds = time.perf_counter() - start
+        statement_seconds.observe(seconds, statement_kind(sql))
+        if seconds >= slow_query_seconds:
+            statement_slow(self.connection, sql, parameters, seconds)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        result = super().executemany(sql, seq_of_parameters)
+        seconds = time.perf_counter() - start
+        statement_seconds.observe(seconds, statement_kind(sql))
+        if seconds >= slow_query_seconds:
+            statement_slow(self.connection, sql, None, seconds, many=True)
+        return result
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    A sqlite3 connection whose cursors are TimedCursors. Pass it as the factory to aiosqlite.connect.
+    sqlite3's own Connection.execute does not go through the cursor's methods, so the shortcuts are redirected.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,67 @@
+from discord import ui, ButtonStyle
+import discord
+
+class ScoreboardView(ui.View):
+    def __init__(self, fetch_page, make_embed, previous_label, next_label, not_allowed_msg, initiator_id, *,
+                 timeout=300):
+        super().__init__(timeout=timeout)
+        self.fetch_page = fetch_page  # async function: cursor -> (entries, next cursor or None)
+        self.make_embed = make_embed  # function: (entries, page index) -> embed
+        self.not_allowed_msg = not_allowed_msg
+        self.initiator_id = initiator_id  # discord id of the user who initiated the command
+        self.pages = []  # page cache of this interaction, going back never queries again
+        self.next_cursors = []  # cursor of the page following each cached page
+        self.page_index = 0
+
+        # Create previous button
+        self.previous_button = ui.Button(label=previous_label, style=ButtonStyle.grey, custom_id='previous_page')
+        self.previous_button.callback = self.previous
+        self.add_item(self.previous_button)
+
+        # Create next button
+        self.next_button = ui.Button(label=next_label, style=ButtonStyle.blurple, custom_id='next_page')
+        self.next_button.callback = self.next
+        self.add_item(self.next_button)
+
+    async def load_first_page(self):
+        # fetch the first page, returns its embed or None if the scoreboard is empty
+        entries, next_cursor = await self.fetch_page(None)
+        if not entries:
+            return None
+        self.pages.append(entries)
+        self.next_cursors.append(next_cursor)
+        self.update_buttons()
+        return self.make_embed(entries, 0)
+
+    def update_buttons(self):
+        self.previous_button.disabled = self.page_index == 0
+        self.next_button.disabled = self.page_index == len(self.pages) - 1 and self.next_cursors[-1] is None
+
+    async def previous(self, interaction: discord.Interaction):
+        if interaction.user.id != self.initiator_id:
+            await interaction.response.send_message(self.not_allowed_msg, ephemeral=True)
+            return
+        self.page_index = max(self.page_index - 1, 0)
+        await self.show_page(interaction)
+
+    async def next(self, interaction: discord.Interaction):
+        if interaction.user.id != self.initiator_id:
+            await interaction.response.send_message(self.not_allowed_msg, ephemeral=True)
+            return
+        if self.page_index == len(self.pages) - 1:
+            # only pages that were never shown are fetched
+            entries, next_cursor = await self.fetch_page(self.next_cursors[-1])
+            if not entries:
+                self.next_cursors[-1] = None
+                self.update_buttons()
+                await interaction.response.edit_message(view=self)
+                return
+            self.pages.append(entries)
+            self.next_cursors.append(next_cursor)
+        self.page_index += 1
+        await self.show_page(interaction)
+
+    async def show_page(self, interaction):
+        self.update_buttons()
+        embed = self.make_embed(self.pages[self.page_index], self.page_index)
+        await interaction.response.edit_message(embed=embed, view=self)
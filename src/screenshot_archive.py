@@ -0,0 +1,206 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import asyncio
+import hashlib
+import importlib
+import io
+import json
+import os
+from collections import Counter
+from datetime import datetime, timezone
+
+import db_related
+import upload_scheduler
+
+# the uploaded screenshots are kept so they can be read again when the OCR pipeline improves, off when empty
+archive_folder = os.getenv('SCREENSHOT_ARCHIVE_DIR', '')
+enabled = bool(archive_folder)
+reocr_report_file = os.getenv('REOCR_REPORT_FILE', '../reocr_report.jsonl')
+reocr_delay_seconds = float(os.getenv('REOCR_DELAY', '300'))  # lets the bot connect before the archive is read
+reocr_batch_size = 50
+lossless_formats = ("PNG", "BMP", "TIFF")  # stored as lossless WebP, the pixels the OCR reads stay the same
+
+reocr_task = None
+
+
+def image_path(filename):
+    return os.path.join(archive_folder, filename)
+
+
+def store_image(image_data):
+    """
+    Writes an image file to the archive under the SHA-256 of its bytes, unless the same file is stored already.
+    Lossless images are stored as lossless WebP, JPEGs and other lossy formats as they are.
+
+    :param image_data: The bytes of the uploaded image file.
+    :return: A (hash, filename, size, stored size) tuple.
+    """
+    from PIL import Image
+
+    image_hash = hashlib.sha256(image_data).hexdigest()
+    filename = f"{image_hash[:2]}/{image_hash}"  # the format is read from the file, not its name
+    path = image_path(filename)
+    if os.path.exists(path):
+        return image_hash, filename, len(image_data), os.path.getsize(path)
+
+    stored = image_data
+    with Image.open(io.BytesIO(image_data)) as img:
+        if img.format in lossless_formats:
+            buffer = io.BytesIO()
+            img.save(buffer, "WEBP", lossless=True, quality=100, method=4)
+            if buffer.tell() < len(image_data):
+                stored = buffer.getvalue()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(stored)
+    os.replace(temporary_path, path)  # readers never see a partly written file
+    return image_hash, filename, len(image_data), len(stored)
+
+
+def read_image(filename):
+    with open(image_path(filename), "rb") as file:
+        return file.read()
+
+
+def delete_images(filenames):
+    for filename in filenames:
+        try:
+            os.remove(image_path(filename))
+        except FileNotFoundError:
+            pass
+
+
+async def archive_upload(guild_id, record_id, images, language, playerstats, ocr_version):
+    """
+    Stores the screenshots of an upload and links them to the record the upload created or updated.
+
+    :param record_id: The ID of the record check_and_update_record returned for the upload.
+    :param images: The bytes of the uploaded image files.
+    :param language: The language the screenshots were read in.
+    :param playerstats: The stats read from the screenshots.
+    :param ocr_version: The version of the OCR pipeline that read them.
+    """
+    loop = asyncio.get_running_loop()
+    screenshots = [await loop.run_in_executor(None, store_image, image_data) for image_data in images]
+    stats = {column: playerstats[column] for column in db_related.get_column_names()
+             if column in playerstats and column not in ("playername", "guildid", "discordid")}
+    await db_related.add_screenshot_upload(guild_id, record_id, screenshots, language, stats, ocr_version)
+
+
+def stored_value_changes(upload, reread):
+    """
+    Compares the stats read again from an upload's screenshots to those read back then. A difference only counts
+    if the record still holds the old value, otherwise it was corrected or overwritten since.
+
+    :return: A list of dictionaries with the column, the stored value and the value read now.
+    """
+    changes = []
+    for column, value in reread.items():
+        if column not in upload['record'] or column in ("playername", "guildid", "discordid"):
+            continue
+        old_value = upload['stats'].get(column)
+        if value != old_value and upload['record'][column] == old_value:
+            changes.append({'column': column, 'stored': old_value, 'reocr': value})
+    return changes
+
+
+def write_report(records):
+    try:
+        with open(reocr_report_file, "a", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record, separators=(',', ':'), default=str) + "\n")
+    except OSError as e:
+        print(f"Writing the re-OCR report failed: {e}")
+
+
+async def reocr_pass(is_owner, translations):
+    """
+    Reads the archived screenshots again that an older version of the OCR pipeline read, at backfill priority so
+    uploads go first. The stored records are not changed, the values that would change are written to the report.
+
+    :param is_owner: A function returning whether this process reads the uploads of a guild.
+    :param translations: The translation cache, the language files of the uploads.
+    """
+    loop = asyncio.get_running_loop()
+    ocr_related = await loop.run_in_executor(None, importlib.import_module, "ocr_related")
+    version = ocr_related.pipeline_version
+    after_id = 0
+    read = changed_uploads = 0
+    columns = Counter()
+    while True:
+        uploads = await db_related.get_reocr_batch(version, after_id, reocr_batch_size)
+        if not uploads:
+            break
+        after_id = uploads[-1]['id']
+        checked = []
+        report = []
+        for upload in uploads:
+            if not is_owner(upload['guildid']):
+                continue
+            language_file = translations.get(upload['language'], translations['en'])
+            try:
+                images = [await loop.run_in_executor(None, read_image, filename) for filename in upload['filenames']]
+                reread = await upload_scheduler.run_ocr_job(
+                    upload['guildid'], lambda: ocr_related.process_stored_images(images, language_file),
+                    upload_scheduler.PRIORITY_BACKFILL)
+            except FileNotFoundError as e:
+                print(f"Archived screenshot of upload {upload['id']} is missing: {e}")
+                checked.append(upload['id'])
+                continue
+            except Exception as e:
+                print(f"Reading upload {upload['id']} again failed: {e}")  # tried again on the next pass
+                continue
+            checked.append(upload['id'])
+            read += 1
+            changes = stored_value_changes(upload, reread)
+            if changes:
+                changed_uploads += 1
+                columns.update(change['column'] for change in changes)
+                report.append({'time': datetime.now(timezone.utc).isoformat(), 'upload': upload['id'],
+                               'record': upload['recordid'], 'guildid': upload['guildid'],
+                               'playername': upload['playername'], 'from_version': upload['ocrversion'],
+                               'to_version': version, 'changes': changes})
+        write_report(report)
+        await db_related.mark_screenshot_uploads_checked(checked, version)
+    if read:
+        summary = ", ".join(f"{column} {count}" for column, count in columns.most_common())
+        print(f"Re-OCR with pipeline version {version}: {changed_uploads} of {read} archived uploads would change"
+              + (f" ({summary})" if summary else ""))
+
+
+async def prune():
+    """
+    Deletes the archived screenshots of records that no longer exist.
+    """
+    filenames = await db_related.prune_screenshots()
+    await asyncio.get_running_loop().run_in_executor(None, delete_images, filenames)
+    if filenames:
+        print(f"Deleted {len(filenames)} archived screenshots no record links to anymore")
+
+
+async def reocr_after_delay(is_owner, translations):
+    await asyncio.sleep(reocr_delay_seconds)
+    try:
+        await prune()
+        await reocr_pass(is_owner, translations)
+    except Exception as e:
+        print(f"Re-reading the screenshot archive failed: {e}")
+
+
+def start(is_owner, translations):
+    """
+    Starts reading the archived screenshots again in the background, once the bot had time to connect.
+
+    :param is_owner: A function returning whether this process reads the uploads of a guild.
+    :param translations: The translation cache.
+    """
+    global reocr_task
+    if enabled and reocr_task is None:
+        reocr_task = asyncio.create_task(reocr_after_delay(is_owner, translations))
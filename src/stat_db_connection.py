@@ -6,9 +6,18 @@ Permission is hereby granted, free of charge, to any person obtaining a copy of
 The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
 """
 
+import contextlib
+import os
+
 import aiosqlite
 from asyncio import Lock
 
+import query_log
+
+# the stats connection is shared by every task of the process, so its writes take turns: one explicit transaction
+# at a time, and no write commits while another one is open
+transaction_lock = Lock()
+
 
 class StatDBConnection:
     """
@@ -20,6 +29,7 @@ class StatDBConnection:
         _instance (StatDBConnection): The singleton instance of the StatDBConnection class.
         _lock (Lock): An asyncio Lock object to ensure thread-safe initialization of the singleton instance.
         _connection (aiosqlite.Connection): The SQLite database connection.
+        path (str): The path of the SQLite database file.
 
     Methods:
         get_instance: Returns the singleton instance of the StatDBConnection class, creating it if it does not exist.
@@ -28,6 +38,7 @@ class StatDBConnection:
 
     _instance = None
     _lock = Lock()
+    path = os.getenv('STAT_DB_PATH', '../playerstats.db')
 
     def __init__(self):
         if StatDBConnection._instance is not None:
@@ -45,7 +56,27 @@ class StatDBConnection:
 
     async def _initialize(self):
         if self._connection is None:
-            self._connection = await aiosqlite.connect('../playerstats.db')
+            # statements are timed and slow ones logged with their query plan, see query_log
+            self._connection = await aiosqlite.connect(StatDBConnection.path, factory=query_log.TimedConnection)
 
     async def get_connection(self):
         return self._connection
+
+
+@contextlib.asynccontextmanager
+async def write_transaction(conn):
+    """
+    Runs the statements of the block in an immediate transaction, which takes the database's write lock before the
+    first read, and commits it. Rolls back if the block raises. Every write to the stats database goes through
+    here; a transaction left open by a write outside of it is an error, it is not joined.
+
+    :param conn: The stat database connection.
+    """
+    async with transaction_lock:
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
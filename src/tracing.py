@@ -0,0 +1,212 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import random
+import secrets
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+trace_file = os.getenv('TRACE_FILE', '../traces.jsonl')
+sample_rate = float(os.getenv('TRACE_SAMPLE_RATE', '0.1'))  # share of the traces written to the file
+slow_trace_seconds = float(os.getenv('TRACE_SLOW_SECONDS', '30'))  # slower traces are always written
+trace_file_max_bytes = int(os.getenv('TRACE_FILE_MAX_BYTES', str(10 * 1024 * 1024)))
+trace_file_backups = 5
+recent_trace_count = 500  # finished traces kept in memory for /slowest_uploads, sampled or not
+
+# the span the running code belongs to; asyncio tasks inherit it, executor threads do not
+current_span = contextvars.ContextVar('current_span', default=None)
+recent_traces = deque(maxlen=recent_trace_count)
+trace_logger = None
+
+
+class Span:
+    """
+    A timed section of a trace. Times are time.perf_counter() values.
+    """
+    __slots__ = ('trace', 'id', 'parent_id', 'name', 'start', 'end', 'attributes')
+
+    def __init__(self, trace, name, parent_id, start=None, attributes=None):
+        self.trace = trace
+        self.id = len(trace.spans)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter() if start is None else start
+        self.end = None
+        self.attributes = attributes or dict()
+        trace.spans.append(self)
+
+    def to_dict(self, trace_start):
+        return {'id': self.id, 'parent': self.parent_id, 'name': self.name,
+                'start_ms': round((self.start - trace_start) * 1000, 3),
+                'duration_ms': round(((self.end or self.start) - self.start) * 1000, 3),
+                **({'attributes': self.attributes} if self.attributes else {})}
+
+
+class Trace:
+    """
+    The spans of one command invocation.
+    """
+
+    def __init__(self, name):
+        self.id = secrets.token_hex(8)
+        self.name = name
+        self.started_at = datetime.now(timezone.utc)
+        self.spans = []
+
+
+def start_trace(name, **attributes):
+    """
+    Starts a trace in the current context, e.g. from a before_invoke hook. Spans opened by the code that runs
+    afterwards in the same task, and in tasks it creates, belong to it.
+
+    :param name: The name of the root span, usually the command.
+    :param attributes: Attributes of the trace, e.g. the guild id.
+    :return: The trace.
+    """
+    trace = Trace(name)
+    current_span.set(Span(trace, name, None, attributes=attributes))
+    return trace
+
+
+def annotate(**attributes):
+    """
+    Adds attributes to the current span.
+    """
+    span_in_progress = current_span.get()
+    if span_in_progress is not None:
+        span_in_progress.attributes.update(attributes)
+
+
+def finish_trace():
+    """
+    Ends the trace of the current context, keeps it in memory and writes it to the trace file if it was sampled
+    or slow.
+    """
+    root = current_span.get()
+    if root is None:
+        return
+    while root.parent_id is not None:
+        root = root.trace.spans[root.parent_id]
+    current_span.set(None)
+    root.end = time.perf_counter()
+    trace = root.trace
+    duration = root.end - root.start
+    record = {'trace_id': trace.id, 'name': trace.name, 'started_at': trace.started_at.isoformat(),
+              'duration_ms': round(duration * 1000, 3), 'attributes': root.attributes,
+              'spans': [span.to_dict(root.start) for span in trace.spans[1:]]}
+    recent_traces.append(record)
+    if duration >= slow_trace_seconds or random.random() < sample_rate:
+        write_trace(record)
+
+
+def write_trace(record):
+    global trace_logger
+    try:
+        if trace_logger is None:
+            handler = logging.handlers.RotatingFileHandler(trace_file, maxBytes=trace_file_max_bytes,
+                                                           backupCount=trace_file_backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            trace_logger = logging.getLogger("karibot.traces")
+            trace_logger.propagate = False
+            trace_logger.setLevel(logging.INFO)
+            trace_logger.addHandler(handler)
+        trace_logger.info(json.dumps(record, separators=(',', ':'), default=str))
+    except OSError as e:
+        print(f"Writing trace {record['trace_id']} failed: {e}")
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the with block as a child of the current span. Does nothing outside a trace.
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.id, attributes=attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attributes['error'] = type(e).__name__
+        raise
+    finally:
+        child.end = time.perf_counter()
+        current_span.reset(token)
+
+
+def record_span(name, start, end, **attributes):
+    """
+    Adds an already finished section, e.g. a wait measured elsewhere, as a child of the current span.
+
+    :param start: The time.perf_counter() the section started.
+    :param end: The time.perf_counter() the section ended.
+    """
+    parent = current_span.get()
+    if parent is not None:
+        Span(parent.trace, name, parent.id, start, attributes).end = end
+
+
+def traced(name):
+    """
+    Decorator running every call of an async function in a span with the given name.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def run_in_executor(executor, name, function, *args):
+    """
+    Runs a function in an executor inside a span, with a child span for the time the job waited for a thread.
+
+    :param executor: The executor.
+    :param name: The name of the span.
+    :param function: The function to run.
+    :return: The result of the function.
+    """
+    with span(name):
+        submitted = time.perf_counter()
+        started = []
+
+        def run():
+            started.append(time.perf_counter())
+            return function(*args)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, run)
+        finally:
+            record_span("executor_queue", submitted, started[0] if started else time.perf_counter())
+
+
+def slowest_traces(guild_id, n):
+    """
+    Returns the slowest of the recent traces of a guild.
+
+    :param guild_id: The guild ID.
+    :param n: The maximum number of traces.
+    :return: A list of trace records, the slowest first.
+    """
+    traces = [record for record in list(recent_traces) if record['attributes'].get('guild_id') == guild_id]
+    return sorted(traces, key=lambda record: record['duration_ms'], reverse=True)[:n]
@@ -0,0 +1,278 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import metrics
+import tracing
+
+upload_burst = int(os.getenv('UPLOAD_BURST', '3'))  # uploads a user can make back to back
+upload_rate_per_minute = float(os.getenv('UPLOAD_RATE_PER_MINUTE', '2'))  # sustained uploads per user
+ocr_slots = int(os.getenv('OCR_SLOTS', str(os.cpu_count() or 2)))  # uploads processed at the same time
+guild_max_concurrent = int(os.getenv('GUILD_MAX_CONCURRENT', '2'))  # slots a single guild may hold
+wait_history_size = 200  # recent waits kept per guild for the statistics
+# uploads have to be answered while the interaction token is valid (15 minutes), most users give up much sooner
+upload_deadline_seconds = min(int(os.getenv('UPLOAD_DEADLINE_SECONDS', '300')), 14 * 60)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKFILL = 1
+
+
+def parse_guild_weights(value):
+    """
+    Parses GUILD_WEIGHTS, e.g. "123:3,456:2". Guilds that are not listed have weight 1.
+
+    :param value: The setting.
+    :return: A dictionary mapping guild ids to weights.
+    """
+    weights = dict()
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        guild_id, weight = item.split(':')
+        weights[int(guild_id)] = max(1, int(weight))
+    return weights
+
+
+guild_weights = parse_guild_weights(os.getenv('GUILD_WEIGHTS', ''))
+
+
+class TokenBucket:
+    """
+    Allows bursts of up to `capacity` uploads, refilled at `rate` tokens per second.
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Takes a token if there is one. Returns 0 on success, otherwise the seconds until the next token.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self):
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when an OCR job could not finish before its deadline. Jobs that expire while queued never start.
+    """
+
+
+class UploadScheduler:
+    """
+    Hands out OCR slots by priority and fairly between guilds. Interactive uploads are always served before
+    backfill jobs. Within a priority every guild has its own queue, guilds with waiting jobs take turns in a ring
+    and may take `weight` slots per turn, and no guild may hold more than `guild_limit` slots.
+    A busy guild therefore only delays its own uploads.
+    """
+
+    def __init__(self, slots, guild_limit, weights=None):
+        self.slots = slots
+        self.guild_limit = guild_limit
+        self.weights = weights or dict()
+        self.running = 0
+        self.queues = dict()  # (priority, guild id) -> deque of (future, time queued)
+        self.active = dict()  # guild id -> slots held
+        self.rings = dict()  # priority -> guilds with waiting jobs, in turn order
+        self.credits = dict()  # (priority, guild id) -> slots left in the guild's current turn
+        self.waits = dict()  # guild id -> recent queue wait times in seconds
+        self.wait_totals = dict()  # guild id -> [number of jobs, summed wait]
+        self.dropped = dict()  # guild id -> jobs that expired before they started
+        self.wasted = dict()  # guild id -> [jobs cancelled while running, seconds they had run]
+
+    @asynccontextmanager
+    async def slot(self, guild_id, priority=PRIORITY_INTERACTIVE, deadline=None):
+        """
+        Waits for an OCR slot for a job of the guild and holds it for the duration of the context.
+
+        :param guild_id: The guild the job belongs to.
+        :param priority: PRIORITY_INTERACTIVE or PRIORITY_BACKFILL.
+        :param deadline: Optional; the time.monotonic() by which the job has to be done.
+        :raises DeadlineExceeded: If the deadline passes while the job is still queued.
+        """
+        key = (priority, guild_id)
+        queued = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        if key not in self.credits:
+            # guilds join the end of the ring, so a busy guild cannot push in front of the others
+            self.rings.setdefault(priority, deque()).append(guild_id)
+            self.credits[key] = self.weights.get(guild_id, 1)
+        self.queues.setdefault(key, deque()).append((waiter, time.monotonic()))
+        self.dispatch()
+        try:
+            # on timeout the waiter is cancelled, dispatch skips cancelled waiters
+            await asyncio.wait_for(waiter, None if deadline is None else deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            self.dropped[guild_id] = self.dropped.get(guild_id, 0) + 1
+            raise DeadlineExceeded() from None
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(guild_id)  # the slot was granted just before the cancellation
+            raise
+        tracing.record_span("ocr_slot_wait", queued, time.perf_counter())
+        started = time.monotonic()
+        try:
+            yield
+        except (asyncio.CancelledError, asyncio.TimeoutError, DeadlineExceeded):
+            wasted = self.wasted.setdefault(guild_id, [0, 0.0])
+            wasted[0] += 1
+            wasted[1] += time.monotonic() - started
+            print(f"OCR job of guild {guild_id} cancelled after {time.monotonic() - started:.1f} seconds")
+            raise
+        finally:
+            self.release(guild_id)
+
+    async def run(self, guild_id, job, priority=PRIORITY_INTERACTIVE, deadline=None):
+        """
+        Runs a job in an OCR slot. A job still running at its deadline is cancelled.
+
+        :param guild_id: The guild the job belongs to.
+        :param job: A function returning the coroutine to run once a slot is free.
+        :param priority: PRIORITY_INTERACTIVE or PRIORITY_BACKFILL.
+        :param deadline: Optional; the time.monotonic() by which the job has to be done.
+        :return: The result of the job.
+        :raises DeadlineExceeded: If the job expired while queued or was cancelled at its deadline.
+        """
+        async with self.slot(guild_id, priority, deadline):
+            if deadline is None:
+                return await job()
+            try:
+                return await asyncio.wait_for(job(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded() from None
+
+    def release(self, guild_id):
+        self.running -= 1
+        self.active[guild_id] -= 1
+        if not self.active[guild_id]:
+            del self.active[guild_id]
+        self.dispatch()
+
+    def dispatch(self):
+        # grant free slots to the waiting jobs, highest priority first, guild by guild
+        while self.running < self.slots:
+            key = self.next_job()
+            if key is None:
+                return
+            waiter, queued_at = self.queues[key].popleft()
+            if waiter.done():
+                continue  # cancelled or expired while waiting
+            guild_id = key[1]
+            self.record_wait(guild_id, time.monotonic() - queued_at)
+            self.running += 1
+            self.active[guild_id] = self.active.get(guild_id, 0) + 1
+            waiter.set_result(None)
+
+    def next_job(self):
+        # the queue of the first guild in the ring of the highest priority that has a job waiting and is below its cap
+        for priority in sorted(self.rings):
+            ring = self.rings[priority]
+            checked = 0
+            while ring and checked < len(ring):
+                guild_id = ring[0]
+                key = (priority, guild_id)
+                if not self.queues.get(key):
+                    ring.popleft()
+                    self.queues.pop(key, None)
+                    self.credits.pop(key, None)
+                    continue
+                if self.active.get(guild_id, 0) < self.guild_limit:
+                    self.credits[key] -= 1
+                    if self.credits[key] <= 0:
+                        self.end_turn(ring, key)
+                    return key
+                self.end_turn(ring, key)
+                checked += 1
+        return None
+
+    def end_turn(self, ring, key):
+        ring.rotate(-1)
+        self.credits[key] = self.weights.get(key[1], 1)
+
+    def record_wait(self, guild_id, seconds):
+        self.waits.setdefault(guild_id, deque(maxlen=wait_history_size)).append(seconds)
+        totals = self.wait_totals.setdefault(guild_id, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+    def wait_stats(self, guild_id):
+        """
+        Returns the queue statistics of a guild: the jobs so far with their average wait, the 95th percentile
+        and maximum of the recent waits in seconds, the jobs currently queued and running, the jobs that expired
+        in the queue, and the jobs cancelled while running with the OCR seconds they wasted.
+        """
+        recent = sorted(self.waits.get(guild_id, ()))
+        uploads, total_wait = self.wait_totals.get(guild_id, (0, 0.0))
+        cancelled, wasted_seconds = self.wasted.get(guild_id, (0, 0.0))
+        return {
+            'uploads': uploads,
+            'average_wait': total_wait / uploads if uploads else 0.0,
+            'p95_wait': recent[min(len(recent) - 1, math.ceil(0.95 * len(recent)) - 1)] if recent else 0.0,
+            'max_wait': recent[-1] if recent else 0.0,
+            'queued': sum(len(queue) for (_, queued_guild), queue in self.queues.items() if queued_guild == guild_id),
+            'running': self.active.get(guild_id, 0),
+            'dropped': self.dropped.get(guild_id, 0),
+            'cancelled': cancelled,
+            'wasted_seconds': wasted_seconds,
+        }
+
+
+scheduler = UploadScheduler(ocr_slots, guild_max_concurrent, guild_weights)
+buckets = dict()  # discord id -> TokenBucket
+metrics.register_callback("karibot_upload_jobs", "OCR jobs waiting for a slot or holding one",
+                          lambda: {("queued",): sum(len(queue) for queue in scheduler.queues.values()),
+                                   ("running",): scheduler.running}, ("state",))
+
+
+def take_upload_token(discord_id):
+    """
+    Charges an upload to the rate limit of a user.
+
+    :param discord_id: The Discord ID of the uploading user.
+    :return: 0 if the upload may proceed, otherwise the number of seconds the user has to wait.
+    """
+    bucket = buckets.get(discord_id)
+    if bucket is None:
+        if len(buckets) > 10000:
+            # forget users whose buckets refilled completely, they behave like new users
+            for key in [key for key, value in buckets.items() if value.is_full()]:
+                del buckets[key]
+        bucket = buckets[discord_id] = TokenBucket(upload_burst, upload_rate_per_minute / 60)
+    return bucket.take()
+
+
+def interaction_deadline(created_at):
+    """
+    Returns the time.monotonic() deadline of an upload made through an interaction.
+
+    :param created_at: The aware datetime the interaction was created at.
+    """
+    age = time.time() - created_at.timestamp()
+    return time.monotonic() - age + upload_deadline_seconds
+
+
+async def run_ocr_job(guild_id, job, priority=PRIORITY_INTERACTIVE, deadline=None):
+    """
+    Runs an OCR job of a guild in a fair share slot. See UploadScheduler.run.
+    """
+    return await scheduler.run(guild_id, job, priority, deadline)
@@ -0,0 +1,242 @@
+"""
+Copyright © 2024, ClosetPie107 <closetpie107@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+"""
+
+import asyncio
+import functools
+import json
+import time
+
+import metrics
+
+message_limit = 256 * 1024 * 1024  # an import is sent as a single message
+reconnect_attempts = 30
+reconnect_delay_seconds = 1
+
+# In cluster mode one writer process owns every database write. The bot processes keep their own read connections
+# and forward the functions marked with @writer_call over a local socket, one JSON message per line. After a write
+# the writer publishes events, e.g. which player changed, so every process can bring its in-memory caches up to date.
+writer_functions = dict()  # module.name -> write function, run by the writer
+event_handlers = dict()  # event name -> async function, run by the bot processes
+subscribers = set()  # stream writers of the connected bot processes, in the writer
+client = None  # the WriterClient of a bot process, None when this process writes itself
+
+
+class WriterError(RuntimeError):
+    """
+    Raised in a bot process when a forwarded write failed in the writer.
+    """
+
+
+def writer_call(function):
+    """
+    Marks an async function that writes to the databases. In a cluster bot process the call is forwarded to the
+    writer service, otherwise the function runs locally. Arguments and results have to be JSON serializable,
+    iterables are sent as lists.
+    """
+    name = f"{function.__module__}.{function.__name__}"
+    writer_functions[name] = function
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        if client is None:
+            return await function(*args, **kwargs)
+        return await client.call(name, args, kwargs)
+
+    return wrapper
+
+
+def event_handler(event):
+    """
+    Registers an async function that applies an event published by the writer in a bot process.
+    """
+    def register(function):
+        event_handlers[event] = function
+        return function
+
+    return register
+
+
+def publish(event, *args):
+    """
+    Sends an event to every connected bot process. Does nothing outside the writer. Events are sent before the
+    result of the write that caused them, so the calling process has applied them when the write returns.
+    """
+    if not subscribers:
+        return
+    line = encode({'event': event, 'args': args})
+    for writer in list(subscribers):
+        if writer.is_closing():
+            subscribers.discard(writer)
+        else:
+            writer.write(line)
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':'), default=list).encode() + b'\n'
+
+
+async def open_connection(address):
+    if address.startswith('unix:'):
+        return await asyncio.open_unix_connection(address[5:], limit=message_limit)
+    host, port = address.rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port), limit=message_limit)
+
+
+async def start_server(address):
+    if address.startswith('unix:'):
+        return await asyncio.start_unix_server(handle_connection, address[5:], limit=message_limit)
+    host, port = address.rsplit(':', 1)
+    return await asyncio.start_server(handle_connection, host, int(port), limit=message_limit)
+
+
+class WriterClient:
+    """
+    The connection of a bot process to the writer service. Calls are multiplexed by id; events are applied in the
+    order they arrive, before any later result is handed out.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.reader = None
+        self.writer = None
+        self.read_task = None
+        self.pending = dict()  # call id -> future
+        self.next_id = 0
+        self.lock = asyncio.Lock()
+
+    async def connect(self, resync=False):
+        async with self.lock:
+            if self.writer is not None and not self.writer.is_closing():
+                return
+            for attempt in range(reconnect_attempts):
+                try:
+                    self.reader, self.writer = await open_connection(self.address)
+                    break
+                except OSError:
+                    if attempt == reconnect_attempts - 1:
+                        raise
+                    await asyncio.sleep(reconnect_delay_seconds)
+            self.read_task = asyncio.create_task(self.read_loop())
+        if resync and 'resync' in event_handlers:
+            # events published while the connection was down are lost, so the caches are reloaded
+            await event_handlers['resync']()
+
+    async def call(self, name, args, kwargs):
+        if self.writer is None or self.writer.is_closing():
+            await self.connect(resync=True)
+        self.next_id += 1
+        call_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[call_id] = future
+        try:
+            # a call in flight when the writer goes away fails instead of being repeated, it may have been applied
+            self.writer.write(encode({'id': call_id, 'call': name, 'args': args, 'kwargs': kwargs}))
+            await self.writer.drain()
+            return await future
+        finally:
+            self.pending.pop(call_id, None)
+
+    async def read_loop(self):
+        try:
+            while line := await self.reader.readline():
+                message = json.loads(line)
+                if 'event' in message:
+                    try:
+                        await event_handlers[message['event']](*message['args'])
+                    except Exception as e:
+                        print(f"Applying the writer event {message['event']} failed: {e}")
+                    continue
+                future = self.pending.get(message['id'])
+                if future is None or future.done():
+                    continue
+                if 'error' in message:
+                    future.set_exception(WriterError(message['error']))
+                else:
+                    future.set_result(message['result'])
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            print(f"Lost the connection to the writer service: {e}")
+        finally:
+            self.writer.close()
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(WriterError("The writer service closed the connection"))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.read_task is not None:
+            await asyncio.gather(self.read_task, return_exceptions=True)
+
+
+async def connect(address):
+    """
+    Routes the writes of this process to the writer service at the given address.
+
+    :param address: "host:port" or "unix:/path/to/socket".
+    """
+    global client
+    if client is None:
+        client = WriterClient(address)
+    await client.connect()
+
+
+async def handle_connection(reader, writer):
+    subscribers.add(writer)
+    tasks = set()
+    try:
+        while line := await reader.readline():
+            # calls run concurrently, like the commands of a single bot process share its connection
+            task = asyncio.create_task(run_call(json.loads(line), writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        subscribers.discard(writer)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        writer.close()
+
+
+async def run_call(message, writer):
+    start = time.perf_counter()
+    try:
+        result = await writer_functions[message['call']](*message['args'], **message['kwargs'])
+        response = {'id': message['id'], 'result': result}
+    except Exception as e:
+        print(f"Write {message.get('call')} failed: {e}")
+        response = {'id': message['id'], 'error': f"{type(e).__name__}: {e}"}
+    # the write functions are registered unwrapped, so they are timed here
+    metrics.db_seconds.observe(time.perf_counter() - start, message['call'].rsplit('.', 1)[-1])
+    if not writer.is_closing():
+        writer.write(encode(response))
+        await writer.drain()
+
+
+async def run_writer(address):
+    """
+    Runs the writer service: sets up the databases, starts the background tasks that write and serves the
+    bot processes until cancelled.
+
+    :param address: "host:port" or "unix:/path/to/socket".
+    """
+    import db_related
+    import leaderboard_cache
+    from backup_related import start_backup_task
+
+    await db_related.setup_db(wal=True)
+    await metrics.start()
+    start_backup_task()
+    leaderboard_cache.start_save_task(db_related.get_stat_connection)
+    server = await start_server(address)
+    print(f"Writer service listening on {address}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await db_related.close_db()